@@ -0,0 +1,48 @@
+"""
+Throughput of :class:`~vent.controller.batch.ControlModuleBatchSimulator` vs. one
+:class:`~vent.controller.control_module.ControlModuleSimulator` per patient.
+
+Every configuration simulates ``DURATION`` seconds of breathing at the 10 ms loop rate, on virtual time.
+Throughput is reported in simulated patient-seconds per wall-clock second.
+
+    python benchmarks/bench_batch_simulator.py
+"""
+import time
+
+from vent.controller.batch import ControlModuleBatchSimulator
+from vent.controller.control_module import ControlModuleSimulator
+from vent.controller.timing import SteppedClock
+
+N_PATIENTS = (1, 10, 100, 1000, 10000)
+N_SCALAR = (1, 10)   # one-by-one is too slow beyond that
+DURATION = 10        # seconds
+
+
+def run_batch(n):
+    controller = ControlModuleBatchSimulator(n, seed=0)
+    start = time.perf_counter()
+    controller.run_for(DURATION)
+    return time.perf_counter() - start
+
+
+def run_scalar(n):
+    controllers = [ControlModuleSimulator(clock=SteppedClock()) for _ in range(n)]
+    start = time.perf_counter()
+    for controller in controllers:
+        controller.run_for(DURATION)
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{'method':>8} {'patients':>9} {'wall [s]':>9} {'patient-s/s':>12}")
+    for n in N_PATIENTS:
+        runs = [('batch', run_batch)]
+        if n in N_SCALAR:
+            runs.append(('scalar', run_scalar))
+        for name, run in runs:
+            elapsed = run(n)
+            print(f"{name:>8} {n:>9} {elapsed:>9.3f} {n * DURATION / elapsed:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Cost of running the GUI: a :class:`~vent.gui.main.Vent_Gui` on the offscreen Qt platform, fed by a
+:class:`~vent.coordinator.coordinator.CoordinatorLocal` whose controller runs on a
+:class:`~vent.controller.timing.SteppedClock`.
+
+The acquisition thread and the timer of the :class:`~vent.gui.frame.FrameClock` are stopped, and the benchmark drives
+``N_FRAMES`` frames itself, paced at ``FPS``: advance the controller by one frame of virtual time, pass its sensor
+values to :meth:`.Vent_Gui.update_gui` and the samples of its loop to :meth:`.Vent_Gui.update_samples`, render the
+dirty items, and process the paint events that caused.
+The controller is seeded, so every run draws the same values.
+
+Prints one JSON object: for each measured step, its calls and time per frame (mean, median, 95th percentile and
+max, in ms), and the peak RSS of the process, to compare runs with eg. ``jq``.
+
+    python benchmarks/bench_gui.py > before.json
+"""
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import json
+import resource
+import sys
+import time
+
+import numpy as np
+from PySide2 import QtCore, QtWidgets
+
+from vent.controller.control_module import get_control_module
+from vent.controller.timing import SteppedClock
+from vent.coordinator.coordinator import get_coordinator
+from vent.gui import styles
+from vent.gui.frame import FRAME_RATE, get_frame_clock
+from vent.gui.main import Vent_Gui
+from vent.gui.widgets.monitor_value import Monitor_Value
+from vent.gui.widgets.plot import Plot, TimedPlotCurveItem
+
+N_FRAMES = 600
+FPS = FRAME_RATE
+# virtual time the controller runs before the first frame, to be breathing
+WARMUP = 10
+
+# (class, method) timed per frame, by the name they are reported under
+TIMED = {
+    'Plot.update_value': (Plot, 'update_value'),
+    'Plot.extend': (Plot, 'extend'),
+    'Plot._render': (Plot, '_render'),
+    'TimedPlotCurveItem.updateData': (TimedPlotCurveItem, 'updateData'),
+    'Monitor_Value.update_value': (Monitor_Value, 'update_value'),
+    'Monitor_Value.timed_update': (Monitor_Value, 'timed_update'),
+}
+
+
+class Timings:
+    """ Time spent per frame in each measured step """
+
+    def __init__(self):
+        self.frames = []
+        self.calls = {}
+
+    def new_frame(self):
+        self.frames.append({})
+
+    def add(self, name, duration):
+        if not self.frames:
+            # while the GUI is built
+            return
+        frame = self.frames[-1]
+        frame[name] = frame.get(name, 0.) + duration
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return timed_function
+
+    def summary(self) -> dict:
+        summary = {}
+        for name in sorted(self.calls):
+            per_frame = np.array([frame.get(name, 0.) for frame in self.frames]) * 1e3
+            summary[name] = {'calls': self.calls[name],
+                             'mean_ms': float(per_frame.mean()),
+                             'p50_ms': float(np.percentile(per_frame, 50)),
+                             'p95_ms': float(np.percentile(per_frame, 95)),
+                             'max_ms': float(per_frame.max())}
+        return summary
+
+
+class PaintCounter(QtCore.QObject):
+    """ Counts the paint events delivered to all widgets """
+
+    def __init__(self):
+        super(PaintCounter, self).__init__()
+        self.count = 0
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            self.count += 1
+        return False
+
+
+def main():
+    timings = Timings()
+    for name, (cls, method) in TIMED.items():
+        setattr(cls, method, timings.timed(name, getattr(cls, method)))
+
+    app = QtWidgets.QApplication(sys.argv)
+    app.setStyleSheet(styles.GLOBAL)
+    paint_counter = PaintCounter()
+    app.installEventFilter(paint_counter)
+
+    # the warmup ends now, so the samples fall in the time window the plots draw
+    clock = SteppedClock(start=time.time() - WARMUP)
+    coordinator = get_coordinator(single_process=True, sim_mode=True,
+                                  control_module=get_control_module(sim_mode=True, clock=clock, seed=0))
+    coordinator.control_module.run_for(WARMUP)
+
+    gui = Vent_Gui(coordinator, fps=FPS)
+    # frames are driven below instead
+    gui.acquisition.stop(timeout=1)
+    frame_clock = get_frame_clock()
+    frame_clock.stop()
+    gui.show()
+    app.processEvents()
+
+    paints = []
+    sample_count = None
+    frame_start = time.perf_counter()
+    for _ in range(N_FRAMES):
+        timings.new_frame()
+        coordinator.control_module.run_for(1. / FPS)
+        sensors = coordinator.get_sensors()
+
+        start = time.perf_counter()
+        gui.update_gui(sensors)
+        timings.add('update_gui', time.perf_counter() - start)
+
+        samples, sample_count = coordinator.get_samples(since=sample_count)
+        start = time.perf_counter()
+        gui.update_samples(samples.copy())
+        timings.add('update_samples', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        frame_clock._render()
+        timings.add('FrameClock._render', time.perf_counter() - start)
+
+        paint_count = paint_counter.count
+        start = time.perf_counter()
+        app.processEvents()
+        timings.add('paint', time.perf_counter() - start)
+        paints.append(paint_counter.count - paint_count)
+
+        frame_start += 1. / FPS
+        time.sleep(max(frame_start - time.perf_counter(), 0))
+
+    print(json.dumps({
+        'frames': N_FRAMES,
+        'fps': FPS,
+        'timings': timings.summary(),
+        'paint_events_per_frame': float(np.mean(paints)),
+        # kilobytes on linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Import time and memory of the control process.
+
+Each module is imported in a fresh interpreter, several times. The median import time, the
+peak resident memory of the interpreter after the import, and whether PySide2 got loaded are reported.
+The control process (:mod:`vent.coordinator.rpc` -> :mod:`vent.controller.control_module`) shouldn't load any Qt.
+
+    python benchmarks/bench_import_control.py
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = ('vent.common.values',
+           'vent.controller.control_module',
+           'vent.coordinator.rpc',
+           'vent.coordinator.coordinator',
+           'vent.gui.widgets')   # for reference, the GUI side does need Qt
+REPEATS = 5
+
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'time': elapsed,
+                  'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'qt': any(name.startswith('PySide2') for name in sys.modules)}}))
+"""
+
+
+def measure(module):
+    runs = []
+    for _ in range(REPEATS):
+        output = subprocess.run([sys.executable, '-c', CHILD.format(module=module)],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output))
+    return {'time': statistics.median(run['time'] for run in runs),
+            'rss': statistics.median(run['rss'] for run in runs),
+            'qt': runs[0]['qt']}
+
+
+def main():
+    print(f"{'module':>32} {'import [ms]':>12} {'max RSS [MB]':>13} {'PySide2':>8}")
+    for module in MODULES:
+        result = measure(module)
+        print(f"{module:>32} {result['time'] * 1e3:>12.1f} {result['rss'] / 1024:>13.1f} {str(result['qt']):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Latency and throughput of the coordinator transports, XML-RPC + pickle vs. binary messages over a Unix socket.
+
+The simulated controller runs in its own process, as with :class:`~vent.coordinator.coordinator.CoordinatorRemote`,
+and each call of a GUI poll is repeated ``N_CALLS`` times.
+
+    python benchmarks/bench_ipc.py
+"""
+import time
+
+import numpy as np
+
+from vent.common.message import ControlSetting
+from vent.common.values import ValueName
+from vent.coordinator.coordinator import get_coordinator
+
+TRANSPORTS = ('xmlrpc', 'ipc')
+N_CALLS = 2000
+
+
+def connect(transport):
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
+    # returns once the control process listens
+    coordinator.start()
+    return coordinator
+
+
+def main():
+    setting = ControlSetting(ValueName.PIP, 22, 20, 24, time.time())
+    calls = {
+        'get_sensors': lambda c: c.get_sensors(),
+        'get_active_alarms': lambda c: c.get_active_alarms(),
+        'get_control': lambda c: c.get_control(ValueName.PIP),
+        'set_control': lambda c: c.set_control(setting),
+    }
+    print(f"{'transport':>10} {'call':>18} {'mean [us]':>10} {'p50 [us]':>9} {'p99 [us]':>9} {'calls/s':>9}")
+    for transport in TRANSPORTS:
+        coordinator = connect(transport)
+        try:
+            for name, call in calls.items():
+                durations = np.empty(N_CALLS)
+                for i in range(N_CALLS):
+                    start = time.perf_counter()
+                    call(coordinator)
+                    durations[i] = time.perf_counter() - start
+                durations *= 1e6
+                print(f"{transport:>10} {name:>18} {durations.mean():>10.1f} {np.percentile(durations, 50):>9.1f} "
+                      f"{np.percentile(durations, 99):>9.1f} {1e6 / durations.mean():>9.0f}")
+        finally:
+            coordinator.process_manager.stop_process()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Size and time of the binary layouts of :mod:`vent.common.message` vs. pickle, for one message and for a batch.
+
+The pickle baseline is a plain ``__dict__`` object with the same fields, as the messages were before they had a
+binary layout. Pickling a message itself, by its ``__slots__``, is listed as well.
+
+    python benchmarks/bench_message_codecs.py
+"""
+import pickle
+import time
+
+from vent.common.message import SensorValues, ControlSetting, Alarm, AlarmSeverity
+from vent.common.values import ValueName
+
+N_SINGLE = 20000
+N_BATCH = 10000
+
+
+class PlainMessage:
+    # like the messages without __slots__ and without a layout
+    def __init__(self, message):
+        for name in message.__slots__:
+            setattr(self, name, getattr(message, name))
+
+
+def examples():
+    now = time.time()
+    return {
+        'SensorValues': SensorValues(25.5, 5.1, 60, 37, 90, 10.25, 0.5, 17, 1.0, now, 123),
+        'ControlSetting': ControlSetting(ValueName.PEEP, 5, 3, 7, now),
+        'Alarm': Alarm('PIP', True, AlarmSeverity.RED, now, None),
+    }
+
+
+def per_call(function, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        function()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def once(function):
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1e3
+
+
+def main():
+    print('single message')
+    print(f"{'message':>15} {'codec':>14} {'bytes':>6} {'encode [us]':>12} {'decode [us]':>12}")
+    for name, message in examples().items():
+        cls = type(message)
+        plain = PlainMessage(message)
+        data = message.to_bytes()
+        pickled_plain = pickle.dumps(plain)
+        pickled = pickle.dumps(message)
+        for codec, size, encode, decode in (
+                ('pickle (dict)', len(pickled_plain), lambda: pickle.dumps(plain), lambda: pickle.loads(pickled_plain)),
+                ('pickle', len(pickled), lambda: pickle.dumps(message), lambda: pickle.loads(pickled)),
+                ('to_bytes', len(data), message.to_bytes, lambda: cls.from_bytes(data))):
+            print(f"{name:>15} {codec:>14} {size:>6} {per_call(encode, N_SINGLE):>12.2f} {per_call(decode, N_SINGLE):>12.2f}")
+
+    print(f'\nbatch of {N_BATCH}')
+    print(f"{'message':>15} {'codec':>14} {'bytes':>8} {'encode [ms]':>12} {'decode [ms]':>12}")
+    for name, message in examples().items():
+        cls = type(message)
+        batch = [cls.from_bytes(message.to_bytes()) for _ in range(N_BATCH)]
+        plain_batch = [PlainMessage(m) for m in batch]
+        pickled_plain = pickle.dumps(plain_batch)
+        pickled = pickle.dumps(batch)
+        data = cls.encode_batch(batch)
+        for codec, size, encode, decode in (
+                ('pickle (dict)', len(pickled_plain), lambda: pickle.dumps(plain_batch), lambda: pickle.loads(pickled_plain)),
+                ('pickle', len(pickled), lambda: pickle.dumps(batch), lambda: pickle.loads(pickled)),
+                ('encode_batch', len(data), lambda: cls.encode_batch(batch), lambda: cls.decode_batch(data))):
+            print(f"{name:>15} {codec:>14} {size:>8} {once(encode):>12.2f} {once(decode):>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency of the primary GUI's polls while ``N_CLIENTS`` other monitoring clients load the control process.
+
+The GUI client polls ``get_sensors`` at 10 Hz. Each load client, in its own process, repeatedly fetches the
+logged alarms and the full state as fast as it can, and one more client opens a connection and stalls in the
+middle of a request.
+
+    python benchmarks/bench_rpc_load.py
+"""
+import multiprocessing
+import socket
+import time
+
+import numpy as np
+
+from vent.coordinator import ipc, rpc
+from vent.coordinator.coordinator import get_coordinator
+
+TRANSPORTS = ('xmlrpc', 'ipc')
+N_CLIENTS = 50
+N_POLLS = 100
+POLL_PERIOD = 0.1
+
+
+def connect(transport):
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
+    # returns once the control process listens
+    coordinator.start()
+    return coordinator
+
+
+def load_client(transport, stop):
+    client = ipc.IPCClient() if transport == 'ipc' else rpc.RPCClient()
+    while not stop.is_set():
+        client.get_logged_alarms()
+        client.get_state()
+
+
+def stall(transport):
+    if transport == 'ipc':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(ipc.default_path)
+        sock.sendall(ipc.pack_message(ipc.SET_CONTROL, b'\0' * 33)[:10])
+    else:
+        sock = socket.create_connection((rpc.default_addr, rpc.default_port))
+        sock.sendall(b'POST /RPC2 HTTP/1.1\r\nContent-Length: 1000\r\n\r\n<?xml')
+    return sock
+
+
+def poll(coordinator):
+    durations = np.empty(N_POLLS)
+    for i in range(N_POLLS):
+        start = time.perf_counter()
+        coordinator.get_sensors()
+        durations[i] = time.perf_counter() - start
+        time.sleep(POLL_PERIOD)
+    return durations * 1e3
+
+
+def main():
+    print(f"{'transport':>10} {'load clients':>13} {'mean [ms]':>10} {'p50 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9}")
+    for transport in TRANSPORTS:
+        coordinator = connect(transport)
+        try:
+            for n_clients in (0, N_CLIENTS):
+                stop = multiprocessing.Event()
+                clients = [multiprocessing.Process(target=load_client, args=(transport, stop), daemon=True)
+                           for _ in range(n_clients)]
+                for client in clients:
+                    client.start()
+                stalled = stall(transport) if n_clients else None
+                durations = poll(coordinator)
+                stop.set()
+                for client in clients:
+                    client.join()
+                if stalled is not None:
+                    stalled.close()
+                print(f"{transport:>10} {n_clients:>13} {durations.mean():>10.2f} {np.percentile(durations, 50):>9.2f} "
+                      f"{np.percentile(durations, 99):>9.2f} {durations.max():>9.2f}")
+        finally:
+            coordinator.process_manager.stop_process()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Several clients polling the sensor values of the control process faster than it publishes them, each asking for
+all values every time vs. passing the loop counter of the values it has.
+
+Reports the calls per second, the CPU time of the coordinator process per call, and the bytes received per call.
+
+    python benchmarks/bench_sensor_deltas.py
+"""
+import threading
+import time
+
+from vent.common.values import ValueName
+from vent.coordinator.coordinator import get_coordinator
+
+CLIENTS = 4
+POLL_PERIOD = 0.002
+DURATION = 5
+
+
+def connect():
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport='ipc')
+    # returns once the control process listens
+    coordinator.start()
+    return coordinator
+
+
+def count_bytes(client):
+    # the size of every response of the control process
+    received = []
+    call = client._call
+
+    def counted(*args):
+        response = call(*args)
+        received.append(len(response))
+        return response
+
+    client._call = counted
+    return received
+
+
+def poll(coordinator, deltas, calls):
+    sensors = {}
+    end = time.time() + DURATION
+    while time.time() < end:
+        time.sleep(POLL_PERIOD)
+        if deltas and sensors:
+            latest = sensors[ValueName.PRESSURE]
+            sensors.update(coordinator.get_sensors(since_loop_counter=latest.loop_counter,
+                                                   since_timestamp=latest.timestamp))
+        else:
+            sensors = dict(coordinator.get_sensors())
+        calls.append(1)
+
+
+def main():
+    coordinator = connect()
+    received = count_bytes(coordinator.rpc_client)
+    try:
+        print(f"{'mode':>8} {'calls/s':>8} {'CPU/call [us]':>14} {'bytes/call':>11}")
+        for mode, deltas in (('full', False), ('deltas', True)):
+            received.clear()
+            calls = []
+            threads = [threading.Thread(target=poll, args=(coordinator, deltas, calls)) for _ in range(CLIENTS)]
+            cpu = time.process_time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cpu = time.process_time() - cpu
+            print(f"{mode:>8} {len(calls) / DURATION:>8.0f} {cpu / len(calls) * 1e6:>14.1f} "
+                  f"{sum(received) / len(received):>11.1f}")
+    finally:
+        coordinator.process_manager.stop_process()
+
+
+if __name__ == '__main__':
+    main()
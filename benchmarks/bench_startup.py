@@ -0,0 +1,58 @@
+"""
+Time from :func:`~vent.coordinator.coordinator.get_coordinator` to the first valid sensor reading, for each way
+of starting the control process.
+
+Each start method runs in a fresh interpreter, ``N_STARTS`` times. The first start pays for starting the fork
+server, if any, later ones fork from it. Also reported is the time until the control process signalled it was
+ready (``ProcessManager.startup_time``).
+
+    python benchmarks/bench_startup.py
+"""
+import json
+import subprocess
+import sys
+import time
+
+from vent.common.values import ValueName
+
+START_METHODS = ('fork', 'forkserver', 'spawn')
+TRANSPORTS = ('xmlrpc', 'ipc')
+N_STARTS = 5
+
+
+def first_reading(transport):
+    from vent.coordinator.coordinator import get_coordinator
+    start = time.perf_counter()
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport)
+    coordinator.start()
+    while not coordinator.get_sensors()[ValueName.PRESSURE].loop_counter:
+        time.sleep(0.001)
+    first_reading_time = time.perf_counter() - start
+    startup_time = coordinator.process_manager.startup_time
+    coordinator.process_manager.stop_process()
+    return first_reading_time, startup_time
+
+
+def run(start_method, transport):
+    from vent.coordinator import process_manager
+    process_manager.START_METHOD = start_method
+    print(json.dumps([first_reading(transport) for _ in range(N_STARTS)]))
+
+
+def main():
+    print(f"{'method':>11} {'transport':>10} {'first [ms]':>11} {'later [ms]':>11} {'ready [ms]':>11}")
+    for start_method in START_METHODS:
+        for transport in TRANSPORTS:
+            output = subprocess.run([sys.executable, __file__, start_method, transport],
+                                    check=True, capture_output=True, text=True).stdout
+            times = json.loads(output.splitlines()[-1])
+            later = sorted(reading for reading, _ in times[1:])
+            print(f"{start_method:>11} {transport:>10} {times[0][0] * 1e3:>11.1f} {later[len(later) // 2] * 1e3:>11.1f} "
+                  f"{times[-1][1] * 1e3:>11.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        run(*sys.argv[1:])
+    else:
+        main()
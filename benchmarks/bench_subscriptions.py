@@ -0,0 +1,65 @@
+"""
+Staleness of sensor values in the GUI process, polled every ``POLL_PERIOD`` (as ``Vent_Gui.update_period``)
+vs. pushed by a subscription.
+
+Staleness is the time from the controller taking the values (their ``timestamp``) until the GUI process has them.
+
+    python benchmarks/bench_subscriptions.py
+"""
+import threading
+import time
+
+import numpy as np
+
+from vent.common.values import ValueName
+from vent.coordinator.coordinator import get_coordinator
+
+POLL_PERIOD = 0.1
+DURATION = 10
+
+
+def connect():
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport='ipc')
+    # returns once the control process listens
+    coordinator.start()
+    return coordinator
+
+
+def polled(coordinator):
+    staleness = []
+    end = time.time() + DURATION
+    while time.time() < end:
+        time.sleep(POLL_PERIOD)
+        sensors = coordinator.get_sensors()
+        staleness.append(time.time() - sensors[ValueName.PRESSURE].timestamp)
+    return np.array(staleness)
+
+
+def pushed(coordinator):
+    staleness = []
+    lock = threading.Lock()
+
+    def receive(topic, sensor_values):
+        with lock:
+            staleness.append(time.time() - sensor_values.timestamp)
+
+    subscription_id = coordinator.subscribe('sensors', receive)
+    time.sleep(DURATION)
+    coordinator.unsubscribe(subscription_id)
+    return np.array(staleness)
+
+
+def main():
+    coordinator = connect()
+    try:
+        print(f"{'mode':>8} {'updates/s':>10} {'mean [ms]':>10} {'p50 [ms]':>9} {'p99 [ms]':>9}")
+        for mode, measure in (('polled', polled), ('pushed', pushed)):
+            staleness = measure(coordinator) * 1e3
+            print(f"{mode:>8} {len(staleness) / DURATION:>10.1f} {staleness.mean():>10.2f} "
+                  f"{np.percentile(staleness, 50):>9.2f} {np.percentile(staleness, 99):>9.2f}")
+    finally:
+        coordinator.process_manager.stop_process()
+
+
+if __name__ == '__main__':
+    main()
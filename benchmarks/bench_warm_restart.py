@@ -0,0 +1,62 @@
+"""
+How fast the watchdog of :class:`~vent.coordinator.process_manager.ProcessManager` gets a stalled controller
+ticking again.
+
+The control process is stopped with SIGSTOP ``N_STALLS`` times. For each stall the time until the watchdog
+detects it, and the time from the restart until the warm-started process ticks, are reported.
+
+    python benchmarks/bench_warm_restart.py
+"""
+import os
+import signal
+import time
+
+import numpy as np
+
+from vent.common.message import ControlSetting
+from vent.common.values import ValueName
+from vent.coordinator.coordinator import get_coordinator
+
+TRANSPORTS = ("xmlrpc", "ipc")
+MAX_HEARTBEAT_INTERVAL = 0.05  # 5 periods of the control loop
+N_STALLS = 10
+
+
+def connect(transport):
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport=transport,
+                                  max_heartbeat_interval=MAX_HEARTBEAT_INTERVAL)
+    # returns once the control process listens
+    coordinator.start()
+    return coordinator
+
+
+def main():
+    print(f"{'transport':>10} {'detect [ms]':>12} {'restart to tick [ms]':>21} {'max [ms]':>9} {'PIP kept':>9}")
+    for transport in TRANSPORTS:
+        coordinator = connect(transport)
+        process_manager = coordinator.process_manager
+        coordinator.set_control(ControlSetting(ValueName.PIP, 23, 20, 26, time.time()))
+        time.sleep(1)
+        detect = []
+        for _ in range(N_STALLS):
+            n_restarts = len(process_manager.restarts)
+            stalled = time.monotonic()
+            os.kill(process_manager.child_pid, signal.SIGSTOP)
+            while len(process_manager.restarts) == n_restarts:
+                time.sleep(0.001)
+            detect.append(process_manager.restarts[-1][0] - stalled)
+            time.sleep(0.5)
+        restart = np.array([duration for _, duration in process_manager.restarts]) * 1e3
+        detect = np.array(detect) * 1e3
+        for _ in range(10):
+            try:
+                pip = coordinator.get_control(ValueName.PIP).value
+                break
+            except OSError:
+                time.sleep(0.1)
+        print(f"{transport:>10} {detect.mean():>12.1f} {restart.mean():>21.1f} {restart.max():>9.1f} {str(pip == 23):>9}")
+        process_manager.stop_process()
+
+
+if __name__ == '__main__':
+    main()
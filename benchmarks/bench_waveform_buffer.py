@@ -0,0 +1,52 @@
+"""
+Per-tick cost of recording one breath cycle, :class:`~vent.controller.waveform.WaveformBuffer` vs. :func:`numpy.append`.
+
+One slow breath (6 breaths/min, 10 s) is recorded at several control loop rates.
+The mean cost per tick is reported for the first and the last 10% of the breath:
+with a growable buffer both should be about the same, with :func:`numpy.append` the
+cost grows with the number of samples already recorded.
+
+    python benchmarks/bench_waveform_buffer.py
+"""
+import time
+
+import numpy as np
+
+from vent.controller.waveform import WaveformBuffer
+
+LOOP_RATES = (100, 500, 1000)  # Hz
+BREATH_DURATION = 10           # seconds
+
+
+def record_buffer(n_samples):
+    durations = np.empty(n_samples)
+    buffer = WaveformBuffer(capacity=1)
+    for i in range(n_samples):
+        start = time.perf_counter()
+        buffer.append((i, 1., 2.))
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def record_np_append(n_samples):
+    durations = np.empty(n_samples)
+    waveform = np.array([[0, 0, 0]])
+    for i in range(n_samples):
+        start = time.perf_counter()
+        waveform = np.append(waveform, [[i, 1., 2.]], axis=0)
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def main():
+    print(f"{'method':>12} {'rate [Hz]':>10} {'samples':>8} {'first 10% [us]':>15} {'last 10% [us]':>14}")
+    for rate in LOOP_RATES:
+        n_samples = rate * BREATH_DURATION
+        tenth = n_samples // 10
+        for name, record in (('buffer', record_buffer), ('np.append', record_np_append)):
+            durations = record(n_samples) * 1e6
+            print(f"{name:>12} {rate:>10} {n_samples:>8} {durations[:tenth].mean():>15.2f} {durations[-tenth:].mean():>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
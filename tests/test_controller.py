@@ -2,11 +2,20 @@ import time
 import numpy as np
 import pytest
 import random
+import pickle
+import subprocess
+import sys
+import threading
 
 from vent.common.message import SensorValues, ControlSetting, Alarm, AlarmSeverity
-from vent.common.values import ValueName
+from vent.common.sample_ring import SampleRing, shared_memory
+from vent.common.values import CONTROL, ValueName
 from vent.coordinator.coordinator import get_coordinator
+from vent.controller.batch import ControlModuleBatchSimulator
 from vent.controller.control_module import get_control_module
+from vent.controller.publisher import MAX_PENDING, Publisher
+from vent.controller.timing import FixedRateScheduler, Histogram, SteppedClock
+from vent.controller.waveform import BreathAnalyzer, WaveformBuffer
 
 ######################################################################
 #########################   TEST 1  ##################################
@@ -27,7 +36,7 @@ def test_control_settings(control_setting_name):
     This test set_controls and get_controls
     Set and read a all five variables, make sure that they are identical.
     '''
-    Controller = get_control_module(sim_mode=True)
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock())
     Controller.start()
     Controller.stop()
 
@@ -50,15 +59,17 @@ def test_control_settings(control_setting_name):
 def test_restart_controller():
     '''
     This tests whether the controller can be started and stopped 10 times without problems
+    On a SteppedClock the main-loop thread runs as fast as it can, so instead of sleeping, wait for it to have run.
     '''
-    Controller = get_control_module(sim_mode=True)
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock())
 
     for counter in range(10):
-        time.sleep(0.1)
         Controller.start()
         vals_start = Controller.get_sensors()
-        time.sleep(0.2)
-        Controller.stop() 
+        deadline = time.time() + 10
+        while Controller.get_sensors().loop_counter <= vals_start.loop_counter and time.time() < deadline:
+            time.sleep(0.001)
+        Controller.stop()
         vals_stop = Controller.get_sensors()
         assert vals_stop.loop_counter > vals_start.loop_counter
 
@@ -83,8 +94,11 @@ def test_control_dynamical(control_type):
     ''' 
     This tests whether the controller is controlling pressure as intended.
     Start controller, set control values, measure whether actually there.
+    The controller runs on a SteppedClock, in the calling thread, and the settings are drawn from a seeded
+    generator, so every run gives the same result.
     '''
-    Controller = get_control_module(sim_mode=True)
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=0)
+    rng = random.Random(0)
 
     if control_type == "PID":
         Controller.do_pid_control()
@@ -97,30 +111,29 @@ def test_control_dynamical(control_type):
 
     vals_start = Controller.get_sensors()
 
-    v_peep = random.randint(5, 10)
+    v_peep = rng.randint(5, 10)
     command = ControlSetting(name=ValueName.PEEP, value=v_peep, min_value=v_peep-2, max_value=v_peep+2, timestamp=time.time())
     Controller.set_control(command)
 
-    v_pip = random.randint(15, 30)
+    v_pip = rng.randint(15, 30)
     command = ControlSetting(name=ValueName.PIP, value=v_pip, min_value=v_pip-2, max_value=v_pip+2, timestamp=time.time())
     Controller.set_control(command)
 
-    v_bpm = random.randint(6, 20)
+    v_bpm = rng.randint(6, 20)
     command = ControlSetting(name=ValueName.BREATHS_PER_MINUTE, value=v_bpm, min_value=v_bpm-1, max_value=v_bpm+1, timestamp=time.time()) 
 
     Controller.set_control(command)
 
-    v_iphase = (0.3 + np.random.random()*0.5) * 60/v_bpm
+    v_iphase = (0.3 + rng.random()*0.5) * 60/v_bpm
     command = ControlSetting(name=ValueName.INSPIRATION_TIME_SEC, value=v_iphase, min_value=v_iphase - 1, max_value=v_iphase + 1, timestamp=time.time())
     Controller.set_control(command)
 
 
-    Controller.start()
-    time.sleep(0.1)
+    Controller.run_for(0.1)
     vals_start = Controller.get_sensors()
-    time.sleep(30)                                                   # Let this run for half a minute
+    Controller.run_for(30)                                           # Let this run for half a minute
 
-    Controller.stop() # consecutive stops should be ignored
+    Controller.stop() # stops should be ignored when the main-loop thread is not running
     Controller.stop() 
     Controller.stop()
 
@@ -133,17 +146,18 @@ def test_control_dynamical(control_type):
     assert np.abs(vals_stop.inspiration_time_sec - v_iphase)   < Inspiration_CI # Inspiration time   correct within 0.3 sec
 
     # Test whether get_sensors() return the right values
-    COPY_peep     = Controller.COPY_sensor_values.peep
-    COPY_pip      = Controller.COPY_sensor_values.pip
-    COPY_fio2     = Controller.COPY_sensor_values.fio2
-    COPY_temp     = Controller.COPY_sensor_values.temp
-    COPY_humidity = Controller.COPY_sensor_values.humidity
-    COPY_pressure = Controller.COPY_sensor_values.pressure
-    COPY_vte      = Controller.COPY_sensor_values.vte
-    COPY_bpm      = Controller.COPY_sensor_values.breaths_per_minute
-    COPY_Iinsp    = Controller.COPY_sensor_values.inspiration_time_sec
-    COPY_tt       = Controller.COPY_sensor_values.timestamp
-    COPY_lc       = Controller.COPY_sensor_values.loop_counter
+    snapshot      = Controller.get_snapshot()
+    COPY_peep     = snapshot.sensor_values.peep
+    COPY_pip      = snapshot.sensor_values.pip
+    COPY_fio2     = snapshot.sensor_values.fio2
+    COPY_temp     = snapshot.sensor_values.temp
+    COPY_humidity = snapshot.sensor_values.humidity
+    COPY_pressure = snapshot.sensor_values.pressure
+    COPY_vte      = snapshot.sensor_values.vte
+    COPY_bpm      = snapshot.sensor_values.breaths_per_minute
+    COPY_Iinsp    = snapshot.sensor_values.inspiration_time_sec
+    COPY_tt       = snapshot.sensor_values.timestamp
+    COPY_lc       = snapshot.sensor_values.loop_counter
 
     assert COPY_peep     == vals_stop.peep
     assert COPY_pip      == vals_stop.pip
@@ -178,9 +192,8 @@ def test_alarm():
     '''
         This is a function to test the alarm functions. It triggers a series of alarms, that remain active for a while, and then are deactivated.
     '''
-    Controller = get_control_module(sim_mode=True)
-    Controller.start()
-    time.sleep(1)
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock())
+    Controller.run_for(1)
 
     for t in np.arange(0, 30, 0.05):
 
@@ -243,11 +256,9 @@ def test_alarm():
             assert 'I_PHASE' in activealarms.keys()
 
 
-        time.sleep(0.05)
+        Controller.run_for(0.05)
+
 
-    Controller.stop()
-    
-    
     #Check that the duration of the four alarms was correct
     sv = Controller.get_sensors()
     logged_alarms = Controller.get_logged_alarms()
@@ -276,3 +287,485 @@ def test_alarm():
 
     assert len([s for s in waveformlist_1 if s is not None]) > len([s for s in waveformlist_2 if s is not None])   #Test: calling the past_waveforms clears ring buffer.
 
+
+
+
+######################################################################
+#########################   TEST 4  ##################################
+######################################################################
+#
+#   Unit tests for the building blocks of the controller.
+#
+
+def test_waveform_buffer():
+    '''
+    The waveform buffer grows past its initial capacity, and archives its samples without copying.
+    '''
+    buffer = WaveformBuffer(capacity=2)
+    samples = np.random.random((100, 3))
+    for s in samples:
+        buffer.append(s)
+
+    assert len(buffer) == 100
+    assert buffer.capacity >= 100
+    assert np.array_equal(buffer.view(), samples)
+    assert np.array_equal(buffer[-1], samples[-1])
+
+    archived = buffer.archive()
+    assert np.shares_memory(archived, buffer.view())
+    assert not archived.flags.writeable
+
+    next_buffer = buffer.new_like()
+    assert len(next_buffer) == 0
+    assert next_buffer.capacity == buffer.capacity
+
+
+def test_fixed_rate_scheduler():
+    '''
+    The scheduler keeps its rate when the loop does work, and counts deadlines that were overrun.
+    '''
+    period = 0.005
+    scheduler = FixedRateScheduler(period=period)
+    scheduler.start()
+    start = time.monotonic()
+    for i in range(100):
+        scheduler.wait()
+        time.sleep(period / 2)      # Work for half a period, without drifting
+    assert time.monotonic() - start < 100 * period * 1.5
+    assert scheduler.iterations == 100
+
+    scheduler.wait()
+    time.sleep(period * 3.5)        # Overrun three deadlines
+    dt = scheduler.wait()
+    assert dt > period * 3
+    assert scheduler.missed_deadlines >= 3
+
+
+def test_histogram():
+    '''
+    Recorded values land in buckets within ~6% of their value, and percentiles are read off the buckets.
+    '''
+    histogram = Histogram()
+    values = np.arange(1, 10001) * 1000    # 1us .. 10ms
+    for v in values:
+        assert Histogram.bucket_value(Histogram.bucket_index(int(v))) <= v
+        histogram.record(int(v))
+
+    summary = histogram.summary()
+    assert summary['count'] == len(values)
+    assert summary['min'] == 1e-6
+    assert summary['max'] == 1e-2
+    assert np.abs(summary['p50'] - 5e-3) < 5e-3 * 0.07
+    assert np.abs(summary['p99'] - 9.9e-3) < 9.9e-3 * 0.07
+
+
+def test_loop_stats():
+    '''
+    The controller reports the timing of its main loop.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock())
+    Controller.run_for(1)
+
+    stats = Controller.get_loop_stats()
+    assert stats['loop_counter'] == 100
+    assert stats['missed_deadlines'] == 0
+    for stage in ('sensor', 'pid', 'actuate'):
+        assert stats['stages'][stage]['count'] == 100
+    assert stats['stages']['sync']['count'] > 0
+    for stage in ('sensor', 'pid', 'actuate', 'sync'):
+        assert stats['stages'][stage]['max'] < 1
+
+    # The period is measured on the wall clock, whatever clock paces the loop, so it is only the target period
+    # on the real clock: run_for paces 60 iterations in real time.
+    Controller = get_control_module(sim_mode=True)
+    Controller.run_for(0.6)
+    stats = Controller.get_loop_stats()
+    assert stats['period']['count'] > 50
+    assert np.abs(stats['period']['mean'] - Controller._LOOP_UPDATE_TIME) < Controller._LOOP_UPDATE_TIME * 0.5
+
+
+def test_snapshot():
+    '''
+    The controller publishes immutable snapshots, settings are picked up by the main-loop.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock())
+    snapshot = Controller.get_snapshot()
+    with pytest.raises(AttributeError):
+        snapshot.version = 10
+
+    Controller.run_for(0.2)
+    command = ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=time.time())
+    Controller.set_control(command)
+    assert Controller.get_control(ValueName.PIP) is command
+    Controller.run_for(0.3)
+
+    new_snapshot = Controller.get_snapshot()
+    assert new_snapshot is not snapshot
+    assert new_snapshot.version > snapshot.version
+    assert new_snapshot.sensor_values.loop_counter == new_snapshot.version
+    pip = [c for c in new_snapshot.controls if c.name == ValueName.PIP][0]
+    assert pip.value == 25
+    assert pip.max_value == 30
+
+    unpickled = pickle.loads(pickle.dumps(new_snapshot))
+    assert unpickled.version == new_snapshot.version
+    assert len(unpickled.controls) == len(new_snapshot.controls)
+
+
+def test_stepped_clock():
+    '''
+    With a virtual clock, the controller runs faster than real time, and gives the same results on every run.
+    '''
+    def simulate():
+        Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=1)
+        command = ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=0)
+        Controller.set_control(command)
+        Controller.run_for(60)
+        return Controller
+
+    start = time.time()
+    Controller = simulate()
+    assert time.time() - start < 30
+
+    vals = Controller.get_sensors()
+    assert np.abs(vals.timestamp - 60) < 0.2
+    assert np.abs(vals.pip - 25) < 3
+    assert np.abs(vals.breaths_per_minute - CONTROL[ValueName.BREATHS_PER_MINUTE].default) < 3
+
+    waveforms = Controller.get_past_waveforms()
+    waveforms_again = simulate().get_past_waveforms()
+    assert len(waveforms) == len(waveforms_again) > 10
+    for w, w_again in zip(waveforms, waveforms_again):
+        assert np.array_equal(w, w_again)
+    assert Controller.get_sensors().fio2 == simulate().get_sensors().fio2
+
+
+def test_batch_simulator():
+    '''
+    The batched simulator runs patients with different settings and lungs side by side, each reaching its own targets.
+    '''
+    pips = np.array([15, 20, 25, 22])
+    Controller = ControlModuleBatchSimulator(4, pip=pips, peep=5,
+                                             pid_control=[True, True, True, False],
+                                             leak=[True, False, True, True],
+                                             PC=[20, 20, 15, 25], seed=1)
+    Controller.run_for(30)
+
+    vals = Controller.get_sensors()
+    assert vals.pip.shape == (4,)
+    assert np.abs(vals.timestamp - 30) < 0.2
+    assert np.all(np.abs(vals.pip - pips) < 3)
+    assert np.all(np.abs(vals.peep - 5) < 2)
+    assert np.all(np.abs(vals.breaths_per_minute - CONTROL[ValueName.BREATHS_PER_MINUTE].default) < 1)
+    assert np.all(vals.vte > 0)
+    assert np.all(Controller.breath_count > 5)
+
+    # same seed, same noise
+    Controller_again = ControlModuleBatchSimulator(4, pip=pips, peep=5,
+                                                   pid_control=[True, True, True, False],
+                                                   leak=[True, False, True, True],
+                                                   PC=[20, 20, 15, 25], seed=1)
+    Controller_again.run_for(30)
+    assert np.array_equal(Controller_again.get_sensors().fio2, vals.fio2)
+
+
+@pytest.mark.parametrize("pid_control", [True, False])
+def test_batch_matches_controller(pid_control):
+    '''
+    With the same seed and settings, one patient of the batched simulator follows the single-patient controller:
+    same pressure at every step, and PIP, PEEP and PIP_TIME that only differ by how they are estimated.
+    '''
+    settings = {ValueName.PIP: 25, ValueName.PEEP: 8,
+                ValueName.BREATHS_PER_MINUTE: 15, ValueName.INSPIRATION_TIME_SEC: 1.6}
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=4)
+    if not pid_control:
+        Controller.do_state_control()
+    for name, value in settings.items():
+        Controller.set_control(ControlSetting(name=name, value=value, min_value=0, max_value=100, timestamp=0))
+    Batch = ControlModuleBatchSimulator(1, pip=25, peep=8, breaths_per_minute=15, inspiration_time_sec=1.6,
+                                        pid_control=pid_control, seed=4)
+
+    pressure, batch_pressure, control_in, batch_control_in, falling = [], [], [], [], []
+    samples = None
+    for _ in range(3000):
+        Controller.run_for(Controller._LOOP_UPDATE_TIME)
+        Batch.step()
+        pressure.append(Controller.Balloon.current_pressure)
+        batch_pressure.append(Batch.Balloon.current_pressure[0])
+        records, samples = Controller._sample_ring.read(since=samples)
+        control_in.append(records['control_in'][-1])
+        batch_control_in.append(Batch._control_signal_in[0])
+        cycle_phase = Batch.time - Batch._cycle_start[0]
+        falling.append(1.6 < cycle_phase < 1.6 + CONTROL[ValueName.PEEP_TIME].default)
+    assert np.allclose(pressure, batch_pressure, rtol=0, atol=1e-6)
+
+    # both close the inspiratory valve during the fall to PEEP
+    falling = np.array(falling)
+    assert falling.any()
+    assert np.all(np.array(control_in)[falling] == 0)
+    assert np.all(np.array(batch_control_in)[falling] == 0)
+
+    vals, batch_vals = Controller.get_sensors(), Batch.get_sensors()
+    assert vals.fio2 == pytest.approx(batch_vals.fio2[0])
+    # percentiles of the waveform against the maximum and minimum of the breath
+    assert np.abs(batch_vals.pip[0] - vals.pip) < 1
+    assert np.abs(batch_vals.peep[0] - vals.peep) < 1
+    # 90% of the measured PIP against 90% of its setting
+    assert np.abs(Batch.DATA_PIP_TIME[0] - Controller._DATA_PIP_TIME) < 0.05
+    assert np.abs(batch_vals.breaths_per_minute[0] - vals.breaths_per_minute) < 0.1
+
+def test_breath_analyzer():
+    '''
+    The streaming breath analysis agrees with the percentile heuristics computed over whole waveforms.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=2)
+    Controller.run_for(20)
+    waveforms = Controller.get_past_waveforms()
+    assert len(waveforms) > 3
+
+    analyzer = BreathAnalyzer()
+    assert analyzer.analyze() is None
+    for data in waveforms[1:]:
+        analyzer.reset()
+        for phase, pressure, volume in data:
+            analyzer.add(phase, pressure, volume)
+        analysis = analyzer.analyze()
+
+        phase, pressure, volume = data[:, 0], data[:, 1], data[:, 2]
+        pip = np.percentile(pressure[pressure > np.mean(pressure)], 80)
+        peep = np.percentile(pressure[pressure < np.mean(pressure)], 20)
+        assert np.abs(analysis['pip'] - pip) < 2 * analyzer.resolution
+        assert np.abs(analysis['peep'] - peep) < 2 * analyzer.resolution
+        assert np.abs(analysis['pip_time'] - phase[np.min(np.where(pressure > pip * 0.9))]) < 0.05
+        assert np.abs(analysis['i_phase'] - phase[np.max(np.where(pressure > pip * 0.9))]) < 0.05
+        assert analysis['vte'] == np.max(volume) - np.min(volume)
+        assert analysis['bpm'] == 60. / phase[-1]
+
+    # no sample above 90% of a negative PIP: the times are read off the highest pressure instead
+    analyzer.reset()
+    for phase, pressure in enumerate([-10., -5., -4., -12.]):
+        analyzer.add(phase, pressure, 0.)
+    analysis = analyzer.analyze()
+    assert analysis['pip_time'] == 2 and analysis['i_phase'] == 2
+
+    # a failed pressure reading is left out, instead of failing the control thread
+    analyzer.reset()
+    for phase, pressure in enumerate([5., float('nan'), 20., float('inf'), 20., 5.]):
+        analyzer.add(phase, pressure, phase / 10)
+    analysis = analyzer.analyze()
+    assert analyzer.n == 4
+    assert np.abs(analysis['pip'] - 20) < analyzer.resolution
+    assert np.abs(analysis['peep'] - 5) < analyzer.resolution
+    assert analysis['pip_time'] == 2 and analysis['i_phase'] == 4
+    assert analysis['vte'] == 0.5 and analysis['bpm'] == 60. / 5
+
+
+def test_headless_imports():
+    '''
+    The control process never loads Qt: neither the controller, the values nor the rpc server import PySide2.
+    '''
+    code = "import sys; import vent.coordinator.rpc, vent.controller.batch; " \
+           "print(any(name.startswith('PySide2') for name in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    assert output.strip() == 'False'
+
+
+def test_sample_ring():
+    ring = SampleRing(capacity=8)
+    for i in range(5):
+        ring.write(i, 2 * i, 3 * i, 0, 0, 0, 0, i)
+    records, count = ring.read()
+    assert count == 5
+    assert np.array_equal(records['loop_counter'], np.arange(5))
+    assert np.shares_memory(records, ring.records)   # zero-copy
+
+    # the writer laps the reader, it gets the newest records only
+    for i in range(5, 15):
+        ring.write(i, 2 * i, 3 * i, 0, 0, 0, 0, i)
+    records, count = ring.read(since=count)
+    assert count == 15
+    assert np.array_equal(records['loop_counter'], np.arange(7, 15))
+    assert np.array_equal(records['pressure'], 2 * np.arange(7, 15))
+    records, count = ring.read(since=count)
+    assert len(records) == 0 and count == 15
+
+
+@pytest.mark.skipif(shared_memory is None, reason="needs multiprocessing.shared_memory")
+def test_shared_sample_ring():
+    owner = SampleRing.create_shared(capacity=16)
+    try:
+        reader = SampleRing.attach(owner.name)
+        assert reader.capacity == 16
+
+        Controller = get_control_module(sim_mode=True, clock=SteppedClock())
+        Controller.set_sample_ring(owner)
+        Controller.run_for(1)
+
+        records, count = reader.read()
+        assert count == 100
+        assert np.array_equal(records['loop_counter'], np.arange(85, 101))
+        assert np.all(np.diff(records['timestamp']) > 0)
+        reader.close()
+    finally:
+        owner.unlink()
+
+
+def test_get_state():
+    '''
+    get_state returns one consistent snapshot, and afterwards only the sections that changed.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=3)
+    Controller.run_for(10)
+
+    state = Controller.get_state()
+    assert state['version'] == Controller.get_snapshot().version
+    assert state['sensors'].loop_counter == state['version']
+    assert set(state['controls'].keys()) == {ValueName.PIP, ValueName.PIP_TIME, ValueName.PEEP,
+                                             ValueName.BREATHS_PER_MINUTE, ValueName.INSPIRATION_TIME_SEC}
+    assert isinstance(state['active_alarms'], dict)
+    assert isinstance(state['logged_alarms'], list)
+    assert state['loop_stats']['loop_counter'] == 1000
+
+    # nothing new
+    unchanged = Controller.get_state(since_version=state['version'])
+    assert unchanged['version'] == state['version']
+    assert unchanged['sensors'] is None and unchanged['controls'] is None and unchanged['active_alarms'] is None
+
+    # new sensor values, same controls
+    Controller.run_for(0.2)
+    update = Controller.get_state(since_version=state['version'])
+    assert update['version'] > state['version']
+    assert update['sensors'] is not None
+    assert update['controls'] is None
+
+    # new controls
+    Controller.set_control(ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=0))
+    Controller.run_for(0.2)
+    update = Controller.get_state(since_version=update['version'])
+    assert update['controls'][ValueName.PIP].value == 25
+
+    # a version the controller doesn't know, eg. from before a restart, gets everything
+    assert Controller.get_state(since_version=10 ** 9)['controls'] is not None
+
+
+def test_sensor_deltas():
+    '''
+    get_sensors with the loop counter and timestamp of previous sensor values returns nothing, only what changed,
+    or everything.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=3)
+    Controller.run_for(10)
+
+    full = Controller.get_sensors()
+    assert full.changed is None
+    assert Controller.get_sensors(since_loop_counter=full.loop_counter, since_timestamp=full.timestamp) is None
+
+    Controller.run_for(0.2)
+    current = Controller.get_sensors()
+    delta = Controller.get_sensors(since_loop_counter=full.loop_counter, since_timestamp=full.timestamp)
+    assert delta.loop_counter == current.loop_counter
+    assert delta.timestamp == current.timestamp
+    for field in SensorValues.VALUE_FIELDS:
+        if getattr(current, field) == getattr(full, field):
+            assert not delta.is_changed(field)
+            assert getattr(delta, field) is None
+        else:
+            assert delta.is_changed(field)
+            assert getattr(delta, field) == getattr(current, field)
+    assert delta.pressure == current.pressure
+
+    # too old, or from before a restart, gets everything
+    Controller.run_for(10)
+    assert Controller.get_sensors(since_loop_counter=full.loop_counter, since_timestamp=full.timestamp) \
+        is Controller.get_sensors()
+    assert Controller.get_sensors(since_loop_counter=10 ** 9, since_timestamp=full.timestamp) \
+        is Controller.get_sensors()
+
+    # a restarted controller counts its loops from the start again, on a later clock
+    Restarted = get_control_module(sim_mode=True, clock=SteppedClock(start=100), seed=3)
+    Restarted.run_for(10)
+    assert Restarted.get_sensors().loop_counter == full.loop_counter
+    assert Restarted.get_sensors(since_loop_counter=full.loop_counter, since_timestamp=full.timestamp) \
+        is Restarted.get_sensors()
+
+    # a value that changed to None is in the delta, flagged as changed
+    previous = SensorValues(pip=20, peep=5, pressure=10, timestamp=1, loop_counter=1)
+    delta = SensorValues(pip=None, peep=5, pressure=12, timestamp=2, loop_counter=2).delta(previous)
+    assert delta.is_changed('pip') and delta.pip is None
+    assert delta.is_changed('pressure') and delta.pressure == 12
+    assert not delta.is_changed('peep')
+    assert SensorValues.from_bytes(delta.to_bytes()).changed == delta.changed
+
+
+def test_subscriptions():
+    '''
+    Subscribers get the messages of their topic pushed, every decimation-th one, until they unsubscribe.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=4)
+    received = {'sensors': [], 'breath': [], 'controls': []}
+    ids = {topic: Controller.subscribe(topic, lambda topic, msg: received[topic].append(msg),
+                                       decimation=10 if topic == 'sensors' else 1)
+           for topic in received}
+    with pytest.raises(ValueError):
+        Controller.subscribe('nothing', print)
+
+    Controller.set_control(ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=0))
+    Controller.run_for(10)
+    time.sleep(0.5)
+
+    # 1000 iterations, every 10th pushed
+    assert len(received['sensors']) == 100
+    assert all(isinstance(s, SensorValues) for s in received['sensors'])
+    assert [s.loop_counter for s in received['sensors']] == list(range(10, 1001, 10))
+    assert len(received['breath']) >= 1
+    assert all(b['pip'] > b['peep'] for b in received['breath'])
+    assert [c.name for c in received['controls']] == [ValueName.PIP]
+
+    Controller.unsubscribe(ids['sensors'])
+    n_sensors = len(received['sensors'])
+    Controller.run_for(1)
+    time.sleep(0.2)
+    assert len(received['sensors']) == n_sensors
+
+
+def test_publisher_drops():
+    '''
+    Behind a slow callback, messages are dropped and counted instead of queued without bound.
+    '''
+    publisher = Publisher()
+    release = threading.Event()
+    received = []
+
+    def slow(topic, message):
+        release.wait()
+        received.append(message)
+
+    publisher.subscribe('sensors', slow)
+    for i in range(MAX_PENDING + 100):
+        publisher.publish('sensors', i)
+    assert publisher.dropped >= 99
+    release.set()
+    deadline = time.time() + 10
+    while len(received) < MAX_PENDING + 100 - publisher.dropped and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(received) == MAX_PENDING + 100 - publisher.dropped
+    assert received == sorted(received)
+
+
+def test_restore():
+    '''
+    A new controller can be warm-started from the settings and alarms of a previous one.
+    '''
+    Controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=5)
+    pip = ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=0)
+    active = Alarm("PEEP", True, AlarmSeverity.RED, 1., None)
+    logged = Alarm("PIP", False, AlarmSeverity.RED, 0., 1.)
+    Controller.restore(controls=[pip], active_alarms=[active], logged_alarms=[logged])
+
+    assert Controller.get_control(ValueName.PIP).value == 25
+    assert set(Controller.get_active_alarms().keys()) == {"PEEP"}
+    assert Controller.get_logged_alarms()[0].alarm_name == "PIP"
+
+    Controller.run_for(10)
+    assert np.abs(Controller.get_sensors().pip - 25) < 3
+    assert Controller.get_logged_alarms()[0].alarm_name == "PIP"
@@ -1,20 +1,30 @@
 # TODO: this is a unit test, need to add integration test
+import os
+import pickle
 import random
+import signal
 import socket
 import threading
 import time
 from unittest.mock import patch, Mock
 
+import numpy as np
 import pytest
 
 from vent.common import values
 from vent.common.message import ControlSetting, SensorValues, SensorValueNew, Alarm, AlarmSeverity
 from vent.common.values import ValueName
-from vent.controller.control_module import ControlModuleBase
-from vent.coordinator import rpc
+from vent.controller.control_module import ControlModuleBase, get_control_module
+from vent.controller.publisher import TOPICS
+from vent.controller.timing import SteppedClock
+from vent.coordinator import ipc, rpc, subscription
 from vent.coordinator.coordinator import get_coordinator
 
 
+def fields(message):
+    return {name: getattr(message, name) for name in message.__slots__}
+
+
 def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) != 0
@@ -35,7 +45,7 @@ class ControlModuleMock(ControlModuleBase):
     def start(self):
         self._running.set()
 
-    def get_sensors(self):
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None):
         self._running.wait()
         return SensorValues(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 
@@ -59,7 +69,7 @@ def mock_get_control_module(sim_mode):
 
 
 @pytest.mark.parametrize("control_setting_name", values.controllable_values)
-@patch('vent.controller.control_module.get_control_module', mock_get_control_module, Mock())
+@patch('vent.controller.control_module.get_control_module', mock_get_control_module)
 def test_local_coordinator(control_setting_name):
     coordinator = get_coordinator(single_process=True, sim_mode=True)
     coordinator.start()
@@ -84,7 +94,8 @@ def test_local_coordinator(control_setting_name):
 
 
 @pytest.mark.parametrize("control_setting_name", values.controllable_values)
-@patch('vent.controller.control_module.get_control_module', mock_get_control_module, Mock())
+@patch('vent.controller.control_module.get_control_module', mock_get_control_module)
+@patch('vent.coordinator.process_manager.START_METHOD', 'fork')  # the mock only reaches a forked process
 def test_remote_coordinator(control_setting_name):
     # wait before
     while not is_port_in_use(rpc.default_port):
@@ -167,6 +178,35 @@ def test_local_sensors():
         assert isinstance(v, SensorValueNew)
 
 
+def test_local_sensor_deltas():
+    # in virtual time, to control when new sensor values are published
+    coordinator = get_coordinator(single_process=True, sim_mode=True,
+                                  control_module=get_control_module(sim_mode=True, clock=SteppedClock(), seed=3))
+    coordinator.control_module.run_for(10)
+
+    sensor_values = coordinator.get_sensors()
+    loop_counter = sensor_values[ValueName.PRESSURE].loop_counter
+    timestamp = sensor_values[ValueName.PRESSURE].timestamp
+    # built once per loop counter
+    assert coordinator.get_sensors() is sensor_values
+    assert coordinator.get_sensors(since_loop_counter=loop_counter, since_timestamp=timestamp) == {}
+    # the same loop counter, from before a restart
+    assert coordinator.get_sensors(since_loop_counter=loop_counter, since_timestamp=timestamp - 1) is sensor_values
+
+    coordinator.control_module.run_for(0.2)
+    delta = coordinator.get_sensors(since_loop_counter=loop_counter, since_timestamp=timestamp)
+    current = coordinator.get_sensors()
+    assert delta[ValueName.PRESSURE] is current[ValueName.PRESSURE]
+    assert delta[ValueName.PRESSURE].loop_counter > loop_counter
+    assert all(current[name].value != sensor_values[name].value for name in delta)
+    assert all(current[name].value == sensor_values[name].value for name in set(current) - set(delta))
+
+    # a value that changed to None is sent
+    previous = SensorValues(pip=20, pressure=10, timestamp=1, loop_counter=1)
+    changed = coordinator._sensor_cache.sensor_dict(
+        SensorValues(pip=None, pressure=10, timestamp=2, loop_counter=2).delta(previous))
+    assert list(changed) == [ValueName.PIP] and changed[ValueName.PIP].value is None
+
 def test_remote_sensors():
     # wait before
     while not is_port_in_use(rpc.default_port):
@@ -226,3 +266,287 @@ def test_remote_alarms():
         assert isinstance(a, Alarm)
 
     coordinator.process_manager.stop_process()
+
+
+def test_local_loop_stats():
+    coordinator = get_coordinator(single_process=True, sim_mode=True)
+    coordinator.start()
+    while not coordinator.is_running():
+        pass
+    time.sleep(0.5)
+
+    stats = coordinator.get_loop_stats()
+    assert isinstance(stats, dict)
+    assert stats['loop_counter'] > 0
+    assert stats['period']['count'] > 0
+
+    samples, count = coordinator.get_samples()
+    assert len(samples) == count > 0
+
+    state = coordinator.get_state()
+    assert isinstance(state['sensors'][ValueName.PRESSURE], SensorValueNew)
+    assert state['controls'][ValueName.PIP].value == values.CONTROL[ValueName.PIP].default
+    coordinator.stop()
+
+
+def test_remote_loop_stats():
+    # wait before
+    while not is_port_in_use(rpc.default_port):
+        time.sleep(1)
+    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    # TODO need to wait for rpc client start?
+    time.sleep(1)
+    coordinator.start()
+    while not coordinator.is_running():
+        pass
+    time.sleep(0.5)
+
+    stats = coordinator.get_loop_stats()
+    assert isinstance(stats, dict)
+    assert stats['loop_counter'] > 0
+    assert set(stats['stages'].keys()) == {'sensor', 'pid', 'actuate', 'sync'}
+
+    state = coordinator.get_state()
+    assert state['loop_stats']['loop_counter'] > 0
+    assert isinstance(state['sensors'][ValueName.PRESSURE], SensorValueNew)
+    assert coordinator.get_state(since_version=state['version'])['controls'] is None
+
+    coordinator.process_manager.stop_process()
+
+
+def test_ipc_codecs():
+    sensor_values = SensorValues(pip=25.5, peep=None, fio2=60, temp=37, humidity=90, pressure=10.25, vte=0.5,
+                                 breaths_per_minute=17, inspiration_time_sec=None, timestamp=time.time(), loop_counter=123)
+    decoded = ipc.decode_sensor_values(ipc.encode_sensor_values(sensor_values))
+    assert fields(decoded) == fields(sensor_values)
+
+    control_setting = ControlSetting(ValueName.PEEP, 5, 3, 7, time.time())
+    decoded = ipc.decode_control_setting(ipc.encode_control_setting(control_setting))
+    assert fields(decoded) == fields(control_setting)
+    assert ipc.decode_value_name(ipc.encode_value_name(ValueName.INSPIRATION_TIME_SEC)) == ValueName.INSPIRATION_TIME_SEC
+
+    alarms = [Alarm("PIP", True, AlarmSeverity.RED, time.time(), None),
+              Alarm("BREATHS_PER_MINUTE", False, AlarmSeverity.YELLOW, time.time(), time.time())]
+    decoded = ipc.decode_alarms(ipc.encode_alarms(alarms))
+    assert [fields(alarm) for alarm in decoded] == [fields(alarm) for alarm in alarms]
+    assert ipc.decode_alarms(ipc.encode_alarms([])) == []
+
+
+def test_message_layouts():
+    sensor_values = [SensorValues(pip=i, peep=None, fio2=60, temp=37, humidity=90, pressure=i / 3, vte=0.5,
+                                  breaths_per_minute=17, inspiration_time_sec=None, timestamp=time.time(), loop_counter=i)
+                     for i in range(10000)]
+    assert len(sensor_values[0].to_bytes()) == SensorValues.DTYPE.itemsize == 96
+    assert fields(SensorValues.from_bytes(sensor_values[0].to_bytes())) == fields(sensor_values[0])
+    assert fields(pickle.loads(pickle.dumps(sensor_values[1]))) == fields(sensor_values[1])
+    assert fields(SensorValues.from_bytes(SensorValues().to_bytes())) == fields(SensorValues())
+
+    # batches
+    array = SensorValues.to_array(sensor_values)
+    assert np.array_equal(array['loop_counter'], np.arange(10000))
+    assert np.all(np.isnan(array['peep']))
+    decoded = SensorValues.decode_batch(SensorValues.encode_batch(sensor_values))
+    assert [fields(s) for s in decoded] == [fields(s) for s in sensor_values]
+
+    control_settings = [ControlSetting(name, 5, None, 7, time.time()) for name in values.controllable_values]
+    decoded = ControlSetting.decode_batch(ControlSetting.encode_batch(control_settings))
+    assert [fields(c) for c in decoded] == [fields(c) for c in control_settings]
+    assert isinstance(decoded[0].name, ValueName)
+
+    sensor_value = SensorValueNew(ValueName.VTE, 0.5, time.time(), 3)
+    assert fields(pickle.loads(pickle.dumps(sensor_value))) == fields(sensor_value)
+
+    # pickling keeps fields as they are, including those the layout can't hold exactly
+    for message in (SensorValues(pip=20, fio2=float('nan')),
+                    ControlSetting('PIP', 5, 3, 7, time.time()),
+                    SensorValueNew('PIP', 1, 2., None)):
+        unpickled = pickle.loads(pickle.dumps(message))
+        assert type(unpickled) is type(message)
+        assert repr(fields(unpickled)) == repr(fields(message))
+    assert type(pickle.loads(pickle.dumps(SensorValues(pip=20))).pip) is int
+
+    alarm = Alarm("I_PHASE", True, AlarmSeverity.ORANGE, time.time(), None)
+    assert fields(Alarm.from_bytes(alarm.to_bytes())) == fields(alarm)
+    with pytest.raises(ValueError):
+        Alarm("X" * 33, True, AlarmSeverity.RED, 0, None).to_bytes()
+
+
+def test_subscription_errors(tmp_path):
+    path = str(tmp_path / 'subscriptions.sock')
+    controller = get_control_module(sim_mode=True, clock=SteppedClock(), seed=0)
+    subscription.start_subscription_server(controller, path=path)
+    client = subscription.SubscriptionClient(path=path, timeout=1)
+
+    # refused by the client
+    with pytest.raises(ValueError):
+        client.subscribe('sensors', print, decimation=0)
+
+    # and answered with an error by the server, rather than left waiting
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        sock.connect(path)
+        ipc.send_message(sock, subscription.SUBSCRIBE, subscription._SUBSCRIBE_STRUCT.pack(0, 0))
+        opcode, payload = ipc.recv_message(sock)
+        assert opcode == subscription.ERROR
+        assert b'decimation' in payload
+        ipc.send_message(sock, subscription.SUBSCRIBE, subscription._SUBSCRIBE_STRUCT.pack(len(TOPICS), 1))
+        assert ipc.recv_message(sock)[0] == subscription.ERROR
+
+    # events from the first one on
+    received = []
+    client.subscribe('sensors', lambda topic, message: received.append(message))
+    controller.run_for(0.5)
+    start = time.time()
+    while not received and time.time() - start < 2:
+        time.sleep(0.01)
+    assert received[0].loop_counter <= controller._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+
+    # subscribed again on every new connection, without answers piling up that nobody waits for
+    client_subscription, = client._subscriptions.values()
+    for _ in range(3):
+        server_id = client_subscription.server_id
+        client._sock.shutdown(socket.SHUT_RDWR)
+        start = time.time()
+        while client_subscription.server_id in (None, server_id) and time.time() - start < 2:
+            time.sleep(0.01)
+        assert client_subscription.server_id not in (None, server_id)
+    assert client_subscription.answer.empty()
+    client.close()
+
+
+def test_remote_coordinator_ipc():
+    # returns once the control process listens
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport='ipc')
+    coordinator.start()
+    while not coordinator.is_running():
+        pass
+
+    c = ControlSetting(name=ValueName.PIP, value=22, min_value=20, max_value=24, timestamp=time.time())
+    coordinator.set_control(c)
+    c_read = coordinator.get_control(ValueName.PIP)
+    assert fields(c_read) == fields(c)
+
+    time.sleep(0.5)
+    sensor_values = coordinator.get_sensors()
+    for k, v in sensor_values.items():
+        assert isinstance(k, ValueName)
+        assert isinstance(v, SensorValueNew)
+    assert sensor_values[ValueName.PRESSURE].loop_counter > 0
+
+    # only the values that changed since
+    loop_counter = sensor_values[ValueName.PRESSURE].loop_counter
+    time.sleep(0.2)
+    delta = coordinator.get_sensors(since_loop_counter=loop_counter,
+                                    since_timestamp=sensor_values[ValueName.PRESSURE].timestamp)
+    assert delta[ValueName.PRESSURE].loop_counter > loop_counter
+    assert set(delta) <= set(sensor_values)
+    assert coordinator.get_sensors()[ValueName.PRESSURE].value is not None
+
+    assert isinstance(coordinator.get_active_alarms(), dict)
+    assert isinstance(coordinator.get_logged_alarms(), list)
+    assert coordinator.get_loop_stats()['loop_counter'] > 0
+
+    state = coordinator.get_state()
+    assert state['controls'][ValueName.PIP].value == 22
+    assert state['sensors'][ValueName.PRESSURE].loop_counter == state['version']
+    assert coordinator.get_state(since_version=state['version'])['controls'] is None
+
+    # every sample of the control loop, from shared memory
+    samples, count = coordinator.get_samples()
+    assert count > 10
+    assert np.array_equal(samples['loop_counter'], np.arange(samples['loop_counter'][0], count + 1))
+    new_samples, new_count = coordinator.get_samples(since=count)
+    assert new_count >= count
+    assert np.all(new_samples['loop_counter'] > count)
+
+    # pushed from the control process
+    received = []
+    subscription_id = coordinator.subscribe('sensors', lambda topic, msg: received.append(msg), decimation=5)
+    coordinator.set_control(ControlSetting(name=ValueName.PIP, value=23, min_value=20, max_value=25, timestamp=time.time()))
+    time.sleep(0.5)
+    coordinator.unsubscribe(subscription_id)
+    assert len(received) > 5
+    assert all(isinstance(s, SensorValues) for s in received)
+    assert all(b.loop_counter - a.loop_counter == 5 for a, b in zip(received, received[1:]))
+
+    coordinator.stop()
+    while coordinator.is_running():
+        pass
+    coordinator.process_manager.stop_process()
+
+
+@patch('vent.controller.control_module.get_control_module', mock_get_control_module)
+@patch('vent.coordinator.process_manager.START_METHOD', 'fork')  # the mock only reaches a forked process
+def test_remote_concurrent_clients():
+    # a client that stalls in the middle of a request doesn't hold up the others
+    while not is_port_in_use(rpc.default_port):
+        time.sleep(1)
+    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    time.sleep(1)
+    coordinator.start()
+    while not coordinator.is_running():
+        pass
+
+    stalled = socket.create_connection(('localhost', rpc.default_port))
+    stalled.sendall(b'POST /RPC2 HTTP/1.1\r\nContent-Length: 1000\r\n\r\n<?xml')
+
+    results = []
+    def call():
+        client = rpc.RPCClient(timeout=2)
+        results.append(client.get_control(ValueName.PIP).name)
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - start < 2
+    assert results == [ValueName.PIP] * 10
+
+    stalled.close()
+    coordinator.process_manager.stop_process()
+
+
+def test_remote_watchdog():
+    # a stalled control process is restarted with the settings and alarms of the previous one
+    coordinator = get_coordinator(single_process=False, sim_mode=True, transport='ipc', max_heartbeat_interval=0.2)
+    coordinator.start()
+    c = ControlSetting(name=ValueName.PIP, value=23, min_value=20, max_value=26, timestamp=time.time())
+    coordinator.set_control(c)
+    received = []
+    coordinator.subscribe('sensors', lambda topic, message: received.append(message))
+    time.sleep(1)
+    assert received
+    process_manager = coordinator.process_manager
+    pid = process_manager.child_pid
+
+    os.kill(pid, signal.SIGSTOP)
+    start = time.time()
+    while not process_manager.restarts and time.time() - start < 5:
+        time.sleep(0.05)
+    assert process_manager.child_pid != pid
+    assert len(process_manager.restarts) == 1
+    _, restart_to_tick = process_manager.restarts[0]
+    assert restart_to_tick < 2
+
+    # calls on the broken connection connect to the new process
+    assert coordinator.is_running()
+    assert fields(coordinator.get_control(ValueName.PIP)) == fields(c)
+    count = coordinator.sample_ring.write_count
+    time.sleep(0.2)
+    assert coordinator.sample_ring.write_count > count
+
+    # a process that died is restarted as well
+    os.kill(process_manager.child_pid, signal.SIGKILL)
+    start = time.time()
+    while len(process_manager.restarts) < 2 and time.time() - start < 5:
+        time.sleep(0.05)
+    assert len(process_manager.restarts) == 2
+    assert fields(coordinator.get_control(ValueName.PIP)) == fields(c)
+
+    # and subscriptions resume, from the new process
+    received.clear()
+    time.sleep(0.5)
+    assert received
+
+    process_manager.stop_process()
@@ -0,0 +1,233 @@
+import os
+# no display needed, eg. on CI
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import time
+
+import numpy as np
+from PySide2 import QtCore, QtWidgets
+
+from vent.common.message import SensorValueNew
+from vent.common.values import Value, ValueName
+from vent.controller.control_module import get_control_module
+from vent.controller.timing import SteppedClock
+from vent.coordinator.coordinator import get_coordinator
+from vent.gui.acquisition import Acquisition
+from vent.gui.frame import FrameClock
+from vent.gui.history import History, Ring
+
+
+def test_ring():
+    ring = Ring(8, 2)
+    for i in range(5):
+        ring.append((i, 10 * i))
+    assert len(ring) == 5
+    assert np.array_equal(ring.since(2.5)[:, 1], [30, 40])
+
+    # overwrites the oldest rows, and still finds rows in both runs
+    for i in range(5, 20):
+        ring.append((i, 10 * i))
+    assert len(ring) == 8
+    assert np.array_equal(ring.chronological()[:, 0], np.arange(12, 20))
+    for start in (5, 12, 13.5, 16, 18, 19, 25):
+        expected = np.arange(12, 20)[np.arange(12, 20) > start]
+        assert np.array_equal(ring.since(start)[:, 0], expected)
+        assert ring.count_since(start) == len(expected)
+    assert ring.covers(12) and not ring.covers(11.5)
+
+
+def test_plot_history():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    from vent.gui.widgets.plot import Plot
+
+    plot = Plot('Pressure', buffer_size=8, plot_duration=5)
+    now = time.time()
+    for i in range(12):
+        plot.update_value((now - 5.5 + i * 0.5, None if i == 10 else i))
+
+    # the last buffer_size values, oldest first, None as NaN, in copies
+    assert np.allclose(plot.timestamps, now - 5.5 + np.arange(4, 12) * 0.5)
+    assert np.array_equal(plot.history, [4, 5, 6, 7, 8, 9, np.nan, 11], equal_nan=True)
+    plot.history[:] = 0
+    assert plot.history[0] == 4
+
+    # the plot wrapped around 2.25 s ago: values from before are drawn on the right, newer ones from the left
+    plot._start_time = now - 7.25
+    plot._render()
+    early_timestamps, early_values = plot.early_curve.getData()
+    late_timestamps, late_values = plot.late_curve.getData()
+    assert np.all(early_timestamps > 2.2) and np.all(late_timestamps < 2.3)
+    assert np.nanmax(early_values) < np.nanmin(late_values)
+    # values older than plot_duration are not drawn
+    assert np.nanmin(early_values) >= 1
+
+def test_history_pyramids():
+    history = History(raw_size=8, bin_width=1., factor=2, n_tiers=3, tier_size=100)
+    for i in range(40):
+        history.append(i * 0.5, i)
+
+    # bins of 1 s hold two samples, bins of 2 s four
+    assert np.array_equal(history.tiers[0].chronological()[:3], [[0, 0, 1, 0.5], [1, 2, 3, 2.5], [2, 4, 5, 4.5]])
+    assert np.array_equal(history.tiers[1].chronological()[:2], [[0, 0, 3, 1.5], [2, 4, 7, 5.5]])
+
+    # recent enough for the samples themselves
+    timestamps, values = history.window(17, 10)
+    assert np.array_equal(values, [35, 36, 37, 38, 39])
+
+    # otherwise min/max of bins, merged to fit into max_points
+    timestamps, values = history.window(-1, 10)
+    assert len(timestamps) <= 10
+    assert np.all(np.diff(timestamps) > 0)
+    assert values.min() == 0 and values.max() == 39
+
+    # means
+    timestamps, values = history.window(14.5, 100, envelope=False)
+    assert np.array_equal(timestamps, [15, 16, 17, 18, 19])
+    assert np.array_equal(values, [30.5, 32.5, 34.5, 36.5, 38.5])
+
+
+def test_history_long_window():
+    # an hour of samples at 100 Hz draws in as many points as a few seconds
+    history = History()
+    timestamps = np.arange(0, 3600, 0.01)
+    for timestamp in timestamps:
+        history.append(timestamp, np.sin(timestamp))
+    for duration in (5, 60, 900, 3600):
+        plot_timestamps, values = history.window(timestamps[-1] - duration, 2000)
+        assert len(plot_timestamps) <= 2000
+        assert plot_timestamps[0] >= timestamps[-1] - duration
+        assert plot_timestamps[0] < timestamps[-1] - 0.95 * duration
+        assert values.min() < -0.99 and values.max() > 0.99
+
+
+def test_history_extend():
+    # batches give the same history as appending sample by sample
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.uniform(0.001, 0.03, 3000))
+    values = rng.normal(size=3000)
+    values[rng.random(3000) < 0.05] = np.nan
+
+    appended = History(raw_size=50, bin_width=0.05, factor=4, n_tiers=4, tier_size=64)
+    for timestamp, value in zip(timestamps, values):
+        appended.append(timestamp, value)
+    extended = History(raw_size=50, bin_width=0.05, factor=4, n_tiers=4, tier_size=64)
+    start = 0
+    for size in rng.integers(0, 200, 100):
+        extended.extend(timestamps[start:start + size], values[start:start + size])
+        start += size
+    extended.extend(timestamps[start:], values[start:])
+
+    assert np.array_equal(appended.raw.chronological(), extended.raw.chronological(), equal_nan=True)
+    for appended_tier, extended_tier in zip(appended.tiers, extended.tiers):
+        assert np.allclose(appended_tier.chronological(), extended_tier.chronological())
+    assert np.allclose(appended._open, extended._open)
+
+
+class SlowCoordinator:
+    """ Answers every call to get_sensors after ``delay`` seconds, with a new pressure value """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.loop_counter = 0
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None):
+        time.sleep(self.delay)
+        self.loop_counter += 1
+        return {ValueName.PRESSURE: SensorValueNew(ValueName.PRESSURE, 10., time.time(), self.loop_counter)}
+
+    def get_samples(self, since=None):
+        raise NotImplementedError
+
+    def set_control(self, control_setting):
+        pass
+
+
+def test_acquisition_thread():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    # calls to the coordinator take longer than the update period
+    acquisition = Acquisition(SlowCoordinator(delay=0.3), update_period=0.05)
+    assert not acquisition.samples_supported
+    received = []
+    acquisition.sensors_updated.connect(received.append)
+
+    acquisition.start()
+    end = time.time() + 5
+    while not received and time.time() < end:
+        # sensor values come back as queued signals
+        app.processEvents(QtCore.QEventLoop.AllEvents, 50)
+    assert received[0][ValueName.PRESSURE].value == 10.
+
+    # waits for the call in flight
+    assert acquisition.stop()
+    assert acquisition.acquisition_thread.isFinished()
+
+
+def test_acquisition_samples():
+    coordinator = get_coordinator(single_process=True, sim_mode=True,
+                                  control_module=get_control_module(sim_mode=True, clock=SteppedClock(), seed=0))
+    coordinator.control_module.run_for(1)
+
+    acquisition = Acquisition(coordinator)
+    assert acquisition.samples_supported
+    batches = []
+    acquisition.samples_updated.connect(batches.append)
+
+    # every iteration of the control loop, in batches since the last poll
+    acquisition.poll()
+    coordinator.control_module.run_for(0.5)
+    acquisition.poll()
+    acquisition.poll()
+    assert len(batches) == 2
+    loop_counters = np.concatenate([batch['loop_counter'] for batch in batches])
+    assert np.array_equal(loop_counters, np.arange(loop_counters[0], loop_counters[0] + len(loop_counters)))
+    assert len(batches[1]) == 50
+
+
+def test_frame_clock():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    clock = FrameClock(fps=50)
+    assert clock.timer.interval() == 20
+
+    rendered = []
+    frames = []
+    clock.frame.connect(frames.append)
+
+    def plot():
+        rendered.append('plot')
+        # marked while rendering, still drawn in this frame
+        clock.mark_dirty(curve)
+
+    def curve():
+        rendered.append('curve')
+
+    # only items marked since the last frame are drawn, once however often they were marked
+    for _ in range(5):
+        clock.mark_dirty(plot)
+    clock._render()
+    clock._render()
+    assert rendered == ['plot', 'curve']
+    assert len(frames) == 2
+
+
+def test_monitor_value_transitions():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    from vent.gui.widgets import Monitor_Value
+
+    monitor = Monitor_Value(Value(name='Pressure', units='cmH2O', abs_range=(0, 100), safe_range=(20, 80),
+                                  decimals=1))
+    # nothing to draw before the first value
+    monitor.update_value(None)
+    monitor.timed_update()
+
+    texts, style_sheets = [], []
+    set_text, set_style_sheet = monitor.value_label.setText, monitor.value_label.setStyleSheet
+    monitor.value_label.setText = lambda text: (texts.append(text), set_text(text))
+    monitor.value_label.setStyleSheet = lambda style: (style_sheets.append(style), set_style_sheet(style))
+
+    # the label is only touched when the rounded value, or whether it is out of the limits, changes
+    for value in (50.01, 50.02, 50.04, 50.4, 90, 95, 50.01):
+        monitor.update_value(value)
+        monitor.timed_update()
+    assert texts == ['50.0', '50.4', '90', '95', '50.0']
+    assert len(style_sheets) == 2
+    assert not monitor.range_slider.alarm
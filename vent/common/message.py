@@ -1,8 +1,215 @@
+"""
+Messages passed between the controller, the coordinator and the GUI.
+
+Messages have ``__slots__``, and a fixed binary layout, given by their :data:`DTYPE` (a packed, little-endian
+:class:`numpy.dtype`): :meth:`to_bytes` / :meth:`from_bytes` for one message, :meth:`encode_batch` /
+:meth:`decode_batch` for many at once, whose bytes are an array of records, as sent by the IPC transport.
+Pickling a message doesn't use its layout, and keeps its fields exactly as they are.
+
+In the layout, None is stored as NaN (-1 for loop counters), enums as their value (uint8), and alarm names as
+up to :data:`ALARM_NAME_SIZE` bytes of utf-8.
+"""
+import operator
+import struct
 from enum import Enum, auto
 
+import numpy as np
+
+from vent.common.values import ValueName
+
+
+ALARM_NAME_SIZE = 32
+"""
+Maximum length of an alarm name in the binary layout, in bytes of utf-8.
+"""
+
+
+class _Float:
+    # None <-> NaN
+    format = 'd'
+    dtype = '<f8'
+
+    @staticmethod
+    def encode(value):
+        return np.nan if value is None else value
+
+    @staticmethod
+    def decode(value):
+        return None if value != value else value
+
+    @staticmethod
+    def encode_column(values):
+        # numpy converts None to NaN by itself
+        return np.array(values, dtype=np.float64)
+
+    @staticmethod
+    def decode_column(column):
+        values = column.astype(object)
+        values[np.isnan(column)] = None
+        return values
+
+
+class _Counter:
+    # None <-> -1
+    format = 'q'
+    dtype = '<i8'
+
+    @staticmethod
+    def encode(value):
+        return -1 if value is None else value
+
+    @staticmethod
+    def decode(value):
+        return None if value == -1 else value
+
+    @staticmethod
+    def encode_column(values):
+        return np.array([-1 if value is None else value for value in values], dtype=np.int64)
+
+    @staticmethod
+    def decode_column(column):
+        values = column.astype(object)
+        values[column == -1] = None
+        return values
+
+
+class _Bool:
+    format = '?'
+    dtype = '?'
+
+    encode = staticmethod(bool)
+    decode = staticmethod(bool)
+
+    @staticmethod
+    def encode_column(values):
+        return np.array(values, dtype=bool)
+
+    @staticmethod
+    def decode_column(column):
+        return column.tolist()
+
+
+class _Name:
+    # str <-> fixed-size utf-8
+    format = f'{ALARM_NAME_SIZE}s'
+    dtype = f'S{ALARM_NAME_SIZE}'
+
+    @staticmethod
+    def encode(value):
+        encoded = value.encode('utf-8')
+        if len(encoded) > ALARM_NAME_SIZE:
+            raise ValueError(f'{value} is longer than {ALARM_NAME_SIZE} bytes')
+        return encoded
+
+    @staticmethod
+    def decode(value):
+        return value.rstrip(b'\0').decode('utf-8')
+
+    @classmethod
+    def encode_column(cls, values):
+        return np.array([cls.encode(value) for value in values], dtype=cls.dtype)
+
+    @staticmethod
+    def decode_column(column):
+        return np.char.decode(column, 'utf-8').tolist()
+
+
+class _EnumKind:
+    # member <-> value
+    format = 'B'
+    dtype = 'u1'
+
+    def __init__(self, enum):
+        self.enum = enum
+        self.members = np.empty(max(member.value for member in enum) + 1, dtype=object)
+        for member in enum:
+            self.members[member.value] = member
+
+    def encode(self, value):
+        return value.value
 
+    def decode(self, value):
+        return self.enum(value)
+
+    def encode_column(self, values):
+        return np.array([value.value for value in values], dtype=np.uint8)
+
+    def decode_column(self, column):
+        return self.members[column]
+
+
+class _Message:
+    """
+    Base of the messages with a binary layout.
+
+    Subclasses list their fields in ``_LAYOUT``, as (attribute, kind) in the order of the arguments of their
+    ``__init__``, and get :data:`DTYPE` and the codecs from it.
+    """
+    __slots__ = ()
+    _LAYOUT = ()
+
+    DTYPE = None
+    """
+    :class:`numpy.dtype` of one record of the binary layout
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.DTYPE = np.dtype([(name, kind.dtype) for name, kind in cls._LAYOUT])
+        cls._STRUCT = struct.Struct('<' + ''.join(kind.format for _, kind in cls._LAYOUT))
+        cls._GET_FIELDS = operator.attrgetter(*[name for name, _ in cls._LAYOUT])
+        # most fields are floats, only the others need their own conversion
+        cls._OTHER_FIELDS = tuple((i, kind) for i, (_, kind) in enumerate(cls._LAYOUT) if kind is not _Float)
+
+    def to_bytes(self) -> bytes:
+        fields = self._GET_FIELDS(self)
+        values = [np.nan if value is None else value for value in fields]
+        for i, kind in self._OTHER_FIELDS:
+            values[i] = kind.encode(fields[i])
+        return self._STRUCT.pack(*values)
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = cls._STRUCT.unpack(data)
+        fields = [None if value != value else value for value in values]
+        for i, kind in cls._OTHER_FIELDS:
+            fields[i] = kind.decode(values[i])
+        return cls(*fields)
+
+    @classmethod
+    def to_array(cls, messages) -> np.ndarray:
+        """
+        Records of ``messages``, a :class:`numpy.ndarray` of :data:`DTYPE`, converted a field at a time
+        """
+        array = np.empty(len(messages), dtype=cls.DTYPE)
+        for name, kind in cls._LAYOUT:
+            array[name] = kind.encode_column([getattr(message, name) for message in messages])
+        return array
+
+    @classmethod
+    def from_array(cls, array) -> list:
+        """
+        Messages from records made by :meth:`.to_array`, converted a field at a time
+        """
+        columns = [kind.decode_column(array[name]) for name, kind in cls._LAYOUT]
+        return [cls(*fields) for fields in zip(*columns)]
+
+    @classmethod
+    def encode_batch(cls, messages) -> bytes:
+        return cls.to_array(messages).tobytes()
+
+    @classmethod
+    def decode_batch(cls, data) -> list:
+        return cls.from_array(np.frombuffer(data, dtype=cls.DTYPE))
+
+
+class SensorValueNew(_Message):
+    __slots__ = ('name', 'value', 'timestamp', 'loop_counter')
+    _LAYOUT = (('name', _EnumKind(ValueName)),
+               ('value', _Float),
+               ('timestamp', _Float),
+               ('loop_counter', _Counter))
 
-class SensorValueNew:
     def __init__(self, name, value, timestamp, loop_counter):
         self.name = name
         self.value = value
@@ -10,9 +217,22 @@ class SensorValueNew:
         self.loop_counter = loop_counter
 
 
-class SensorValues:
+class SensorValues(_Message):
+    __slots__ = ('pip', 'peep', 'fio2', 'temp', 'humidity', 'pressure', 'vte', 'breaths_per_minute',
+                 'inspiration_time_sec', 'timestamp', 'loop_counter', 'changed')
+    _LAYOUT = tuple((name, _Float) for name in __slots__[:-2]) + (('loop_counter', _Counter), ('changed', _Counter))
+
+    VALUE_FIELDS = __slots__[:-3]
+    """
+    The sensor values, in the order of the bits of :attr:`changed`
+    """
+
     def __init__(self, pip=None, peep=None, fio2=None, temp=None, humidity=None, pressure=None, vte=None, breaths_per_minute=None,
-                 inspiration_time_sec=None, timestamp=None, loop_counter = None):
+                 inspiration_time_sec=None, timestamp=None, loop_counter = None, changed=None):
+        """
+        Args:
+            changed (int): for a delta, bit mask of the :data:`VALUE_FIELDS` it holds, None if it holds all of them
+        """
         self.pip = pip
         self.peep = peep
         self.fio2 = fio2
@@ -24,11 +244,39 @@ class SensorValues:
         self.inspiration_time_sec = inspiration_time_sec
         self.timestamp = timestamp
         self.loop_counter = loop_counter
+        self.changed = changed
+
+    def delta(self, previous) -> 'SensorValues':
+        """
+        The values that changed since ``previous``, flagged in :attr:`changed`, with the timestamp and loop counter
+        of these values. The others are None, see :meth:`.is_changed`.
+        """
+        values = []
+        changed = 0
+        for i, (value, old) in enumerate(zip(self._GET_FIELDS(self)[:-3], previous._GET_FIELDS(previous)[:-3])):
+            if value != old:
+                changed |= 1 << i
+                values.append(value)
+            else:
+                values.append(None)
+        return SensorValues(*values, timestamp=self.timestamp, loop_counter=self.loop_counter, changed=changed)
 
+    def is_changed(self, field) -> bool:
+        """
+        Whether ``field``, one of :data:`VALUE_FIELDS`, is held by these values: always for full sensor values,
+        for a delta only if it changed, even if it changed to None.
+        """
+        return self.changed is None or bool(self.changed >> self.VALUE_FIELDS.index(field) & 1)
 
 
+class ControlSetting(_Message):
+    __slots__ = ('name', 'value', 'min_value', 'max_value', 'timestamp')
+    _LAYOUT = (('name', _EnumKind(ValueName)),
+               ('value', _Float),
+               ('min_value', _Float),
+               ('max_value', _Float),
+               ('timestamp', _Float))
 
-class ControlSetting:
     def __init__(self, name, value, min_value, max_value, timestamp):
         """
         TODO: if enum is hard to use, we may just use a predefined set, e.g. {'PIP', 'PEEP', ...}
@@ -51,7 +299,14 @@ class AlarmSeverity(Enum):
     YELLOW = auto()
 
 
-class Alarm:
+class Alarm(_Message):
+    __slots__ = ('alarm_name', 'is_active', 'severity', 'alarm_start_time', 'alarm_end_time')
+    _LAYOUT = (('alarm_name', _Name),
+               ('is_active', _Bool),
+               ('severity', _EnumKind(AlarmSeverity)),
+               ('alarm_start_time', _Float),
+               ('alarm_end_time', _Float))
+
     def __init__(self, alarm_name, is_active, severity, alarm_start_time, alarm_end_time):
         """
         :param alarm_name:
@@ -68,9 +323,9 @@ class Alarm:
 
 
 class Error:
+    __slots__ = ('errnum', 'err_str', 'timestamp')
+
     def __init__(self, errnum, err_str, timestamp):
         self.errnum = errnum
         self.err_str = err_str
         self.timestamp = timestamp
-
-
@@ -0,0 +1,162 @@
+"""
+Ring buffer of the samples of every control loop iteration, which can be shared between processes.
+
+The control loop is the single writer, any number of readers can read without locks, and without copying.
+"""
+import os
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, rings can only be used within one process
+    shared_memory = None
+
+
+SAMPLE_DTYPE = np.dtype([('timestamp', 'f8'),
+                         ('pressure', 'f8'),
+                         ('volume', 'f8'),
+                         ('Qin', 'f8'),
+                         ('Qout', 'f8'),
+                         ('control_in', 'f8'),
+                         ('control_out', 'f8'),
+                         ('loop_counter', 'i8')])
+"""
+Layout of one sample record.
+"""
+
+# Header of the ring: number of records ever written, capacity, record size
+_HEADER_FIELDS = 3
+_HEADER_SIZE = _HEADER_FIELDS * 8
+
+
+class SampleRing:
+    """
+    Single-producer/multi-consumer ring of :data:`SAMPLE_DTYPE` records.
+
+    The writer stores a record, and then increments the write counter in the header, readers only read records below
+    the counter. If the writer laps a reader, the overwritten records are dropped from what the reader gets.
+
+    A ring is either private to the process (``SampleRing(capacity)``), or lives in a
+    :class:`multiprocessing.shared_memory.SharedMemory` segment (:meth:`.create_shared` by the owner, who unlinks it,
+    and :meth:`.attach` by name in the other processes).
+    """
+
+    def __init__(self, capacity=8192, _buffer=None):
+        """
+        Args:
+            capacity (int): Number of records kept
+        """
+        if _buffer is None:
+            _buffer = bytearray(_HEADER_SIZE + capacity * SAMPLE_DTYPE.itemsize)
+        self._shm = None
+        self._owner_pid = None
+        self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=_buffer)
+        if self._header[1] == 0:
+            self._header[1] = capacity
+            self._header[2] = SAMPLE_DTYPE.itemsize
+        elif self._header[2] != SAMPLE_DTYPE.itemsize:
+            raise ValueError(f'Record size of the ring is {self._header[2]}, expected {SAMPLE_DTYPE.itemsize}')
+        self.capacity = int(self._header[1])
+        self.records = np.ndarray((self.capacity,), dtype=SAMPLE_DTYPE, buffer=_buffer, offset=_HEADER_SIZE)
+
+    @classmethod
+    def create_shared(cls, capacity=8192, name=None):
+        """
+        Create a ring in a new shared memory segment. The caller owns the segment, and must :meth:`.unlink` it.
+
+        Args:
+            capacity (int): Number of records kept
+            name (str): Name of the segment, chosen by the system if None
+        """
+        if shared_memory is None:
+            raise NotImplementedError('Shared rings need multiprocessing.shared_memory, Python 3.8+')
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_SIZE + capacity * SAMPLE_DTYPE.itemsize)
+        shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        ring = cls(capacity, _buffer=shm.buf)
+        ring._shm = shm
+        ring._owner_pid = os.getpid()
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a ring created with :meth:`.create_shared`, in this or another process.
+        """
+        if shared_memory is None:
+            raise NotImplementedError('Shared rings need multiprocessing.shared_memory, Python 3.8+')
+        shm = shared_memory.SharedMemory(name=name)
+        ring = cls(_buffer=shm.buf)
+        ring._shm = shm
+        return ring
+
+    @property
+    def name(self):
+        """ Name of the shared memory segment, None for private rings """
+        return None if self._shm is None else self._shm.name
+
+    @property
+    def write_count(self) -> int:
+        """ Number of records written since the ring was created """
+        return int(self._header[0])
+
+    def write(self, timestamp, pressure, volume, Qin, Qout, control_in, control_out, loop_counter):
+        count = self._header[0]
+        self.records[count % self.capacity] = (timestamp, pressure, volume, Qin, Qout, control_in, control_out, loop_counter)
+        self._header[0] = count + 1
+
+    def read(self, since=None):
+        """
+        Records written since the write count ``since``.
+
+        If they are contiguous in the ring, they are returned as a view, without copying. The view is only valid
+        until the writer wraps around to it again (``capacity`` ticks later), copy the records to keep them longer.
+
+        Args:
+            since (int): :attr:`.write_count` returned by a previous call, None for all records in the ring
+
+        Returns:
+            tuple: (records (:class:`numpy.ndarray` of :data:`SAMPLE_DTYPE`), write count to pass as ``since`` next time)
+        """
+        count = int(self._header[0])
+        oldest = max(count - self.capacity, 0)
+        if since is None or since < oldest:
+            since = oldest
+        n = count - since
+        if n <= 0:
+            return self.records[:0], count
+
+        start = since % self.capacity
+        if start + n <= self.capacity:
+            records = self.records[start:start + n]
+        else:
+            records = np.concatenate((self.records[start:], self.records[:start + n - self.capacity]))
+
+        # drop what the writer may have overwritten while we were reading
+        overwritten = int(self._header[0]) - self.capacity - since
+        if overwritten > 0:
+            records = records[overwritten:]
+        return records, count
+
+    def close(self):
+        """ Detach from the shared memory segment """
+        if self._shm is not None:
+            self.records = None
+            self._header = None
+            try:
+                self._shm.close()
+            except BufferError:
+                # records returned by read() are still alive, the mapping goes away with them
+                pass
+
+    def unlink(self):
+        """
+        Detach and destroy the shared memory segment, by its owner.
+        In processes forked from the owner, the segment is only detached.
+        """
+        if self._shm is not None:
+            self.close()
+            if os.getpid() == self._owner_pid:
+                self._shm.unlink()
+            self._shm = None
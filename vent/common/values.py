@@ -1,8 +1,6 @@
 from collections import OrderedDict as odict
 from enum import Enum, auto
 
-from vent.gui import styles
-
 
 # TODO: Zhenyu's job is to make sure the print value is an intepretable string
 class ValueName(Enum):
@@ -263,26 +261,26 @@ PLOTS = odict({
         #     'name': 'Flow (L/s)',
         #     'abs_range': (0, 100),
         #     'safe_range': (20, 80),
-        #     'color': styles.SUBWAY_COLORS['yellow'],
+        #     'color': 'yellow',
         # },
 
         'pressure': {
             'name': 'Pressure (mmHg)',
             'abs_range': (0, 30),
             'safe_range': (5, 20),
-            'color': styles.SUBWAY_COLORS['orange'],
+            'color': 'orange',
         },
         'temp': {
             'name': 'Temperature (C)',
             'abs_range': (20,50),
             'safe_range' :(35,40),
-            'color': styles.SUBWAY_COLORS['red']
+            'color': 'red'
         },
         'humidity': {
             'name': 'Humidity (% H2O)',
             'abs_range': (70, 100),
             'safe_range': (90, 100),
-            'color': styles.SUBWAY_COLORS['blue']
+            'color': 'blue'
         }
     })
 """
@@ -296,7 +294,7 @@ such that the set limit range is updated when the horizontal bars on the plot ar
         'name' (str): title of plot,
         'abs_range' (tuple): absolute limit of plot range,
         'safe_range' (tuple): safe range, will be discolored outside of this range,
-        'color' (str): hex color of line (like "#FF0000")
+        'color' (str): name of a color in :data:`.gui.styles.SUBWAY_COLORS` (like "red"), or hex color of line (like "#FF0000")
     }
 """
 
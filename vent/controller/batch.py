@@ -0,0 +1,308 @@
+import numpy as np
+
+from vent.common.message import SensorValues
+from vent.common.values import CONTROL, ValueName
+
+
+def _per_patient(value, n, dtype=float):
+    # Broadcast a scalar or a sequence to one value per patient
+    return np.array(np.broadcast_to(np.asarray(value, dtype=dtype), (n,)))
+
+
+class Balloon_Batch_Simulator:
+    '''
+    Vectorized version of :class:`~vent.controller.control_module.Balloon_Simulator`, for N lungs at once.
+
+    Every parameter can be a scalar (shared by all lungs) or a sequence with one value per lung.
+    The state of all lungs is kept in arrays, and :meth:`.update` advances all of them with a few
+    vectorized NumPy calls, so the cost per lung shrinks as N grows.
+    '''
+
+    def __init__(self, n, leak=True, delay=False, PC=20, min_volume=1.5,
+                 temperature=37, fio2=60, humidity=90,
+                 temperature_sigma=0.3, fio2_sigma=5, humidity_sigma=5, tau=1, seed=None):
+        '''
+        Args:
+            n (int): Number of lungs
+            leak (bool): Whether the lungs leak back to their minimum volume
+            delay (bool): Whether the expansion of the lungs lags behind their volume
+            PC (float): Proportionality constant that relates pressure to cm-H2O (the compliance of the lung)
+            min_volume (float): Liters, lungs starts slightly inflated.
+            temperature, fio2, humidity (float): mean of the fluctuating sensor values
+            temperature_sigma, fio2_sigma, humidity_sigma (float): noise amplitude of the sensor values
+            tau (float): time scale of the sensor fluctuations in seconds
+            seed (int): seed for the noise, for reproducible runs
+        '''
+        self.n = n
+        self.leak = _per_patient(leak, n, bool)
+        self.delay = _per_patient(delay, n, bool)
+        self.PC = _per_patient(PC, n)
+        self.min_volume = _per_patient(min_volume, n)
+        self.P0 = 0  # Minimum pressure.
+
+        # Fluctuating sensor values, rows are temperature, fio2 and humidity
+        self._ou_mu = np.stack([_per_patient(temperature, n), _per_patient(fio2, n), _per_patient(humidity, n)])
+        self._ou_sigma = np.stack([_per_patient(temperature_sigma, n), _per_patient(fio2_sigma, n), _per_patient(humidity_sigma, n)])
+        self._ou_tau = _per_patient(tau, n)
+        self._ou_state = self._ou_mu.copy()
+        self._rng = np.random.default_rng(seed)
+
+        # Dynamical parameters - these are the initial conditions
+        self.r0 = np.cbrt(3 * self.min_volume / (4 * np.pi))
+        self.current_flow = np.zeros(n)       # in unit  liters/sec
+        self.current_pressure = np.zeros(n)   # in unit  cm-H2O
+        self.current_volume = self.min_volume.copy()
+        self.r_real = self.r0.copy()
+
+    @property
+    def temperature(self):
+        return self._ou_state[0]
+
+    @property
+    def fio2(self):
+        return self._ou_state[1]
+
+    @property
+    def humidity(self):
+        return self._ou_state[2]
+
+    def get_pressure(self):
+        return self.current_pressure
+
+    def get_volume(self):
+        return self.current_volume
+
+    def set_flow(self, Qin, Qout):
+        self.current_flow = Qin - Qout
+
+    def update(self, dt):  # Performs an update of duration dt [seconds] for all lungs
+        self.current_volume += self.current_flow * dt
+
+        s = dt / (5 + dt)   # Leak with RC = 5 sec
+        self.current_volume = np.where(self.leak, self.current_volume + s * (self.min_volume - self.current_volume), self.current_volume)
+
+        r_target = np.cbrt(3 * self.current_volume / (4 * np.pi))
+        s = dt / (0.1 + dt)  # Delay with RC = 100 ms
+        self.r_real = np.where(self.delay, self.r_real + s * (r_target - self.r_real), r_target)
+
+        ratio = self.r0 / self.r_real
+        ratio3 = ratio * ratio * ratio
+        self.current_pressure = self.P0 + (self.PC / (self.r0 * self.r0 * self.r_real)) * (1 - ratio3 * ratio3)
+
+        # Temperature, humidity and o2 fluctuations modelled as OUprocess, for all lungs at once
+        noise = self._rng.standard_normal(self._ou_state.shape)
+        self._ou_state += dt * (-(self._ou_state - self._ou_mu) / self._ou_tau) \
+                          + self._ou_sigma * np.sqrt(2. / self._ou_tau) * np.sqrt(dt) * noise
+        np.minimum(self._ou_state[2], 100, out=self._ou_state[2])
+
+
+class ControlModuleBatchSimulator:
+    '''
+    Runs the controller of :class:`~vent.controller.control_module.ControlModuleSimulator` for N simulated patients at once.
+
+    Every patient has its own settings, its own lung (see :class:`.Balloon_Batch_Simulator`), and goes through its own
+    breath cycle. The four phases of the cycle (rise to PIP, PIP plateau, fall to PEEP, PEEP plateau) are computed
+    as masks over all patients, so one :meth:`.step` advances all of them with vectorized NumPy calls.
+
+    Time is virtual: :meth:`.run_for` steps with a fixed dt as fast as possible, meant for parameter sweeps and load tests.
+
+    Per breath, PIP and PEEP are measured as the maximum and minimum pressure of the cycle (the single-patient
+    controller uses percentiles of the whole waveform, which would need every sample to be stored), and PIP_TIME as
+    the first time the pressure exceeds 90% of the PIP setting rather than of the measured PIP. The pressure itself
+    follows the single-patient controller step by step, for the same seed and settings.
+    '''
+
+    def __init__(self, n, pip=None, pip_time=None, peep=None, peep_time=None, breaths_per_minute=None,
+                 inspiration_time_sec=None, pid_control=True, balloon=None, **balloon_kwargs):
+        '''
+        Args:
+            n (int): Number of patients
+            pip, pip_time, peep, peep_time, breaths_per_minute, inspiration_time_sec (float): settings,
+                scalar or one per patient. Default to the defaults in :data:`~vent.common.values.CONTROL`
+            pid_control (bool): Use PID control (True) or state control (False), scalar or one per patient
+            balloon (:class:`.Balloon_Batch_Simulator`): the lungs to control, otherwise created from ``balloon_kwargs``
+        '''
+        self.n = n
+        self._LOOP_UPDATE_TIME = 0.01
+
+        def setting(value, name):
+            return _per_patient(CONTROL[name].default if value is None else value, n)
+
+        self.SET_PIP       = setting(pip, ValueName.PIP)
+        self.SET_PIP_TIME  = setting(pip_time, ValueName.PIP_TIME)
+        self.SET_PEEP      = setting(peep, ValueName.PEEP)
+        self.SET_PEEP_TIME = setting(peep_time, ValueName.PEEP_TIME)
+        self.SET_BPM       = setting(breaths_per_minute, ValueName.BREATHS_PER_MINUTE)
+        self.SET_I_PHASE   = setting(inspiration_time_sec, ValueName.INSPIRATION_TIME_SEC)
+        self.pid_control   = _per_patient(pid_control, n, bool)
+
+        self.Balloon = balloon if balloon is not None else Balloon_Batch_Simulator(n, **balloon_kwargs)
+
+        self.time = 0.
+        self.loop_counter = 0
+
+        # Controller state
+        self._cycle_start = np.zeros(n)
+        self._volume = np.zeros(n)
+        self._last_pressure = np.zeros(n)
+        self._dpdt = np.zeros(n)
+        self._P = np.zeros(n)
+        self._I = np.zeros(n)
+        self._D = np.zeros(n)
+        self._control_signal_in = np.zeros(n)
+        self._control_signal_out = np.zeros(n)
+        self._Qin = np.zeros(n)
+        self._Qout = np.zeros(n)
+
+        # Running statistics of the current breath
+        self._cycle_pmax = np.full(n, -np.inf)
+        self._cycle_pmin = np.full(n, np.inf)
+        self._cycle_vmax = np.full(n, -np.inf)
+        self._cycle_vmin = np.full(n, np.inf)
+        self._cycle_pip_reached = np.full(n, np.nan)
+        self._cycle_pip_left = np.full(n, np.nan)
+
+        # Measurements of the last complete breath
+        self.DATA_PIP = np.full(n, np.nan)
+        self.DATA_PEEP = np.full(n, np.nan)
+        self.DATA_PIP_TIME = np.full(n, np.nan)
+        self.DATA_I_PHASE = np.full(n, np.nan)
+        self.DATA_VTE = np.full(n, np.nan)
+        self.DATA_BPM = np.full(n, np.nan)
+        self.breath_count = np.zeros(n, dtype=np.int64)
+
+    def _pid_error(self, mask, ytarget, yis, dt):
+        # PID terms, only updated for the patients in mask
+        error_new = ytarget - yis
+        s = dt / (dt + 0.5)  # Integral term on a timescale RC = 0.5 s
+        self._I = np.where(mask, self._I + s * (error_new - self._I), self._I)
+        self._D = np.where(mask, error_new - self._P, self._D)
+        self._P = np.where(mask, error_new, self._P)
+
+    def _controller_update(self, dt):
+        pressure = self.Balloon.get_pressure()
+        cycle_phase = self.time - self._cycle_start
+        self._volume += dt * (self._Qin - self._Qout)
+
+        rise = cycle_phase < self.SET_PIP_TIME
+        plateau = ~rise & (cycle_phase < self.SET_I_PHASE)
+        fall = ~rise & ~plateau & (cycle_phase < self.SET_PEEP_TIME + self.SET_I_PHASE)
+        peep = ~rise & ~plateau & ~fall & (cycle_phase < 60 / self.SET_BPM)
+        new_cycle = ~(rise | plateau | fall | peep)
+        pid = self.pid_control
+        state = ~pid
+
+        # 1) Rise to PIP, PID control on dP/dt
+        s = dt / (0.05 + dt)  # 50ms LP filter
+        sample_dpdt = (pressure - self._last_pressure) / dt
+        self._dpdt = np.where(rise & pid, self._dpdt + s * (sample_dpdt - self._dpdt), self._dpdt)
+        target_slope = (self.SET_PIP - self.SET_PEEP) / self.SET_PIP_TIME
+
+        # 2) Sustain PIP, 4) Sustain PEEP: PID control on pressure
+        ytarget = np.select([rise, plateau], [target_slope, self.SET_PIP], self.SET_PEEP)
+        yis = np.where(rise, self._dpdt, pressure)
+        self._pid_error(pid & (rise | plateau | peep), ytarget, yis, dt)
+        pid_in = 1000 * self._P
+
+        # 3) Fall to PEEP: inspiratory valve closed
+        target = np.where(rise | plateau, self.SET_PIP, self.SET_PEEP)
+        signal_in = np.select(
+            [pid & (rise | plateau | peep),
+             state & (rise | plateau | peep)],
+            [pid_in,
+             np.where(pressure < target, np.inf, 0.)],
+            0.)
+        signal_in = np.where(rise & (pressure > self.SET_PIP), 0., signal_in)
+
+        signal_out = np.select(
+            [fall & pid,
+             fall & state,
+             peep & pid,
+             (plateau | peep) & state],
+            [np.where(pressure < 1.1 * self.SET_PEEP, 0., np.inf),
+             np.where(pressure < self.SET_PEEP, 0., np.inf),
+             np.where(pressure > 1.1 * self.SET_PEEP, np.inf, 0.),
+             np.where(pressure > target, np.inf, 0.)],
+            0.)
+
+        # 5) New cycle: keep control signals as they were, reset integrators
+        self._control_signal_in = np.where(new_cycle, self._control_signal_in, signal_in)
+        self._control_signal_out = np.where(new_cycle, self._control_signal_out, signal_out)
+
+        # Running statistics of the breath
+        self._cycle_pmax = np.maximum(self._cycle_pmax, pressure)
+        self._cycle_pmin = np.minimum(self._cycle_pmin, pressure)
+        self._cycle_vmax = np.maximum(self._cycle_vmax, self._volume)
+        self._cycle_vmin = np.minimum(self._cycle_vmin, self._volume)
+        above = pressure > 0.9 * self.SET_PIP
+        self._cycle_pip_reached = np.where(above & np.isnan(self._cycle_pip_reached), cycle_phase, self._cycle_pip_reached)
+        self._cycle_pip_left = np.where(above, cycle_phase, self._cycle_pip_left)
+
+        if new_cycle.any():
+            self._end_breath(new_cycle, cycle_phase)
+
+        self._last_pressure = pressure
+
+    def _end_breath(self, ended, cycle_phase):
+        # Read off the measurements of the breaths that ended, and start new ones
+        self.DATA_PIP = np.where(ended, self._cycle_pmax, self.DATA_PIP)
+        self.DATA_PEEP = np.where(ended, self._cycle_pmin, self.DATA_PEEP)
+        self.DATA_VTE = np.where(ended, self._cycle_vmax - self._cycle_vmin, self.DATA_VTE)
+        self.DATA_PIP_TIME = np.where(ended, self._cycle_pip_reached, self.DATA_PIP_TIME)
+        self.DATA_I_PHASE = np.where(ended, self._cycle_pip_left, self.DATA_I_PHASE)
+        self.DATA_BPM = np.where(ended, 60. / cycle_phase, self.DATA_BPM)
+        self.breath_count += ended
+
+        self._cycle_start = np.where(ended, self.time, self._cycle_start)
+        self._volume = np.where(ended, 0., self._volume)
+        self._dpdt = np.where(ended, 0., self._dpdt)
+        self._cycle_pmax = np.where(ended, -np.inf, self._cycle_pmax)
+        self._cycle_pmin = np.where(ended, np.inf, self._cycle_pmin)
+        self._cycle_vmax = np.where(ended, -np.inf, self._cycle_vmax)
+        self._cycle_vmin = np.where(ended, np.inf, self._cycle_vmin)
+        self._cycle_pip_reached = np.where(ended, np.nan, self._cycle_pip_reached)
+        self._cycle_pip_left = np.where(ended, np.nan, self._cycle_pip_left)
+
+    def _simulated_prop_valve(self, x, dt):
+        # Vectorized ControlModuleSimulator.__SimulatedPropValve
+        with np.errstate(invalid='ignore'):
+            flow_new = np.tanh(0.03 * (x - 130)) + 1
+        flow_new = np.where(x > 160, 1.72, flow_new)
+        flow_new = np.where(x < 0, 0., flow_new)
+        s = dt / (0.05 + dt)
+        return self._Qin + s * (flow_new - self._Qin)
+
+    def step(self, dt=None):
+        ''' Advance all patients by one loop iteration of dt seconds, by default self._LOOP_UPDATE_TIME '''
+        if dt is None:
+            dt = self._LOOP_UPDATE_TIME
+        self.time += dt
+        self.loop_counter += 1
+
+        self.Balloon.update(dt=dt)
+        self._controller_update(dt)
+
+        Qin = self._simulated_prop_valve(self._control_signal_in, dt)
+        Qout = (self._control_signal_out > 0).astype(float)
+        self.Balloon.set_flow(Qin, Qout)
+        self._Qin = Qin
+        self._Qout = Qout
+
+    def run_for(self, duration):
+        ''' Advance all patients by ``duration`` seconds of virtual time '''
+        for _ in range(int(round(duration / self._LOOP_UPDATE_TIME))):
+            self.step()
+
+    def get_sensors(self) -> SensorValues:
+        ''' Sensor values of all patients, each field is an array with one value per patient '''
+        return SensorValues(pip=self.DATA_PIP.copy(),
+                            peep=self.DATA_PEEP.copy(),
+                            fio2=self.Balloon.fio2.copy(),
+                            temp=self.Balloon.temperature.copy(),
+                            humidity=self.Balloon.humidity.copy(),
+                            pressure=self.Balloon.current_pressure.copy(),
+                            vte=self.DATA_VTE.copy(),
+                            breaths_per_minute=self.DATA_BPM.copy(),
+                            inspiration_time_sec=self.DATA_I_PHASE.copy(),
+                            timestamp=self.time,
+                            loop_counter=self.loop_counter)
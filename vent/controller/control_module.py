@@ -1,48 +1,113 @@
+import math
 import time
 from typing import List
 import threading
 import numpy as np
-import copy
 from collections import deque
-import pdb
 
 from vent.common.message import SensorValues, ControlSetting, Alarm, AlarmSeverity
+from vent.common.sample_ring import SampleRing
 from vent.common.values import CONTROL, ValueName
+from vent.controller.publisher import Publisher
+from vent.controller.timing import Clock, FixedRateScheduler, LoopStats
+from vent.controller.waveform import BreathAnalyzer, WaveformBuffer
+
+
+class ControllerSnapshot:
+    """
+    Immutable state of the controller, as published by the control thread.
+
+    The control thread builds a new snapshot every few iterations and swaps it in with a single
+    reference assignment, which is atomic. Readers pick up the current snapshot without a lock,
+    and always see sensor values, alarms and controls from the same iteration.
+
+    The objects held by a snapshot are shared between all readers and must not be modified.
+
+    Attributes:
+        version (int): loop counter of the iteration the snapshot was taken in
+        sensor_values (:class:`~vent.common.message.SensorValues`)
+        active_alarms (tuple): of :class:`~vent.common.message.Alarm`
+        logged_alarms (tuple): of :class:`~vent.common.message.Alarm`, oldest first
+        controls (tuple): of :class:`~vent.common.message.ControlSetting` currently used by the controller
+        alarms_version (int): version of the snapshot the alarms last changed in
+        controls_version (int): version of the snapshot the controls last changed in
+    """
+
+    __slots__ = ('version', 'sensor_values', 'active_alarms', 'logged_alarms', 'controls',
+                 'alarms_version', 'controls_version')
+
+    def __init__(self, version, sensor_values, active_alarms, logged_alarms, controls,
+                 alarms_version=None, controls_version=None):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'sensor_values', sensor_values)
+        object.__setattr__(self, 'active_alarms', tuple(active_alarms))
+        object.__setattr__(self, 'logged_alarms', tuple(logged_alarms))
+        object.__setattr__(self, 'controls', tuple(controls))
+        object.__setattr__(self, 'alarms_version', version if alarms_version is None else alarms_version)
+        object.__setattr__(self, 'controls_version', version if controls_version is None else controls_version)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ControllerSnapshot is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("ControllerSnapshot is immutable")
+
+    def __reduce__(self):
+        return (ControllerSnapshot, (self.version, self.sensor_values, self.active_alarms,
+                                     self.logged_alarms, self.controls, self.alarms_version, self.controls_version))
 
 
 class ControlModuleBase:
     """This is an abstract class for controlling simulation and hardware.
 
-    1. All internal variables fall in three classes, denoted by the beginning of the variable:
-        - "COPY_varname": These are copies (see 1.) that are regularly sync'ed with internal variables.
+    1. All internal variables fall in two classes, denoted by the beginning of the variable:
         - "__varname":    These are variables only used in the ControlModuleBase-Class
         - "_varname":     These are variables used in derived classes.
 
     2. Internal variables should only to be accessed though the set_ and get_ functions.
-        These functions act on COPIES of internal variables ("__" and "_"), that are sync'd every few
-        iterations. How often this is done is adjusted by the variable
-        self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE. To avoid multiple threads manipulating the same 
-        variables at the same time, every manipulation of "COPY_" is surrounded by a thread lock.
+        The control thread never waits for other threads:
+        - Outgoing state (sensor values, alarms, controls in use) is published every few iterations as an immutable
+          ControllerSnapshot, by swapping the reference self._snapshot. How often this is done is adjusted by the
+          variable self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE. The get_ functions read the current snapshot without a lock.
+        - Incoming control settings are put on a queue by set_control, and picked up by the control thread
+          at the same time the snapshot is published. self._lock only serializes concurrent calls to set_control.
 
     Public Methods:
-        get_sensors():                     Returns a copy of the current sensor values.
+        get_snapshot():                    Returns the current ControllerSnapshot.
+        get_sensors(since_loop_counter, since_timestamp):  Returns the current sensor values, or only those that changed since a previous call
         get_alarms():                      Returns a List of all alarms, active and logged
         get_active_alarms():               Returns a Dictionary of all currently active alarms.
         get_logged_alarms():               Returns a List of logged alarms, up to maximum lengh of self._RINGBUFFER_SIZE
-        get_control(ControlSetting):       Sets a controll-setting. Is updated at latest within self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+        set_control(ControlSetting):       Sets a controll-setting. Is updated at latest within self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+        get_control(ValueName):            Gets the last requested controll-setting. Is updated at latest within self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
         get_past_waveforms():              Returns a List of waveforms of pressure and volume during at the last N breath cycles, N<self._RINGBUFFER_SIZE, AND clears this archive.
+        get_state(since_version):          Returns sensor values, alarms and controls of one snapshot and the loop statistics, or only what changed since a previous call
+        get_loop_stats():                  Returns timing statistics of the main-loop (period, jitter, duration of each stage)
+        restore(controls, alarms):         Warm start from the settings and alarms of a previous controller
+        subscribe(topic, callback):        Pushes sensor values, breath summaries, alarm transitions or control changes to callback
+        get_samples(since):                Returns the samples of every main-loop iteration since a previous call, from a SampleRing
+        set_sample_ring(SampleRing):       Write the samples into another ring, eg. one in shared memory
         start():                           Starts the main-loop of the controller
         stop():                            Stops the main-loop of the controller
 
     """
 
-    def __init__(self):
+    def __init__(self, clock=None):
+        '''
+            clock: Clock used for all timing of the controller, timestamps, and the main-loop scheduling.
+                   Defaults to the wall clock, use a vent.controller.timing.SteppedClock to run faster than real time.
+        '''
+
+        self._clock = clock if clock is not None else Clock()
 
         #####################  Algorithm/Program parameters  ##################
         # Hyper-Parameters
         self._LOOP_UPDATE_TIME                   = 0.01    # Run the main control loop every 0.01 sec
-        self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE = 10      # After every 10 main control loop iterations, update COPYs.
+        self._LOOP_SPIN_TIME                     = 0       # Busy-wait this long before each loop deadline, for lower jitter. 0: only sleep.
+        self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE = 10      # After every 10 main control loop iterations, publish a snapshot and apply new settings.
         self._RINGBUFFER_SIZE                    = 100     # Maximum number of breath cycles kept in memory
+        self._SAMPLE_RING_SIZE                   = 8192    # Number of main-loop samples kept in the sample ring, ~80 s
+        self._SENSOR_HISTORY_SIZE                = 32      # Number of past snapshots get_sensors can send deltas against
 
         #########################  Control management  #########################
 
@@ -80,8 +145,11 @@ class ControlModuleBase:
         self._DATA_D = 0              # Last measurements of the differential term for PID-control
 
         # Parameters to keep track of breath-cycle
-        self.__cycle_start = time.time()
-        self.__cycle_waveform = np.array([[0, 0, 0]])                            # To build up the current cycle's waveform
+        self.__cycle_start = self._clock.time()
+        self.__cycle_waveform = WaveformBuffer(capacity = 2 * self.__SET_CYCLE_DURATION / self._LOOP_UPDATE_TIME)  # To build up the current cycle's waveform
+        self.__cycle_waveform.append((0, 0, 0))
+        self.__breath_analyzer = BreathAnalyzer()                                       # Running statistics of the current cycle
+        self.__breath_analyzer.add(0, 0, 0)
         self.__cycle_waveform_archive = deque(maxlen = self._RINGBUFFER_SIZE)          # An archive of past waveforms.
 
         # These are measurements that change from timepoint to timepoint
@@ -90,127 +158,158 @@ class ControlModuleBase:
         self._DATA_Qin      = 0           # Measurement of the airflow in
         self._DATA_Qout     = 0           # Measurement of the airflow out
         self._DATA_dpdt     = 0           # Current sample of the rate of change of pressure dP/dt in cmH2O/sec
-        self._last_update   = time.time()
 
 
         #########################  Alarm management  #########################
         self.__active_alarms = {}     # Dictionary of active alarms
         self.__logged_alarms = deque(maxlen = self._RINGBUFFER_SIZE)     # List of all resolved alarms
+        self._sample_ring = SampleRing(self._SAMPLE_RING_SIZE)            # Samples of every main-loop iteration
+        self._publisher = Publisher()                                     # Pushes sensor values, breaths, alarms and controls to subscribers
 
         # Variable limits to raise alarms, initialized as small deviation of what the controller initializes
         self.__PIP_min          = CONTROL[ValueName.PIP].safe_range[0]
         self.__PIP_max          = CONTROL[ValueName.PIP].safe_range[1]
-        self.__PIP_lastset      = time.time()
+        self.__PIP_lastset      = self._clock.time()
         self.__PIP_time_min     = CONTROL[ValueName.PIP_TIME].safe_range[0]
         self.__PIP_time_max     = CONTROL[ValueName.PIP_TIME].safe_range[1]
-        self.__PIP_time_lastset = time.time()
+        self.__PIP_time_lastset = self._clock.time()
         self.__PEEP_min         = CONTROL[ValueName.PEEP].safe_range[0]
         self.__PEEP_max         = CONTROL[ValueName.PEEP].safe_range[1]
-        self.__PEEP_lastset     = time.time()
+        self.__PEEP_lastset     = self._clock.time()
         self.__bpm_min          = CONTROL[ValueName.BREATHS_PER_MINUTE].safe_range[0]
         self.__bpm_max          = CONTROL[ValueName.BREATHS_PER_MINUTE].safe_range[1]
-        self.__bpm_lastset      = time.time()
+        self.__bpm_lastset      = self._clock.time()
         self.__I_phase_min      = CONTROL[ValueName.INSPIRATION_TIME_SEC].safe_range[0]
         self.__I_phase_max      = CONTROL[ValueName.INSPIRATION_TIME_SEC].safe_range[1]
-        self.__I_phase_lastset  = time.time()
+        self.__I_phase_lastset  = self._clock.time()
 
-        ############### Initialize COPY variables for threads  ##############
-        # COPY variables that later updated on a regular basis
-        self.COPY_active_alarms = {}
-        self.COPY_logged_alarms = list(self.__logged_alarms)
-        self.COPY_sensor_values = SensorValues()
+        ################ Initialize state shared with other threads  ##############
+        # Control settings as last requested through set_control, and not yet applied ones
+        self.__requested_controls = {}
+        for name in (ValueName.PIP, ValueName.PIP_TIME, ValueName.PEEP, ValueName.BREATHS_PER_MINUTE, ValueName.INSPIRATION_TIME_SEC):
+            self.__requested_controls[name] = self.__current_control(name)
+        self.__pending_controls = deque()
 
         ###########################  Threading init  #########################
         # Run the start() method as a thread
         self._loop_counter = 0
         self._running = False
         self._lock = threading.Lock()
-        self._alarm_to_COPY()  #These require the lock
-        self._initialize_set_to_COPY()
-
-        self.__thread = threading.Thread(target=self._start_mainloop, daemon=True)
-        self.__thread.start()
-
-
-    def _initialize_set_to_COPY(self):
-        self._lock.acquire()
-        # Copy of the SET variables for threading.
-        self.COPY_SET_PIP       = self.__SET_PIP 
-        self.COPY_SET_PIP_TIME  = self.__SET_PIP_TIME
-        self.COPY_SET_PEEP      = self.__SET_PEEP
-        self.COPY_SET_PEEP_TIME = self.__SET_PEEP_TIME
-        self.COPY_SET_BPM       = self.__SET_BPM
-        self.COPY_SET_I_PHASE   = self.__SET_I_PHASE
-        self._lock.release()
-
-    def _alarm_to_COPY(self):
-        self._lock.acquire()
-        # Update the alarms
-        self.COPY_active_alarms = self.__active_alarms.copy()
-        self.COPY_logged_alarms = list(self.__logged_alarms)
-
-        # The alarm thresholds
-        self.COPY_PIP_min = self.__PIP_min
-        self.COPY_PIP_max = self.__PIP_max
-        self.COPY_PIP_lastset = self.__PIP_lastset
-        self.COPY_PIP_time_min = self.__PIP_time_min 
-        self.COPY_PIP_time_max = self.__PIP_time_max
-        self.COPY_PIP_time_lastset = self.__PIP_time_lastset
-        self.COPY_PEEP_min = self.__PEEP_min
-        self.COPY_PEEP_max = self.__PEEP_max
-        self.COPY_PEEP_lastset = self.__PEEP_lastset
-        self.COPY_bpm_min = self.__bpm_min 
-        self.COPY_bpm_max = self.__bpm_max
-        self.COPY_bpm_lastset = self.__bpm_lastset
-        self.COPY_I_phase_min = self.__I_phase_min
-        self.COPY_I_phase_max = self.__I_phase_max
-        self.COPY_I_phase_lastset = self.__I_phase_lastset
-
-        self._lock.release()
-
-    def _sensor_to_COPY(self):
-        # These variables have to come from the hardware
-        self._lock.acquire()
-        # Make sure you have acquire and release!
-        self._lock.release()
-        pass
-
-    def _controls_from_COPY(self):
-        # Update SET variables
-        self._lock.acquire()
-
-        #Update values
-        self.__SET_PIP       = self.COPY_SET_PIP
-        self.__SET_PIP_TIME  = self.COPY_SET_PIP_TIME
-        self.__SET_PEEP      = self.COPY_SET_PEEP
-        self.__SET_PEEP_TIME = self.COPY_SET_PEEP_TIME
-        self.__SET_BPM       = self.COPY_SET_BPM
-        self.__SET_I_PHASE   = self.COPY_SET_I_PHASE
-
-        #Update derived values
-        self.__SET_CYCLE_DURATION = 60 / self.__SET_BPM
-        self.__SET_E_PHASE = self.__SET_CYCLE_DURATION - self.__SET_I_PHASE
-        self.__SET_T_PLATEAU = self.__SET_I_PHASE - self.__SET_PIP_TIME
-        self.__SET_T_PEEP = self.__SET_E_PHASE - self.__SET_PEEP_TIME
-
-        #Update new confidence intervals
-        self.__PIP_min          = self.COPY_PIP_min
-        self.__PIP_max          = self.COPY_PIP_max 
-        self.__PIP_lastset      = self.COPY_PIP_lastset  
-        self.__PIP_time_min     = self.COPY_PIP_time_min  
-        self.__PIP_time_max     = self.COPY_PIP_time_max  
-        self.__PIP_time_lastset = self.COPY_PIP_time_lastset  
-        self.__PEEP_min         = self.COPY_PEEP_min 
-        self.__PEEP_max         = self.COPY_PEEP_max  
-        self.__PEEP_lastset     = self.COPY_PEEP_lastset  
-        self.__bpm_min          = self.COPY_bpm_min 
-        self.__bpm_max          = self.COPY_bpm_max  
-        self.__bpm_lastset      = self.COPY_bpm_lastset  
-        self.__I_phase_min      = self.COPY_I_phase_min  
-        self.__I_phase_max      = self.COPY_I_phase_max 
-        self.__I_phase_lastset  = self.COPY_I_phase_lastset  
+        self._scheduler = FixedRateScheduler(period=self._LOOP_UPDATE_TIME, spin_time=self._LOOP_SPIN_TIME, clock=self._clock)
+        self._loop_stats = LoopStats(period=self._LOOP_UPDATE_TIME)
+        self.__update_copies = self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+        self.__publish_requested = False   # Publish a snapshot at the end of this iteration
+        self.__alarms_changed = False      # Alarms changed since the last snapshot
+        self.__controls_changed = False    # Controls changed since the last snapshot
+        self._snapshot = ControllerSnapshot(version=0, sensor_values=SensorValues(), active_alarms=(),
+                                            logged_alarms=(), controls=self.__requested_controls.values())
+        self.__sensor_history = deque(maxlen=self._SENSOR_HISTORY_SIZE)   # Sensor values of the last snapshots
+        self.__past_sensor_values = {}     # The same, by loop counter, replaced with every snapshot
+
+        self.__thread = threading.Thread(target=self._start_mainloop, daemon=True)   # started by start()
+
+
+    def __current_control(self, control_setting_name):
+        # The control setting as currently used by the controller
+        if control_setting_name == ValueName.PIP:
+            return ControlSetting(control_setting_name, self.__SET_PIP, self.__PIP_min, self.__PIP_max, self.__PIP_lastset)
+        elif control_setting_name == ValueName.PIP_TIME:
+            return ControlSetting(control_setting_name, self.__SET_PIP_TIME, self.__PIP_time_min, self.__PIP_time_max, self.__PIP_time_lastset)
+        elif control_setting_name == ValueName.PEEP:
+            return ControlSetting(control_setting_name, self.__SET_PEEP, self.__PEEP_min, self.__PEEP_max, self.__PEEP_lastset)
+        elif control_setting_name == ValueName.BREATHS_PER_MINUTE:
+            return ControlSetting(control_setting_name, self.__SET_BPM, self.__bpm_min, self.__bpm_max, self.__bpm_lastset)
+        elif control_setting_name == ValueName.INSPIRATION_TIME_SEC:
+            return ControlSetting(control_setting_name, self.__SET_I_PHASE, self.__I_phase_min, self.__I_phase_max, self.__I_phase_lastset)
+        else:
+            raise KeyError("You cannot set the variabe: " + str(control_setting_name))
 
-        self._lock.release()
+    def _sensor_values(self) -> SensorValues:
+        # The current sensor values, these have to come from the hardware
+        return SensorValues(pip=self._DATA_PIP,
+                            peep=self._DATA_PEEP,
+                            pressure=self._DATA_PRESSURE,
+                            vte=self._DATA_VTE,
+                            breaths_per_minute=self._DATA_BPM,
+                            inspiration_time_sec=self._DATA_I_PHASE,
+                            timestamp=self._clock.time(),
+                            loop_counter = self._loop_counter)
+
+    def _publish_snapshot(self):
+        # Build a new snapshot of sensor values, alarms and controls, and swap it in for the readers.
+        # The previous snapshot is left untouched, readers that still hold it see a consistent state.
+        # Alarms and controls that did not change are shared with the previous snapshot, with their version.
+        previous = self._snapshot
+        version = self._loop_counter
+        if self.__alarms_changed:
+            active_alarms, logged_alarms, alarms_version = self.__active_alarms.values(), self.__logged_alarms, version
+        else:
+            active_alarms, logged_alarms, alarms_version = previous.active_alarms, previous.logged_alarms, previous.alarms_version
+        if self.__controls_changed:
+            controls = [self.__current_control(name) for name in self.__requested_controls.keys()]
+            controls_version = version
+        else:
+            controls, controls_version = previous.controls, previous.controls_version
+
+        sensor_values = self._sensor_values()
+        self.__sensor_history.append(sensor_values)
+        self.__past_sensor_values = {values.loop_counter: values for values in self.__sensor_history}
+        self._snapshot = ControllerSnapshot(version=version,
+                                            sensor_values=sensor_values,
+                                            active_alarms=active_alarms,
+                                            logged_alarms=logged_alarms,
+                                            controls=controls,
+                                            alarms_version=alarms_version,
+                                            controls_version=controls_version)
+        self.__publish_requested = False
+        self.__alarms_changed = False
+        self.__controls_changed = False
+
+    def _controls_from_queue(self):
+        # Apply control settings requested by set_control since the last call.
+        # deque.popleft is atomic, so this doesn't need a lock
+        updated = False
+        while True:
+            try:
+                control_setting = self.__pending_controls.popleft()
+            except IndexError:
+                break
+            updated = True
+
+            if control_setting.name == ValueName.PIP:
+                self.__SET_PIP = control_setting.value
+                self.__PIP_min = control_setting.min_value
+                self.__PIP_max = control_setting.max_value
+                self.__PIP_lastset = control_setting.timestamp
+            elif control_setting.name == ValueName.PIP_TIME:
+                self.__SET_PIP_TIME = control_setting.value
+                self.__PIP_time_min = control_setting.min_value
+                self.__PIP_time_max = control_setting.max_value
+                self.__PIP_time_lastset = control_setting.timestamp
+            elif control_setting.name == ValueName.PEEP:
+                self.__SET_PEEP = control_setting.value
+                self.__PEEP_min = control_setting.min_value
+                self.__PEEP_max = control_setting.max_value
+                self.__PEEP_lastset = control_setting.timestamp
+            elif control_setting.name == ValueName.BREATHS_PER_MINUTE:
+                self.__SET_BPM = control_setting.value
+                self.__bpm_min = control_setting.min_value
+                self.__bpm_max = control_setting.max_value
+                self.__bpm_lastset = control_setting.timestamp
+            elif control_setting.name == ValueName.INSPIRATION_TIME_SEC:
+                self.__SET_I_PHASE = control_setting.value
+                self.__I_phase_min = control_setting.min_value
+                self.__I_phase_max = control_setting.max_value
+                self.__I_phase_lastset = control_setting.timestamp
+            self._publisher.publish('controls', control_setting)
+
+        if updated:
+            self.__controls_changed = True
+            #Update derived values
+            self.__SET_CYCLE_DURATION = 60 / self.__SET_BPM
+            self.__SET_E_PHASE = self.__SET_CYCLE_DURATION - self.__SET_I_PHASE
+            self.__SET_T_PLATEAU = self.__SET_I_PHASE - self.__SET_PIP_TIME
+            self.__SET_T_PEEP = self.__SET_E_PHASE - self.__SET_PEEP_TIME
 
     def __test_critical_levels(self, min, max, value, name):
         '''
@@ -226,38 +325,41 @@ class ControlModuleBase:
         if (value < min) or (value > max):  # If the variable is not within limits
             if name not in self.__active_alarms.keys():  # And and alarm for that variable doesn't exist yet -> RAISE ALARM.
                 new_alarm = Alarm(alarm_name=name, is_active=True, severity=AlarmSeverity.RED, \
-                                  alarm_start_time=time.time(), alarm_end_time=None)
+                                  alarm_start_time=self._clock.time(), alarm_end_time=None)
                 self.__active_alarms[name] = new_alarm
+                self._publisher.publish('alarms', new_alarm)
+                self.__alarms_changed = True
         else:  # Else: if the variable is within bounds,
             if name in self.__active_alarms.keys():  # And an alarm exists -> inactivate it.
-                old_alarm = self.__active_alarms[name]
-                old_alarm.alarm_end_time = time.time()
-                old_alarm.is_active = False
-                self.__logged_alarms.append(old_alarm)
+                old_alarm = self.__active_alarms[name]  # This may be held by a published snapshot, log a resolved copy instead of changing it
+                resolved_alarm = Alarm(alarm_name=old_alarm.alarm_name, is_active=False, severity=old_alarm.severity, \
+                                       alarm_start_time=old_alarm.alarm_start_time, alarm_end_time=self._clock.time())
+                self.__logged_alarms.append(resolved_alarm)
+                self._publisher.publish('alarms', resolved_alarm)
                 del self.__active_alarms[name]
+                self.__alarms_changed = True
 
     def __analyze_last_waveform(self):
-        ''' This goes through the last waveform, and updates VTE, PEEP, PIP, PIP_TIME, I_PHASE, FIRST_PEEP and BPM.'''
-        if len(self.__cycle_waveform_archive) > 1:  # Only if there was a previous cycle
-            data = self.__cycle_waveform_archive[-1]
-            phase = data[:, 0]
-            pressure = data[:, 1]
-            volume = data[:, 2]
-
-            self._DATA_VTE = np.max(volume) - np.min(volume)
+        ''' This reads off VTE, PEEP, PIP, PIP_TIME, I_PHASE and BPM of the last waveform from the running statistics of the breath analyzer.'''
+        analysis = self.__breath_analyzer.analyze()
+        if len(self.__cycle_waveform_archive) > 1 and analysis is not None:  # Only if there was a previous cycle
+            self._DATA_VTE = analysis['vte']
 
-            # get the pressure niveau heuristically (much faster than fitting)
-            # 20/80 percentile of pressure values below/above mean
+            # get the pressure niveau heuristically (much faster than fitting):
+            # 20/80 percentile of the pressure histogram below/above the mean, resolved to the bin width of the analyzer
             # Assumption: waveform is mostly between both plateaus
-            self._DATA_PEEP = np.percentile(pressure[ pressure < np.mean(pressure)], 20 )
-            self._DATA_PIP  = np.percentile(pressure[ pressure > np.mean(pressure)], 80 )
+            self._DATA_PEEP = analysis['peep']
+            self._DATA_PIP  = analysis['pip']
 
-            # measure time of reaching PIP, and leaving PIP
-            self._DATA_PIP_TIME = phase[np.min(np.where(pressure > self._DATA_PIP*0.9))]
-            self._DATA_I_PHASE = phase[np.max(np.where(pressure > self._DATA_PIP*0.9))]
+            # time of reaching PIP, and leaving PIP
+            self._DATA_PIP_TIME = analysis['pip_time']
+            self._DATA_I_PHASE = analysis['i_phase']
 
-            # and measure the breaths per minute
-            self._DATA_BPM = 60. / phase[-1]  # 60 sec divided by the duration of last waveform
+            # and the breaths per minute
+            self._DATA_BPM = analysis['bpm']
+
+            if self._publisher.wants('breath'):
+                self._publisher.publish('breath', dict(analysis, timestamp=self._clock.time(), loop_counter=self._loop_counter))
 
     def __update_alarms(self):
         ''' This goes through the values obtained from the last waveform, and updates alarms.'''
@@ -268,116 +370,87 @@ class ControlModuleBase:
             self.__test_critical_levels(min=self.__bpm_min, max=self.__bpm_max, value=self._DATA_BPM, name="BREATHS_PER_MINUTE")
             self.__test_critical_levels(min=self.__I_phase_min, max=self.__I_phase_max, value=self._DATA_I_PHASE, name="I_PHASE")
 
-    def get_sensors(self) -> SensorValues:
-        # Make sure to return a copy of the instance
-        self._lock.acquire()
-        cp = copy.deepcopy( self.COPY_sensor_values )
-        self._lock.release()
-        return cp
+    def get_snapshot(self) -> ControllerSnapshot:
+        # The current, immutable state of the controller. Never blocks.
+        return self._snapshot
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None) -> SensorValues:
+        '''
+        The sensor values of the current snapshot, shared by all readers, do not modify.
+            since_loop_counter:  loop_counter of the sensor values returned by a previous call. Returns None if the
+                                 values did not change since, only the values that changed (see SensorValues.delta)
+                                 if that snapshot is one of the last self._SENSOR_HISTORY_SIZE, all of them otherwise.
+            since_timestamp:     timestamp of these sensor values. Loop counters start over when the control process
+                                 is restarted, previous values are only recognized if both match.
+        '''
+        sensor_values = self._snapshot.sensor_values
+        if since_loop_counter is None:
+            return sensor_values
+        if since_loop_counter == sensor_values.loop_counter and since_timestamp == sensor_values.timestamp:
+            return None
+        previous = self.__past_sensor_values.get(since_loop_counter)
+        if previous is None or previous.timestamp != since_timestamp:
+            return sensor_values
+        return sensor_values.delta(previous)
 
     def get_alarms(self) -> List[Alarm]:
         # Returns all alarms as a list
-        self._lock.acquire()
-        new_alarm_list = self.COPY_logged_alarms.copy()
-        for alarm_key in self.COPY_active_alarms.keys():
-            new_alarm_list.append(self.COPY_active_alarms[alarm_key])
-        self._lock.release()
-        return new_alarm_list
+        snapshot = self._snapshot
+        return list(snapshot.logged_alarms + snapshot.active_alarms)
+
+    def get_state(self, since_version=None) -> dict:
+        '''
+        Sensor values, alarms and controls of one snapshot, and the loop statistics, in a single call.
+            since_version:  version returned by a previous call. Sections that did not change since are None.
+                            None (or a version from before a restart of the controller) to get all sections.
+        Returns a dictionary with
+            version:        version of the snapshot, pass it as since_version to the next call
+            sensors:        SensorValues
+            active_alarms:  Dictionary of active alarms, by alarm name
+            logged_alarms:  List of logged alarms
+            controls:       Dictionary of the ControlSettings currently used by the controller, by ValueName
+            loop_stats:     see get_loop_stats, always included
+        '''
+        snapshot = self._snapshot
+        if since_version is not None and since_version > snapshot.version:
+            since_version = None
+        alarms_changed = since_version is None or snapshot.alarms_version > since_version
+        controls_changed = since_version is None or snapshot.controls_version > since_version
+        return {'version': snapshot.version,
+                'sensors': snapshot.sensor_values if since_version is None or snapshot.version > since_version else None,
+                'active_alarms': {alarm.alarm_name: alarm for alarm in snapshot.active_alarms} if alarms_changed else None,
+                'logged_alarms': list(snapshot.logged_alarms) if alarms_changed else None,
+                'controls': {control.name: control for control in snapshot.controls} if controls_changed else None,
+                'loop_stats': self.get_loop_stats()}
 
     def get_active_alarms(self):
         # Returns only the active alarms
-        self._lock.acquire()
-        active_alarms = self.COPY_active_alarms.copy() # Make sure to return a copy
-        self._lock.release()
-        return active_alarms
+        return {alarm.alarm_name: alarm for alarm in self._snapshot.active_alarms}
 
     def get_logged_alarms(self) -> List[Alarm]:
         # Returns only the inactive alarms
-        self._lock.acquire()
-        logged_alarms = self.COPY_logged_alarms.copy()
-        self._lock.release()
-        return logged_alarms
+        return list(self._snapshot.logged_alarms)
 
     def set_control(self, control_setting: ControlSetting):
-        ''' Updates the entry of COPY contained in the control settings'''
-        self._lock.acquire()
-
-        if control_setting.name == ValueName.PIP:
-            self.COPY_SET_PIP = control_setting.value
-            self.COPY_PIP_min = control_setting.min_value
-            self.COPY_PIP_max = control_setting.max_value
-            self.COPY_PIP_lastset = control_setting.timestamp
-
-        elif control_setting.name == ValueName.PIP_TIME:
-            self.COPY_SET_PIP_TIME = control_setting.value
-            self.COPY_PIP_time_min = control_setting.min_value
-            self.COPY_PIP_time_max = control_setting.max_value
-            self.COPY_PIP_time_lastset = control_setting.timestamp
-
-        elif control_setting.name == ValueName.PEEP:
-            self.COPY_SET_PEEP = control_setting.value
-            self.COPY_PEEP_min = control_setting.min_value
-            self.COPY_PEEP_max = control_setting.max_value
-            self.COPY_PEEP_lastset = control_setting.timestamp
-
-        elif control_setting.name == ValueName.BREATHS_PER_MINUTE:
-            self.COPY_SET_BPM = control_setting.value
-            self.COPY_bpm_min = control_setting.min_value
-            self.COPY_bpm_max = control_setting.max_value
-            self.COPY_bpm_lastset = control_setting.timestamp
-
-        elif control_setting.name == ValueName.INSPIRATION_TIME_SEC:
-            self.COPY_SET_I_PHASE = control_setting.value
-            self.COPY_I_phase_min = control_setting.min_value
-            self.COPY_I_phase_max = control_setting.max_value
-            self.COPY_I_phase_lastset = control_setting.timestamp
-
-        else:
+        ''' Queues a control setting, to be applied by the control thread at the next update'''
+        if control_setting.name not in self.__requested_controls:
             raise KeyError("You cannot set the variabe: " + str(control_setting.name))
 
+        self._lock.acquire()
+        # Swap in a new dict, so get_control can read without a lock
+        requested_controls = self.__requested_controls.copy()
+        requested_controls[control_setting.name] = control_setting
+        self.__requested_controls = requested_controls
+        self.__pending_controls.append(control_setting)
         self._lock.release()
 
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
-        ''' Gets values of the COPY of the control settings. '''
-        
-        self._lock.acquire()
-        if control_setting_name == ValueName.PIP:
-            return_value = ControlSetting(control_setting_name,
-                                  self.COPY_SET_PIP,
-                                  self.COPY_PIP_min,
-                                  self.COPY_PIP_max,
-                                  self.COPY_PIP_lastset)
-        elif control_setting_name == ValueName.PIP_TIME:
-            return_value = ControlSetting(control_setting_name,
-                                  self.COPY_SET_PIP_TIME,
-                                  self.COPY_PIP_time_min,
-                                  self.COPY_PIP_time_max,
-                                  self.COPY_PIP_time_lastset, )
-        elif control_setting_name == ValueName.PEEP:
-            return_value = ControlSetting(control_setting_name,
-                                  self.COPY_SET_PEEP,
-                                  self.COPY_PEEP_min,
-                                  self.COPY_PEEP_max,
-                                  self.COPY_PEEP_lastset)
-        elif control_setting_name == ValueName.BREATHS_PER_MINUTE:
-            return_value = ControlSetting(control_setting_name,
-                                  self.COPY_SET_BPM,
-                                  self.COPY_bpm_min,
-                                  self.COPY_bpm_max,
-                                  self.COPY_bpm_lastset)
-        elif control_setting_name == ValueName.INSPIRATION_TIME_SEC:
-            return_value = ControlSetting(control_setting_name,
-                                  self.COPY_SET_I_PHASE,
-                                  self.COPY_I_phase_min,
-                                  self.COPY_I_phase_max,
-                                  self.COPY_I_phase_lastset)
-        else:
+        ''' Gets the last requested value of a control setting. '''
+        try:
+            return self.__requested_controls[control_setting_name]
+        except KeyError:
             raise KeyError("You cannot set the variabe: " + str(control_setting_name))
 
-        self._lock.release()
-
-        return return_value
-
 
     def __get_PID_error(self, ytarget, yis, dt):
         error_new = ytarget - yis                   # New value of the error
@@ -427,7 +500,7 @@ class ControlModuleBase:
             dt: Time since last update in seconds 
 
         '''
-        now = time.time()
+        now = self._clock.time()
         cycle_phase = now - self.__cycle_start
         next_cycle = False
 
@@ -464,7 +537,7 @@ class ControlModuleBase:
 
         elif cycle_phase < self.__SET_PEEP_TIME + self.__SET_I_PHASE:  # then, we drop pressure as fast as possible
             if self._pid_control_flag:
-                self.control_signal_in = 0
+                self.__control_signal_in = 0
                 self.__control_signal_out = np.inf   # open out valve to max, once the pressure is down, let the PID controller take over
                 if self._DATA_PRESSURE < 1.1*self.__SET_PEEP:
                     self.__control_signal_out = 0
@@ -490,40 +563,157 @@ class ControlModuleBase:
                     self.__control_signal_out = np.inf
 
         else:
-            self.__cycle_start = time.time()  # New cycle starts
+            self.__cycle_start = self._clock.time()  # New cycle starts
             self.__DATA_VOLUME = 0            # ... start at zero volume in the lung
             self._DATA_dpdt    = 0            # and restart the rolling average for the dP/dt estimation
             next_cycle = True
         
         if next_cycle:                        # if a new breath cycle has started
             if len(self.__cycle_waveform) > 1:
-                self.__cycle_waveform_archive.append( self.__cycle_waveform )
-            self.__cycle_waveform = np.array([[0, self._DATA_PRESSURE, self.__DATA_VOLUME]])
+                self.__cycle_waveform_archive.append( self.__cycle_waveform.archive() )   # zero-copy, the buffer is not written to anymore
+            self.__cycle_waveform = self.__cycle_waveform.new_like()
+            self.__cycle_waveform.append((0, self._DATA_PRESSURE, self.__DATA_VOLUME))
             self.__analyze_last_waveform()    # Analyze last waveform
+            self.__breath_analyzer.reset()
+            self.__breath_analyzer.add(0, self._DATA_PRESSURE, self.__DATA_VOLUME)
             self.__update_alarms()            # Run alarm detection over last cycle's waveform
-            self._sensor_to_COPY()            # Get the fit values from the last waveform directly into sensor values
+            self.__publish_requested = True   # Get the fit values from the last waveform directly into sensor values, at the end of this iteration
         else:
-            self.__cycle_waveform = np.append(self.__cycle_waveform, [[cycle_phase, self._DATA_PRESSURE, self.__DATA_VOLUME]], axis=0)
+            self.__cycle_waveform.append((cycle_phase, self._DATA_PRESSURE, self.__DATA_VOLUME))
+            self.__breath_analyzer.add(cycle_phase, self._DATA_PRESSURE, self.__DATA_VOLUME)
 
     def get_past_waveforms(self):
         # Returns a list of past waveforms.
         # Format:
         #     Returns a list of [Nx3] waveforms, of [time, pressure, volume]
+        #     These are read-only views on the buffers of the past cycles, not copies.
         #     Most recent entry is waveform_list[-1]
         # Note:
         #     After calling this function, archive is emptied!
-        self._lock.acquire()
         archive = list( self.__cycle_waveform_archive ) # Make sure to return a copy as a list
-        self.__cycle_waveform_archive = deque(maxlen = self._RINGBUFFER_SIZE)
-        self.__cycle_waveform_archive.append(archive[-1])
-        self._lock.release()
+        for _ in range(len(archive) - 1):                 # The control thread only appends on the right, keep the most recent cycle.
+            self.__cycle_waveform_archive.popleft()
         return archive
 
-    def _start_mainloop(self):
+    def _control_step(self, dt):
+        # One iteration of the control loop: read sensors, update the controller, actuate.
         # This will depend on simulation or reality
-        pass   
+        pass
+
+    def __start_scheduler(self):
+        self._scheduler = FixedRateScheduler(period=self._LOOP_UPDATE_TIME, spin_time=self._LOOP_SPIN_TIME, clock=self._clock)
+        self._loop_stats = LoopStats(period=self._LOOP_UPDATE_TIME)
+        self.__update_copies = 0   # Apply pending settings and publish at the first iteration, not after a full round
+        self._scheduler.start()
+
+    def __loop_iteration(self):
+        # One scheduled iteration of the main-loop, including the regular sync with other threads
+        dt = self._scheduler.wait()                             # Time since last cycle of main-loop
+        self._loop_stats.tick(time.perf_counter_ns())
+        self._loop_counter += 1
+
+        self._control_step(dt = dt)
+        self._sample_ring.write(self._clock.time(), self._DATA_PRESSURE, self.__DATA_VOLUME,
+                                self._DATA_Qin, self._DATA_Qout,
+                                self.__control_signal_in, self.__control_signal_out, self._loop_counter)
+        if self._publisher.wants('sensors'):
+            self._publisher.publish('sensors', self._sensor_values())
+
+        if self.__update_copies == 0:
+            sync_start = time.perf_counter_ns()
+            self._controls_from_queue()    # Update controls from possibly updated values as a chunk
+            self._publish_snapshot()       # Publish current sensor values, alarms and settings
+            self._loop_stats.record('sync', time.perf_counter_ns() - sync_start)
+            self.__update_copies = self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+        else:
+            self.__update_copies -= 1
+            if self.__publish_requested:   # At most one snapshot per iteration, so versions are unique
+                self._publish_snapshot()
+
+        self._loop_stats.tock(time.perf_counter_ns())
+
+    def _start_mainloop(self):
+        # start running, this should be run as a thread!
+        # The loop is paced by absolute deadlines, so the loop period does not depend on how long _control_step takes.
+        self.__start_scheduler()
+        while self._running:
+            self.__loop_iteration()
+
+    def run_for(self, duration):
+        '''
+        Runs the main-loop in the calling thread, for the given number of seconds on the controller's clock.
+        With a SteppedClock this runs as fast as possible, and returns after duration/self._LOOP_UPDATE_TIME iterations.
+        The main-loop thread must not be running at the same time.
+        '''
+        if self.__thread.is_alive():
+            raise RuntimeError("Main Loop is running in its thread, stop it first.")
+        self.__start_scheduler()
+        for _ in range(int(round(duration / self._LOOP_UPDATE_TIME))):
+            self.__loop_iteration()
+
+    def get_loop_stats(self) -> dict:
+        '''
+        Timing statistics of the main-loop since it was last started, all durations in seconds:
+            loop_counter:       number of iterations of the main-loop
+            period_target:      the period the main-loop is scheduled at
+            missed_deadlines:   number of deadlines the scheduler could not keep
+            overruns:           number of iterations that took longer than the period
+            period, jitter:     summary of the measured period, and of its deviation from period_target
+            stages:             summary of the time spent per iteration in sensor reading, PID update, actuation, and sync (applying settings and publishing a snapshot)
+        Each summary is a dictionary with count, mean, min, max, p50, p99 and p999.
+        '''
+        stats = self._loop_stats.summary()
+        stats['loop_counter'] = self._loop_counter
+        stats['missed_deadlines'] = self._scheduler.missed_deadlines
+        return stats
+
+    def set_sample_ring(self, sample_ring):
+        '''
+        Write the samples of the main-loop into sample_ring from now on, eg. a vent.common.sample_ring.SampleRing in shared memory
+        that other processes read. Only the control thread writes to the ring.
+        '''
+        self._sample_ring = sample_ring
+
+    def restore(self, controls=(), active_alarms=(), logged_alarms=()):
+        '''
+        Warm start from the checkpoint of a previous controller, eg. after its process was restarted. Call before start().
+            controls:       ControlSettings, applied at the first iteration as if they were set with set_control
+            active_alarms:  Alarms that were active, they stay active until they are resolved as usual
+            logged_alarms:  Alarms that were resolved
+        '''
+        if self._running:
+            raise RuntimeError('Can only restore a controller that is not running')
+        for control_setting in controls:
+            self.set_control(control_setting)
+        self.__active_alarms = {alarm.alarm_name: alarm for alarm in active_alarms}
+        self.__logged_alarms.extend(logged_alarms)
+        self.__alarms_changed = True
+        self._publish_snapshot()
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        '''
+        Push messages of a topic to callback, see vent.controller.publisher.TOPICS.
+            topic:       'sensors', 'breath', 'alarms' or 'controls'
+            callback:    called as callback(topic, message) in a dispatcher thread, never in the control thread. Must not block.
+            decimation:  only every decimation-th message is passed on, eg. 10 for sensor values at a tenth of the loop rate
+        Returns the id of the subscription, to unsubscribe.
+        '''
+        return self._publisher.subscribe(topic, callback, decimation)
+
+    def unsubscribe(self, subscription_id):
+        self._publisher.unsubscribe(subscription_id)
+
+    def get_samples(self, since=None):
+        '''
+        Samples of every main-loop iteration, see vent.common.sample_ring.SampleRing.read.
+            since:  write count returned by the previous call, None for all samples in the ring
+        Returns a tuple of (records with timestamp, pressure, volume, Qin, Qout, control_in, control_out, loop_counter; write count)
+        '''
+        return self._sample_ring.read(since)
 
     def start(self):
+        if not self._running and self.__thread.is_alive():  # The previous thread has been stopped, but is still finishing its last iteration
+            self.__thread.join()
         if not self.__thread.is_alive():  # If the previous thread has been stopped, make a new one.
             self._running = True
             self.__thread = threading.Thread(target=self._start_mainloop, daemon=True)
@@ -558,6 +748,7 @@ class ControlModuleBase:
 
 class ControlModuleDevice(ControlModuleBase):
     # Implement ControlModuleBase functions
+    # The main loop and its scheduling are inherited, hardware access goes into _control_step
     pass
 
 
@@ -569,7 +760,16 @@ class Balloon_Simulator:
     For math, see https://en.wikipedia.org/wiki/Two-balloon_experiment
     '''
 
-    def __init__(self, leak, delay):
+    # Number of noise samples drawn at once for each fluctuating sensor value
+    _NOISE_BLOCK = 1024
+
+    def __init__(self, leak, delay, seed=None):
+        '''
+        Args:
+            leak (bool): Whether the balloon leaks back to its minimum volume
+            delay (bool): Whether the expansion of the balloon lags behind its volume
+            seed (int): Seed of the :class:`numpy.random.Generator` used for the sensor noise, for reproducible runs
+        '''
         # Hard parameters for the simulation
         self.max_volume = 6  # Liters  - 6?
         self.min_volume = 1.5  # Liters - baloon starts slightly inflated.
@@ -582,10 +782,16 @@ class Balloon_Simulator:
         self.humidity = 90
         self.fio2 = 60
 
+        # Noise for the OU processes is drawn in blocks of _NOISE_BLOCK ticks, one column per variable
+        self._rng = np.random.default_rng(seed)
+        self._noise = []
+        self._noise_index = 0
+
         # Dynamical parameters - these are the initial conditions
         self.current_flow = 0  # in unit  liters/sec
         self.current_pressure = 0  # in unit  cm-H2O
-        self.r_real = (3 * self.min_volume / (4 * np.pi)) ** (1 / 3)  # size of the lung
+        self.r0 = (3 * self.min_volume / (4 * np.pi)) ** (1 / 3)  # size of the empty lung
+        self.r_real = self.r0  # size of the lung
         self.current_volume = self.min_volume  # in unit  liters
 
     def get_pressure(self):
@@ -607,7 +813,7 @@ class Balloon_Simulator:
 
         # This is fromt the baloon equation, uses helper variable (the baloon radius)
         r_target = (3 * self.current_volume / (4 * np.pi)) ** (1 / 3)
-        r0 = (3 * self.min_volume / (4 * np.pi)) ** (1 / 3)
+        r0 = self.r0
 
         # Delay -> Expansion takes time
         if self.delay:
@@ -620,13 +826,27 @@ class Balloon_Simulator:
         self.current_pressure = self.P0 + (self.PC / (r0 ** 2 * self.r_real)) * (1 - (r0 / self.r_real) ** 6)
 
         # Temperature, humidity and o2 fluctuations modelled as OUprocess
-        self.temperature = self.OUupdate(self.temperature, dt=dt, mu=37, sigma=0.3, tau=1)
-        self.fio2 = self.OUupdate(self.fio2, dt=dt, mu=60, sigma=5, tau=1)
-        self.humidity = self.OUupdate(self.humidity, dt=dt, mu=90, sigma=5, tau=1)
+        noise_temperature, noise_fio2, noise_humidity = self._next_noise()
+        sqrtdt = math.sqrt(dt)
+        self.temperature = self.OUupdate(self.temperature, dt=dt, mu=37, sigma=0.3, tau=1, noise=noise_temperature, sqrtdt=sqrtdt)
+        self.fio2 = self.OUupdate(self.fio2, dt=dt, mu=60, sigma=5, tau=1, noise=noise_fio2, sqrtdt=sqrtdt)
+        self.humidity = self.OUupdate(self.humidity, dt=dt, mu=90, sigma=5, tau=1, noise=noise_humidity, sqrtdt=sqrtdt)
         if self.humidity > 100:
             self.humidity = 100
 
-    def OUupdate(self, variable, dt, mu, sigma, tau):
+    def _next_noise(self):
+        '''
+        Standard normal noise for temperature, fio2 and humidity, as a tuple of floats.
+        A new block is drawn from the generator every _NOISE_BLOCK ticks.
+        '''
+        if self._noise_index == len(self._noise):
+            self._noise = self._rng.standard_normal((self._NOISE_BLOCK, 3)).tolist()
+            self._noise_index = 0
+        noise = self._noise[self._noise_index]
+        self._noise_index += 1
+        return noise
+
+    def OUupdate(self, variable, dt, mu, sigma, tau, noise=None, sqrtdt=None):
         '''
         This is a simple function to produce an OU process.
         It is used as model for fluctuations in measurement variables.
@@ -636,20 +856,25 @@ class Balloon_Simulator:
         mu      :   mean
         sigma   :   noise amplitude
         tau     :   time scale
+        noise   :   standard normal sample, drawn from the simulator's generator if None
+        sqrtdt  :   square root of dt, if already known
         returns:
         new_variable :  value of "variable" at next time step
         '''
-        sigma_bis = sigma * np.sqrt(2. / tau)
-        sqrtdt = np.sqrt(dt)
-        new_variable = variable + dt * (-(variable - mu) / tau) + sigma_bis * sqrtdt * np.random.randn()
+        if noise is None:
+            noise = self._rng.standard_normal()
+        if sqrtdt is None:
+            sqrtdt = math.sqrt(dt)
+        sigma_bis = sigma * math.sqrt(2. / tau)
+        new_variable = variable + dt * (-(variable - mu) / tau) + sigma_bis * sqrtdt * noise
         return new_variable
 
 class ControlModuleSimulator(ControlModuleBase):
     # Implement ControlModuleBase functions
-    def __init__(self):
-        ControlModuleBase.__init__(self)
-        self.Balloon = Balloon_Simulator(leak=True, delay=False)          # This is the simulation
-        self._sensor_to_COPY()
+    def __init__(self, clock=None, seed=None):
+        ControlModuleBase.__init__(self, clock=clock)
+        self.Balloon = Balloon_Simulator(leak=True, delay=False, seed=seed)          # This is the simulation
+        self._publish_snapshot()
 
     def __SimulatedPropValve(self, x, dt):
         '''
@@ -680,64 +905,50 @@ class ControlModuleSimulator(ControlModuleBase):
         else:
             return 0
 
-    def _sensor_to_COPY(self):
+    def _sensor_values(self) -> SensorValues:
         # And the sensor measurements
-        self._lock.acquire()
-        self.COPY_sensor_values = SensorValues(pip=self._DATA_PIP,
-                                          peep=self._DATA_PEEP,
-                                          fio2=self.Balloon.fio2,
-                                          temp=self.Balloon.temperature,
-                                          humidity= self.Balloon.humidity,
-                                          pressure=self.Balloon.current_pressure,
-                                          vte=self._DATA_VTE,
-                                          breaths_per_minute=self._DATA_BPM,
-                                          inspiration_time_sec=self._DATA_I_PHASE,
-                                          timestamp=time.time(),
-                                          loop_counter = self._loop_counter)
-        self._lock.release()
-
-    def _start_mainloop(self):
-        # start running, this should be run as a thread! 
-        # Compare to initialization in Base Class!
+        return SensorValues(pip=self._DATA_PIP,
+                            peep=self._DATA_PEEP,
+                            fio2=self.Balloon.fio2,
+                            temp=self.Balloon.temperature,
+                            humidity= self.Balloon.humidity,
+                            pressure=self.Balloon.current_pressure,
+                            vte=self._DATA_VTE,
+                            breaths_per_minute=self._DATA_BPM,
+                            inspiration_time_sec=self._DATA_I_PHASE,
+                            timestamp=self._clock.time(),
+                            loop_counter = self._loop_counter)
 
-        update_copies = self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
+    def _control_step(self, dt):
+        sensor_start = time.perf_counter_ns()
+        self.Balloon.update(dt = dt)                            # Update the state of the balloon simulation
+        self._DATA_PRESSURE = self.Balloon.get_pressure()       # Get a pressure measurement from balloon and tell controller             --- SENSOR 1
 
-        while self._running:
-            time.sleep(self._LOOP_UPDATE_TIME)
-            self._loop_counter += 1
-            now = time.time()
-            dt = now - self._last_update                            # Time sincle last cycle of main-loop
+        pid_start = time.perf_counter_ns()
+        self._PID_update(dt = dt)                               # Update the PID Controller
 
-            self.Balloon.update(dt = dt)                            # Update the state of the balloon simulation
-            self._DATA_PRESSURE = self.Balloon.get_pressure()       # Get a pressure measurement from balloon and tell controller             --- SENSOR 1
+        actuate_start = time.perf_counter_ns()
+        x = self._get_control_signal_in()                       # Inspiratory side: get control signal for PropValve
+        Qin = self.__SimulatedPropValve(x, dt = dt)             # And calculate the produced flow Qin
 
-            self._PID_update(dt = dt)                               # Update the PID Controller
+        y = self._get_control_signal_out()                      # Expiratory side: get control signal for Solenoid
+        Qout = self.__SimulatedSolenoid(y)                      # Set expiratory flow rate, Qout
 
-            x = self._get_control_signal_in()                       # Inspiratory side: get control signal for PropValve
-            Qin = self.__SimulatedPropValve(x, dt = dt)             # And calculate the produced flow Qin
+        self.Balloon.set_flow(Qin, Qout)                        # Set the flow rates for the Balloon simulator
 
-            y = self._get_control_signal_out()                      # Expiratory side: get control signal for Solenoid
-            Qout = self.__SimulatedSolenoid(y)                      # Set expiratory flow rate, Qout
+        self._DATA_Qout = Qout                                  # Tell controller the expiratory flow rate, _DATA_Qout                    --- SENSOR 2
+        self._DATA_Qin = Qin                                    # Tell controller the expiratory flow rate, _DATA_Qin                     --- SENSOR 3
+        actuate_end = time.perf_counter_ns()
 
-            self.Balloon.set_flow(Qin, Qout)                        # Set the flow rates for the Balloon simulator
-
-            self._DATA_Qout = Qout                                  # Tell controller the expiratory flow rate, _DATA_Qout                    --- SENSOR 2
-            self._DATA_Qin = Qin                                    # Tell controller the expiratory flow rate, _DATA_Qin                     --- SENSOR 3
-            self._last_update = now
-
-            if update_copies == 0:
-                self._controls_from_COPY()     # Update controls from possibly updated values as a chunk
-                self._alarm_to_COPY()          # Copy current alarms and settings to COPY
-                self._sensor_to_COPY()         # Copy sensor values to COPY
-                update_copies = self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
-            else:
-                update_copies -= 1
+        self._loop_stats.record('sensor', pid_start - sensor_start)
+        self._loop_stats.record('pid', actuate_start - pid_start)
+        self._loop_stats.record('actuate', actuate_end - actuate_start)
 
 
 
 
-def get_control_module(sim_mode=False):
+def get_control_module(sim_mode=False, clock=None, seed=None):
     if sim_mode == True:
-        return ControlModuleSimulator()
+        return ControlModuleSimulator(clock=clock, seed=seed)
     else:
-        return ControlModuleDevice()
\ No newline at end of file
+        return ControlModuleDevice(clock=clock)
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Pushes what the controller publishes (sensor values, breath summaries, alarms and control settings) to subscribers,
+instead of having them poll for it.
+"""
+import itertools
+import queue
+import threading
+
+
+TOPICS = ('sensors', 'breath', 'alarms', 'controls')
+"""
+Topics published by the controller:
+
+* ``'sensors'``: :class:`~vent.common.message.SensorValues`, every iteration of the main-loop
+* ``'breath'``: dict with ``pip``, ``peep``, ``pip_time``, ``i_phase``, ``vte``, ``bpm``, ``timestamp`` and ``loop_counter``, after every breath
+* ``'alarms'``: :class:`~vent.common.message.Alarm`, when an alarm is raised (``is_active``) or resolved
+* ``'controls'``: :class:`~vent.common.message.ControlSetting`, when the controller applies a new setting
+"""
+
+MAX_PENDING = 4096
+"""
+Messages are dropped when this many are waiting for the dispatcher thread, eg. behind a slow callback
+"""
+
+
+class _Subscription:
+    __slots__ = ('topic', 'callback', 'decimation', 'count')
+
+    def __init__(self, topic, callback, decimation):
+        self.topic = topic
+        self.callback = callback
+        self.decimation = decimation
+        self.count = 0
+
+
+class Publisher:
+    """
+    Pushes messages from the control thread to subscribers, without ever blocking the control thread.
+
+    :meth:`.publish` only puts the message on a :class:`queue.Queue`, and only if somebody subscribed to the topic.
+    A dispatcher thread takes the messages off the queue, and calls the callbacks of the subscribers, every
+    ``decimation`` th message of the topic. A callback that raises is unsubscribed.
+
+    When :data:`MAX_PENDING` messages are waiting, because a callback is slow, new ones are dropped rather than
+    queued without bound, and counted in :attr:`.dropped`.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self.dropped = 0
+        self._subscriptions = {}
+        self._active_topics = frozenset()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._thread = None
+
+    def wants(self, topic) -> bool:
+        """ Whether anybody subscribed to ``topic``, to skip building messages nobody receives """
+        return topic in self._active_topics
+
+    def publish(self, topic, message):
+        if topic in self._active_topics:
+            try:
+                self._queue.put_nowait((topic, message))
+            except queue.Full:
+                self.dropped += 1
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        """
+        Args:
+            topic (str): one of :data:`TOPICS`
+            callback (callable): called as ``callback(topic, message)``, in the dispatcher thread
+            decimation (int): only pass on every ``decimation`` th message
+
+        Returns:
+            int: id of the subscription, for :meth:`.unsubscribe`
+        """
+        if topic not in TOPICS:
+            raise ValueError(f'Unknown topic {topic}, expected one of {TOPICS}')
+        if int(decimation) < 1:
+            raise ValueError('decimation must be at least 1')
+        with self._lock:
+            subscription_id = next(self._ids)
+            self._subscriptions[subscription_id] = _Subscription(topic, callback, int(decimation))
+            self._active_topics = frozenset(s.topic for s in self._subscriptions.values())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, daemon=True)
+                self._thread.start()
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        with self._lock:
+            self._subscriptions.pop(subscription_id, None)
+            self._active_topics = frozenset(s.topic for s in self._subscriptions.values())
+
+    def _dispatch(self):
+        while True:
+            topic, message = self._queue.get()
+            for subscription_id, subscription in list(self._subscriptions.items()):
+                if subscription.topic != topic:
+                    continue
+                subscription.count += 1
+                if subscription.count < subscription.decimation:
+                    continue
+                subscription.count = 0
+                try:
+                    subscription.callback(topic, message)
+                except Exception:
+                    self.unsubscribe(subscription_id)
@@ -0,0 +1,293 @@
+import time
+
+import numpy as np
+
+
+class Clock:
+    """
+    The wall clock, as used by the controller and simulator.
+
+    All time the controller sees goes through a clock, so it can be swapped for a :class:`.SteppedClock`
+    to run simulations faster than real time.
+
+    Attributes:
+        realtime (bool): Whether the clock follows real time.
+    """
+
+    realtime = True
+
+    def time(self) -> float:
+        """ Seconds since the epoch, see :func:`time.time` """
+        return time.time()
+
+    def monotonic(self) -> float:
+        """ Seconds on a clock that never goes backwards, see :func:`time.monotonic` """
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SteppedClock(Clock):
+    """
+    Virtual clock that only advances when slept on.
+
+    :meth:`.sleep` returns immediately after moving the clock forward, so a loop paced by a
+    :class:`.FixedRateScheduler` on this clock runs as fast as the CPU allows, with a fixed ``dt`` per
+    iteration, and gives the same results on every run.
+    """
+
+    realtime = False
+
+    def __init__(self, start=0.):
+        """
+        Args:
+            start (float): Initial time in seconds, returned by both :meth:`.time` and :meth:`.monotonic`
+        """
+        self._now = float(start)
+
+    def time(self) -> float:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._now += seconds
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+
+class FixedRateScheduler:
+    """
+    Paces a loop on absolute deadlines, instead of sleeping a fixed time after each iteration.
+
+    Deadlines are spaced by ``period`` on a monotonic clock, so the time spent doing work does not
+    add up to the loop period, and the loop doesn't drift.
+
+    If an iteration overran its deadline, the next :meth:`.wait` returns immediately to catch up.
+    If whole periods were missed, they are skipped (and counted in :attr:`.missed_deadlines`) rather than
+    run back-to-back.
+
+    Usage::
+
+        scheduler = FixedRateScheduler(period=0.01)
+        scheduler.start()
+        while running:
+            dt = scheduler.wait()
+            do_work(dt)
+    """
+
+    def __init__(self, period, spin_time=0., clock=None):
+        """
+        Args:
+            period (float): Time between deadlines in seconds
+            spin_time (float): The last ``spin_time`` seconds before a deadline are busy-waited instead of slept,
+                which trades CPU for sub-millisecond jitter. 0 to disable. Ignored if the clock is not realtime.
+            clock (:class:`.Clock`): Clock the deadlines are on, by default the wall clock.
+
+        Attributes:
+            missed_deadlines (int): Number of deadlines that passed before :meth:`.wait` was called
+            iterations (int): Number of times :meth:`.wait` returned since :meth:`.start`
+        """
+        self.period = period
+        self.clock = clock if clock is not None else Clock()
+        self.spin_time = spin_time if self.clock.realtime else 0.
+        self.missed_deadlines = 0
+        self.iterations = 0
+        self._next_deadline = None
+        self._last_wakeup = None
+
+    def start(self):
+        """ (Re)start the schedule, the first deadline is one period from now. """
+        now = self.clock.monotonic()
+        self._next_deadline = now + self.period
+        self._last_wakeup = now
+        self.missed_deadlines = 0
+        self.iterations = 0
+
+    def wait(self) -> float:
+        """
+        Block until the next deadline.
+
+        Returns:
+            float: Time in seconds since the previous call returned (or since :meth:`.start`)
+        """
+        if self._next_deadline is None:
+            self.start()
+
+        deadline = self._next_deadline
+        now = self.clock.monotonic()
+
+        if now > deadline:
+            # deadline passed while working, skip whole periods that can't be caught up anymore
+            missed = int((now - deadline) / self.period)
+            deadline += missed * self.period
+            self.missed_deadlines += missed + 1
+
+        remaining = deadline - now - self.spin_time
+        if remaining > 0:
+            self.clock.sleep(remaining)
+        if self.clock.realtime:
+            while self.clock.monotonic() < deadline:
+                pass
+
+        wakeup = self.clock.monotonic()
+        dt = wakeup - self._last_wakeup
+        self._last_wakeup = wakeup
+        self._next_deadline = deadline + self.period
+        self.iterations += 1
+        return dt
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations in nanoseconds, in the style of an HDR histogram.
+
+    Buckets are spaced logarithmically, with :attr:`.SUB_BUCKETS` linear sub-buckets per power of two,
+    so every recorded value is resolved to ~6% across the whole range (1 ns to ~17 s, larger values go to the last bucket).
+    Counts are kept in a preallocated array, recording a value does not allocate.
+    """
+
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    N_BUCKETS = 512
+
+    def __init__(self):
+        self.counts = np.zeros(self.N_BUCKETS, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def bucket_index(cls, value) -> int:
+        if value < 2 * cls.SUB_BUCKETS:
+            return max(int(value), 0)
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return min(shift * cls.SUB_BUCKETS + (value >> shift), cls.N_BUCKETS - 1)
+
+    @classmethod
+    def bucket_value(cls, index) -> int:
+        """ Lowest value that falls into bucket ``index`` """
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return (index - shift * cls.SUB_BUCKETS) << shift
+
+    def record(self, value):
+        """
+        Args:
+            value (int): duration in nanoseconds
+        """
+        self.counts[self.bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q) -> int:
+        """
+        Args:
+            q (float): percentile between 0 and 100
+
+        Returns:
+            int: lower bound of the bucket holding the ``q`` th percentile, in nanoseconds
+        """
+        if self.count == 0:
+            return 0
+        rank = max(int(np.ceil(self.count * q / 100.)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return self.bucket_value(index)
+
+    def summary(self) -> dict:
+        """ Summary statistics, in seconds """
+        if self.count == 0:
+            return {'count': 0, 'mean': None, 'min': None, 'max': None, 'p50': None, 'p99': None, 'p999': None}
+        return {'count': self.count,
+                'mean': self.total / self.count / 1e9,
+                'min': self.min / 1e9,
+                'max': self.max / 1e9,
+                'p50': self.percentile(50) / 1e9,
+                'p99': self.percentile(99) / 1e9,
+                'p999': self.percentile(99.9) / 1e9}
+
+
+class LoopStats:
+    """
+    Timing statistics of a control loop, gathered with :func:`time.perf_counter_ns`.
+
+    Keeps a :class:`.Histogram` each for the loop period, the jitter (deviation of the period from its target),
+    and the duration of each stage of an iteration, and counts iterations that took longer than the period.
+
+    Usage::
+
+        stats = LoopStats(period=0.01)
+        while running:
+            scheduler.wait()
+            stats.tick(time.perf_counter_ns())
+            start = time.perf_counter_ns()
+            read_sensors()
+            stats.record('sensor', time.perf_counter_ns() - start)
+            ...
+            stats.tock(time.perf_counter_ns())
+    """
+
+    STAGES = ('sensor', 'pid', 'actuate', 'sync')
+
+    def __init__(self, period):
+        """
+        Args:
+            period (float): Target loop period in seconds
+        """
+        self.period_ns = int(period * 1e9)
+        self.period = Histogram()
+        self.jitter = Histogram()
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.reset()
+
+    def reset(self):
+        self.period.reset()
+        self.jitter.reset()
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.overruns = 0
+        self._last_tick = None
+        self._tick = None
+
+    def tick(self, now):
+        """ Start of an iteration, ``now`` from :func:`time.perf_counter_ns` """
+        if self._last_tick is not None:
+            period = now - self._last_tick
+            self.period.record(period)
+            self.jitter.record(abs(period - self.period_ns))
+        self._last_tick = now
+        self._tick = now
+
+    def tock(self, now):
+        """ End of an iteration, ``now`` from :func:`time.perf_counter_ns` """
+        if self._tick is not None and now - self._tick > self.period_ns:
+            self.overruns += 1
+
+    def record(self, stage, duration):
+        """
+        Args:
+            stage (str): one of :attr:`.STAGES`
+            duration (int): in nanoseconds
+        """
+        self.stages[stage].record(duration)
+
+    def summary(self) -> dict:
+        return {'period_target': self.period_ns / 1e9,
+                'overruns': self.overruns,
+                'period': self.period.summary(),
+                'jitter': self.jitter.summary(),
+                'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()}}
@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+
+
+class WaveformBuffer:
+    """
+    Growable buffer holding the ``[time, pressure, volume]`` samples of one breath cycle.
+
+    Samples are written into a preallocated array. When the array is full its capacity is doubled,
+    so appending is O(1) amortized, instead of the O(N) copy of :func:`numpy.append`.
+
+    :meth:`.view` returns the filled part of the array without copying. Once a cycle is archived
+    the buffer must not be written to again -- start a new buffer with :meth:`.new_like`.
+    """
+
+    def __init__(self, capacity=1024, n_columns=3):
+        """
+        Args:
+            capacity (int): Number of samples to preallocate
+            n_columns (int): Number of values per sample
+        """
+        self._data = np.empty((max(int(capacity), 1), n_columns))
+        self._n = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._data.shape[0]
+
+    def append(self, sample):
+        """
+        Args:
+            sample (tuple, list, :class:`numpy.ndarray`): one sample, eg. ``(time, pressure, volume)``
+        """
+        if self._n == self._data.shape[0]:
+            grown = np.empty((2 * self._data.shape[0], self._data.shape[1]))
+            grown[:self._n] = self._data
+            self._data = grown
+        self._data[self._n] = sample
+        self._n += 1
+
+    def view(self) -> np.ndarray:
+        """ Zero-copy view of the samples written so far. """
+        return self._data[:self._n]
+
+    def archive(self) -> np.ndarray:
+        """ Read-only zero-copy view of the samples, to be stored once the cycle is over. """
+        view = self._data[:self._n]
+        view.flags.writeable = False
+        return view
+
+    def new_like(self):
+        """ Returns an empty buffer with the same capacity, so the next cycle doesn't have to grow again. """
+        return WaveformBuffer(capacity=self.capacity, n_columns=self._data.shape[1])
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        return self._data[:self._n][key]
+
+
+class BreathAnalyzer:
+    """
+    Streaming analysis of one breath cycle, updated with every ``(time, pressure, volume)`` sample.
+
+    Pressure samples are counted in a fixed histogram, which also keeps, per bin, the first and the last time a
+    sample fell into it. When the cycle is over, :meth:`.analyze` reads PIP, PEEP, PIP_TIME, I_PHASE, VTE and BPM off
+    the histogram and the running min/max, without going over the samples again.
+
+    PIP and PEEP are estimated as in the percentile heuristic of the controller: PEEP is the 20th percentile
+    of the pressures below the mean, PIP the 80th percentile of the pressures above it. Pressures are resolved to
+    ``resolution``, values outside of ``[p_min, p_max)`` are counted in the first or last bin. Non-finite pressures,
+    eg. a NaN from a failed sensor read, are left out of the pressure statistics.
+    """
+
+    def __init__(self, p_min=-20., p_max=80., resolution=0.1):
+        """
+        Args:
+            p_min (float): Lower edge of the pressure histogram, in cm H2O
+            p_max (float): Upper edge of the pressure histogram, in cm H2O
+            resolution (float): Width of a histogram bin, in cm H2O
+        """
+        self.p_min = p_min
+        self.resolution = resolution
+        self.n_bins = int(np.ceil((p_max - p_min) / resolution))
+        self._counts = np.zeros(self.n_bins, dtype=np.int64)
+        self._first_time = np.zeros(self.n_bins)
+        self._last_time = np.zeros(self.n_bins)
+        self._centers = p_min + (np.arange(self.n_bins) + 0.5) * resolution
+        self.reset()
+
+    def reset(self):
+        """ Start a new cycle """
+        self._counts[:] = 0
+        self._first_time[:] = np.inf
+        self._last_time[:] = -np.inf
+        self.n = 0
+        self._pressure_sum = 0.
+        self._volume_min = np.inf
+        self._volume_max = -np.inf
+        self._last_phase = 0.
+
+    def add(self, phase, pressure, volume):
+        """
+        Args:
+            phase (float): time since the start of the cycle, in seconds
+            pressure (float): in cm H2O
+            volume (float): in liters
+        """
+        if math.isfinite(pressure):
+            i = int((pressure - self.p_min) / self.resolution)
+            if i < 0:
+                i = 0
+            elif i >= self.n_bins:
+                i = self.n_bins - 1
+            self._counts[i] += 1
+            if phase < self._first_time[i]:
+                self._first_time[i] = phase
+            if phase > self._last_time[i]:
+                self._last_time[i] = phase
+
+            self.n += 1
+            self._pressure_sum += pressure
+        if volume < self._volume_min:
+            self._volume_min = volume
+        if volume > self._volume_max:
+            self._volume_max = volume
+        self._last_phase = phase
+
+    def _percentile(self, cumulative, start, end, q):
+        # Center of the bin holding the q-th percentile of the samples counted in bins [start, end),
+        # read off the cumulative histogram of the whole cycle
+        offset = cumulative[start - 1] if start > 0 else 0
+        total = (cumulative[end - 1] if end > 0 else 0) - offset
+        if total <= 0:
+            return None
+        rank = max(int(np.ceil(total * q / 100.)), 1)
+        return float(self._centers[np.searchsorted(cumulative, offset + rank)])
+
+    def analyze(self) -> dict:
+        """
+        Reads the cycle off the histogram: one cumulative sum and a few searches over the ``n_bins`` bins, ie.
+        O(n_bins) once per breath however many samples were added, against the O(1) of :meth:`.add` per sample.
+
+        Returns:
+            dict: ``pip``, ``peep``, ``pip_time``, ``i_phase``, ``vte`` and ``bpm`` of the cycle,
+            or None if fewer than two samples with a finite pressure were added.
+        """
+        if self.n < 2:
+            return None
+
+        mean = self._pressure_sum / self.n
+        mean_bin = int((mean - self.p_min) / self.resolution)
+        cumulative = np.cumsum(self._counts)
+
+        # bins below the one of the mean, and above it
+        peep = self._percentile(cumulative, 0, min(max(mean_bin, 0), self.n_bins), 20)
+        pip = self._percentile(cumulative, min(max(mean_bin + 1, 0), self.n_bins), self.n_bins, 80)
+        if peep is None:
+            peep = mean
+        if pip is None:
+            pip = mean
+
+        # bins above 90% of PIP, for the time of reaching PIP and leaving PIP.
+        # If none of them holds a sample (eg. a negative PIP), fall back to the highest bin that does.
+        threshold_bin = min(max(int((0.9 * pip - self.p_min) / self.resolution), 0), self.n_bins - 1)
+        if cumulative[-1] - (cumulative[threshold_bin - 1] if threshold_bin > 0 else 0) == 0:
+            threshold_bin = int(np.flatnonzero(self._counts)[-1])
+        pip_time = float(self._first_time[threshold_bin:].min())
+        i_phase = float(self._last_time[threshold_bin:].max())
+
+        return {'pip': pip,
+                'peep': peep,
+                'pip_time': pip_time,
+                'i_phase': i_phase,
+                'vte': self._volume_max - self._volume_min,
+                'bpm': 60. / self._last_phase if self._last_phase > 0 else None}
@@ -1,21 +1,88 @@
-import pickle
 import threading
+import weakref
 from typing import List, Dict
 
 import vent
 import vent.controller.control_module
 from vent.common.message import ControlSetting, Alarm
 from vent.common.message import SensorValueNew
+from vent.common import sample_ring
 from vent.common.values import ValueName
+from vent.coordinator.ipc import IPCClient
 from vent.coordinator.process_manager import ProcessManager
 from vent.coordinator.rpc import get_rpc_client
+from vent.coordinator.subscription import SubscriptionClient
+
+
+SENSOR_FIELDS = {
+    ValueName.PIP: 'pip',
+    ValueName.PEEP: 'peep',
+    ValueName.FIO2: 'fio2',
+    ValueName.TEMP: 'temp',
+    ValueName.HUMIDITY: 'humidity',
+    ValueName.PRESSURE: 'pressure',
+    ValueName.VTE: 'vte',
+    ValueName.BREATHS_PER_MINUTE: 'breaths_per_minute',
+    ValueName.INSPIRATION_TIME_SEC: 'inspiration_time_sec',
+}
+"""
+Attribute of :class:`~vent.common.message.SensorValues` for each :class:`~vent.common.values.ValueName` of a sensor
+"""
+
+
+def sensor_dict(sensor_values) -> Dict[ValueName, SensorValueNew]:
+    """
+    The :class:`~vent.common.message.SensorValues` of the controller, as a dictionary of
+    :class:`~vent.common.message.SensorValueNew` by :class:`~vent.common.values.ValueName`
+    """
+    return {name: SensorValueNew(name, getattr(sensor_values, field), sensor_values.timestamp,
+                                 sensor_values.loop_counter)
+            for name, field in SENSOR_FIELDS.items()}
+
+
+class _SensorCache:
+    # The SensorValueNew of the latest loop counter, built once and shared by all callers of get_sensors
+    def __init__(self):
+        # (loop counter, timestamp), SensorValueNew by ValueName built for it, and all of them once built
+        self._built = (None, {}, None)
+
+    def sensor_dict(self, sensor_values) -> Dict[ValueName, SensorValueNew]:
+        """
+        Like :func:`sensor_dict`, but only with the values a delta holds (see
+        :meth:`.SensorValues.is_changed <vent.common.message.SensorValues.is_changed>`), and empty if
+        ``sensor_values`` is None.
+        """
+        if sensor_values is None:
+            return {}
+        # keyed by the timestamp too, loop counters start over when the control process is restarted
+        key = (sensor_values.loop_counter, sensor_values.timestamp)
+        delta = sensor_values.changed is not None
+        built_key, built, full = self._built
+        if built_key == key:
+            if full is not None and not delta:
+                return full
+        else:
+            built, full = {}, None
+            self._built = (key, built, full)
+        result = {}
+        for name, field in SENSOR_FIELDS.items():
+            if delta and not sensor_values.is_changed(field):
+                continue
+            sensor_value = built.get(name)
+            if sensor_value is None:
+                sensor_value = built[name] = SensorValueNew(name, getattr(sensor_values, field),
+                                                            sensor_values.timestamp, sensor_values.loop_counter)
+            result[name] = sensor_value
+        if not delta:
+            self._built = (key, built, result)
+        return result
 
 
 class CoordinatorBase:
     def __init__(self, sim_mode=False):
         # get_ui_control_module handles single_process flag
         # self.lock = threading.Lock()
-        pass
+        self._sensor_cache = _SensorCache()
 
     # TODO: do we still need this
     # def get_msg_timestamp(self):
@@ -25,7 +92,20 @@ class CoordinatorBase:
     #     return last_message_timestamp
 
 
-    def get_sensors(self) -> Dict[ValueName, SensorValueNew]:
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None) -> Dict[ValueName, SensorValueNew]:
+        """
+        The sensor values of the controller, by :class:`~vent.common.values.ValueName`.
+
+        The dictionary of one loop counter, and its :class:`~vent.common.message.SensorValueNew`, are built once,
+        and shared by all callers, do not modify them.
+
+        Args:
+            since_loop_counter (int): ``loop_counter`` of the values returned by a previous call. If given, only the
+                values that changed since are returned, to be merged into those of the previous call: none if the
+                controller didn't publish new values, all of them if the previous ones are too old to compare to.
+            since_timestamp (float): ``timestamp`` of these values. Loop counters start over when the control
+                process is restarted, so the previous values are only compared to if both match.
+        """
         pass
 
     def get_active_alarms(self) -> Dict[str, Alarm]:
@@ -43,6 +123,21 @@ class CoordinatorBase:
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
         pass
 
+    def get_loop_stats(self) -> dict:
+        pass
+
+    def get_samples(self, since=None):
+        pass
+
+    def get_state(self, since_version=None) -> dict:
+        pass
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        pass
+
+    def unsubscribe(self, subscription_id):
+        pass
+
     def start(self):
         pass
 
@@ -53,43 +148,25 @@ class CoordinatorBase:
         pass
 
 class CoordinatorLocal(CoordinatorBase):
-    def __init__(self, sim_mode=False):
+    def __init__(self, sim_mode=False, control_module=None):
         """
 
         Args:
             sim_mode:
+            control_module (:class:`~vent.controller.control_module.ControlModuleBase`): the controller to run,
+                eg. one on a :class:`~vent.controller.timing.SteppedClock`, made from ``sim_mode`` if None
 
         Attributes:
             _is_running (:class:`threading.Event`): ``.set()`` when thread should stop
 
         """
         super().__init__(sim_mode=sim_mode)
-        self.control_module = vent.controller.control_module.get_control_module(sim_mode)
-
-    def get_sensors(self) -> Dict[ValueName, SensorValueNew]:
-        sensor_values = self.control_module.get_sensors()
-        res = {
-            ValueName.PIP: SensorValueNew(ValueName.PIP, sensor_values.pip, sensor_values.timestamp,
-                                          sensor_values.loop_counter),
-            ValueName.PEEP: SensorValueNew(ValueName.PEEP, sensor_values.peep, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.FIO2: SensorValueNew(ValueName.FIO2, sensor_values.fio2, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.TEMP: SensorValueNew(ValueName.TEMP, sensor_values.temp, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.HUMIDITY: SensorValueNew(ValueName.HUMIDITY, sensor_values.humidity, sensor_values.timestamp,
-                                               sensor_values.loop_counter),
-            ValueName.PRESSURE: SensorValueNew(ValueName.PRESSURE, sensor_values.pressure, sensor_values.timestamp,
-                                               sensor_values.loop_counter),
-            ValueName.VTE: SensorValueNew(ValueName.VTE, sensor_values.vte, sensor_values.timestamp,
-                                          sensor_values.loop_counter),
-            ValueName.BREATHS_PER_MINUTE: SensorValueNew(ValueName.BREATHS_PER_MINUTE, sensor_values.breaths_per_minute,
-                                                         sensor_values.timestamp, sensor_values.loop_counter),
-            ValueName.INSPIRATION_TIME_SEC: SensorValueNew(ValueName.INSPIRATION_TIME_SEC,
-                                                           sensor_values.inspiration_time_sec, sensor_values.timestamp,
-                                                           sensor_values.loop_counter),
-        }
-        return res
+        if control_module is None:
+            control_module = vent.controller.control_module.get_control_module(sim_mode)
+        self.control_module = control_module
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None) -> Dict[ValueName, SensorValueNew]:
+        return self._sensor_cache.sensor_dict(self.control_module.get_sensors(since_loop_counter, since_timestamp))
 
     def get_active_alarms(self) -> Dict[str, Alarm]:
         return self.control_module.get_active_alarms()
@@ -107,6 +184,48 @@ class CoordinatorLocal(CoordinatorBase):
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
         return self.control_module.get_control(control_setting_name)
 
+    def get_loop_stats(self) -> dict:
+        return self.control_module.get_loop_stats()
+
+    def get_samples(self, since=None):
+        """
+        Samples of every iteration of the control loop since a previous call,
+        see :meth:`.SampleRing.read <vent.common.sample_ring.SampleRing.read>`
+        """
+        return self.control_module.get_samples(since)
+
+    def get_state(self, since_version=None) -> dict:
+        """
+        Sensor values, alarms and controls from one snapshot of the controller, and its loop statistics, in one call.
+        See :meth:`.ControlModuleBase.get_state <vent.controller.control_module.ControlModuleBase.get_state>`,
+        sensors are returned as by :meth:`.get_sensors`.
+
+        Args:
+            since_version (int): ``version`` returned by a previous call, to only get sections that changed since
+        """
+        state = self.control_module.get_state(since_version)
+        if state['sensors'] is not None:
+            state['sensors'] = self._sensor_cache.sensor_dict(state['sensors'])
+        return state
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        """
+        Push messages of the controller to ``callback`` instead of polling for them.
+        See :meth:`.ControlModuleBase.subscribe <vent.controller.control_module.ControlModuleBase.subscribe>`.
+
+        Args:
+            topic (str): one of :data:`~vent.controller.publisher.TOPICS`
+            callback (callable): called as ``callback(topic, message)``, in a thread of the coordinator
+            decimation (int): only receive every ``decimation`` th message
+
+        Returns:
+            int: id of the subscription, for :meth:`.unsubscribe`
+        """
+        return self.control_module.subscribe(topic, callback, decimation)
+
+    def unsubscribe(self, subscription_id):
+        self.control_module.unsubscribe(subscription_id)
+
     def start(self):
         """
         Start the coordinator.
@@ -129,58 +248,115 @@ class CoordinatorLocal(CoordinatorBase):
 
 
 class CoordinatorRemote(CoordinatorBase):
-    def __init__(self, sim_mode=False):
+    def __init__(self, sim_mode=False, transport='xmlrpc', max_heartbeat_interval=None):
+        """
+
+        Args:
+            sim_mode:
+            transport (str): 'xmlrpc' for XML-RPC over localhost TCP (see :mod:`.rpc`),
+                'ipc' for binary messages over a Unix socket (see :mod:`.ipc`)
+            max_heartbeat_interval (float): if given, restart the control process when its loop stalls for this
+                many seconds, warm-started with the settings and alarms of the previous one
+                (see :class:`~vent.coordinator.process_manager.ProcessManager`)
+        """
         super().__init__(sim_mode=sim_mode)
-        # TODO: according to documentation, pass max_heartbeat_interval?
-        self.process_manager = ProcessManager(sim_mode)
-        self.rpc_client = get_rpc_client()
-        # TODO: make sure the ipc connection is setup. There should be a clever method
-
-    def get_sensors(self) -> Dict[ValueName, SensorValueNew]:
-        sensor_values = pickle.loads(self.rpc_client.get_sensors().data)
-        res = {
-            ValueName.PIP: SensorValueNew(ValueName.PIP, sensor_values.pip, sensor_values.timestamp,
-                                          sensor_values.loop_counter),
-            ValueName.PEEP: SensorValueNew(ValueName.PEEP, sensor_values.peep, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.FIO2: SensorValueNew(ValueName.FIO2, sensor_values.fio2, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.TEMP: SensorValueNew(ValueName.TEMP, sensor_values.temp, sensor_values.timestamp,
-                                           sensor_values.loop_counter),
-            ValueName.HUMIDITY: SensorValueNew(ValueName.HUMIDITY, sensor_values.humidity, sensor_values.timestamp,
-                                               sensor_values.loop_counter),
-            ValueName.PRESSURE: SensorValueNew(ValueName.PRESSURE, sensor_values.pressure, sensor_values.timestamp,
-                                               sensor_values.loop_counter),
-            ValueName.VTE: SensorValueNew(ValueName.VTE, sensor_values.vte, sensor_values.timestamp,
-                                          sensor_values.loop_counter),
-            ValueName.BREATHS_PER_MINUTE: SensorValueNew(ValueName.BREATHS_PER_MINUTE, sensor_values.breaths_per_minute,
-                                                         sensor_values.timestamp, sensor_values.loop_counter),
-            ValueName.INSPIRATION_TIME_SEC: SensorValueNew(ValueName.INSPIRATION_TIME_SEC,
-                                                           sensor_values.inspiration_time_sec, sensor_values.timestamp,
-                                                           sensor_values.loop_counter),
-        }
-        return res
+        # The control process writes the samples of its loop into a ring in shared memory, owned by this process
+        self.sample_ring = None
+        if sample_ring.shared_memory is not None:
+            self.sample_ring = sample_ring.SampleRing.create_shared()
+            weakref.finalize(self, self.sample_ring.unlink)
+        self.process_manager = ProcessManager(sim_mode, maxHeartbeatInterval=max_heartbeat_interval, transport=transport,
+                                              sample_ring_name=self.sample_ring.name if self.sample_ring else None)
+        # requests only go out once the control process listens
+        self.process_manager.wait_until_ready()
+        if transport == 'ipc':
+            self.rpc_client = IPCClient()
+        else:
+            self.rpc_client = get_rpc_client()
+        # Pushed messages come over their own socket, connected on the first subscription
+        self.subscription_client = SubscriptionClient()
+        weakref.finalize(self, self.subscription_client.close)
+        # Settings requested through this coordinator, which the controller may not have applied yet
+        self._requested_controls = {}
+        if max_heartbeat_interval is not None:
+            self.process_manager.watch(self._liveness, self._checkpoint)
+
+    def _liveness(self) -> int:
+        # Advances with every iteration of the control loop, read from shared memory if possible
+        if self.sample_ring is not None:
+            return self.sample_ring.write_count
+        return self.rpc_client.get_loop_stats()['loop_counter']
+
+    def _checkpoint(self) -> dict:
+        # Settings and alarms of the control process, to warm start the next one after a restart
+        state = self.rpc_client.get_state()
+        controls = dict(state['controls'])
+        controls.update(self._requested_controls)
+        return {'running': self.rpc_client.is_running(),
+                'controls': list(controls.values()),
+                'active_alarms': list(state['active_alarms'].values()),
+                'logged_alarms': state['logged_alarms']}
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None) -> Dict[ValueName, SensorValueNew]:
+        """
+        See :meth:`.CoordinatorBase.get_sensors`, the control process only sends the values that changed
+        """
+        return self._sensor_cache.sensor_dict(self.rpc_client.get_sensors(since_loop_counter, since_timestamp))
 
     def get_active_alarms(self) -> Dict[str, Alarm]:
-        pickled_res = self.rpc_client.get_active_alarms().data
-        return pickle.loads(pickled_res)
+        return self.rpc_client.get_active_alarms()
 
     def get_logged_alarms(self) -> List[Alarm]:
-        pickled_res = self.rpc_client.get_logged_alarms().data
-        return pickle.loads(pickled_res)
+        return self.rpc_client.get_logged_alarms()
 
     def clear_logged_alarms(self):
         # TODO: implement this
         raise NotImplementedError
 
     def set_control(self, control_setting: ControlSetting):
-        pickled_args = pickle.dumps(control_setting)
-        self.rpc_client.set_control(pickled_args)
+        self.rpc_client.set_control(control_setting)
+        self._requested_controls[control_setting.name] = control_setting
+        self.process_manager.save_checkpoint()
 
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
-        pickled_args = pickle.dumps(control_setting_name)
-        pickled_res = self.rpc_client.get_control(pickled_args).data
-        return pickle.loads(pickled_res)
+        return self.rpc_client.get_control(control_setting_name)
+
+    def get_loop_stats(self) -> dict:
+        return self.rpc_client.get_loop_stats()
+
+    def get_samples(self, since=None):
+        """
+        Samples of every iteration of the control loop since a previous call, read from shared memory without copying,
+        see :meth:`.SampleRing.read <vent.common.sample_ring.SampleRing.read>`
+        """
+        if self.sample_ring is None:
+            raise NotImplementedError('Reading samples from the control process needs multiprocessing.shared_memory, Python 3.8+')
+        return self.sample_ring.read(since)
+
+    def get_state(self, since_version=None) -> dict:
+        """
+        Sensor values, alarms and controls from one snapshot of the controller, and its loop statistics, in one call.
+        See :meth:`.ControlModuleBase.get_state <vent.controller.control_module.ControlModuleBase.get_state>`,
+        sensors are returned as by :meth:`.get_sensors`.
+
+        Args:
+            since_version (int): ``version`` returned by a previous call, to only get sections that changed since
+        """
+        state = self.rpc_client.get_state(since_version)
+        if state['sensors'] is not None:
+            state['sensors'] = self._sensor_cache.sensor_dict(state['sensors'])
+        return state
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        """
+        Push messages of the control process to ``callback`` instead of polling for them, over the socket of
+        :mod:`.subscription`. Callbacks are called in a reader thread of the coordinator.
+        See :meth:`.CoordinatorLocal.subscribe`.
+        """
+        return self.subscription_client.subscribe(topic, callback, decimation)
+
+    def unsubscribe(self, subscription_id):
+        self.subscription_client.unsubscribe(subscription_id)
 
     def start(self):
         """
@@ -188,6 +364,7 @@ class CoordinatorRemote(CoordinatorBase):
         This does a soft start (not allocating a process).
         """
         self.rpc_client.start()
+        self.process_manager.save_checkpoint()
 
     def is_running(self) -> bool:
         """
@@ -201,10 +378,22 @@ class CoordinatorRemote(CoordinatorBase):
         This does a soft stop (not kill a process)
         """
         self.rpc_client.stop()
-
-
-def get_coordinator(single_process=False, sim_mode=False) -> CoordinatorBase:
+        self.process_manager.save_checkpoint()
+
+
+def get_coordinator(single_process=False, sim_mode=False, transport='xmlrpc', max_heartbeat_interval=None,
+                    control_module=None) -> CoordinatorBase:
+    """
+    Args:
+        single_process (bool): Run the controller in a thread of this process, otherwise in a separate process
+        sim_mode (bool): Simulate the lungs instead of driving the hardware
+        transport (str): Transport to the control process if not ``single_process``, 'xmlrpc' or 'ipc'
+        max_heartbeat_interval (float): Restart a stalled control process, if not ``single_process``,
+            see :class:`.CoordinatorRemote`
+        control_module (:class:`~vent.controller.control_module.ControlModuleBase`): the controller to run if
+            ``single_process``, see :class:`.CoordinatorLocal`
+    """
     if single_process:
-        return CoordinatorLocal(sim_mode)
+        return CoordinatorLocal(sim_mode, control_module=control_module)
     else:
-        return CoordinatorRemote(sim_mode)
+        return CoordinatorRemote(sim_mode, transport=transport, max_heartbeat_interval=max_heartbeat_interval)
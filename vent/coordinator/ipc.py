@@ -0,0 +1,388 @@
+"""
+Binary transport between the coordinator and the control process, over a Unix domain socket.
+
+Messages are framed with a 5-byte header, the length of the payload (uint32) and an opcode (uint8), followed by
+the payload. Every request gets exactly one response, whose opcode is :data:`STATUS_OK` or :data:`STATUS_ERROR`.
+
+Messages of :mod:`vent.common.message` are sent in their binary layout (see ``DTYPE`` of each),
+lists of them as arrays of records.
+
+``get_sensors`` is sent the loop counter and timestamp of the sensor values the client has (-1 and NaN for none),
+and answers with the sensor values, or nothing if they didn't change.
+
+Loop statistics are nested dicts without a fixed layout and are sent as JSON. The state returned by
+``get_state`` is sent as its version, flags for the sections that are included, and each included section
+prefixed with its length.
+
+The server side is :func:`ipc_server_main`, the client side :class:`IPCClient`, which has the same interface as
+:class:`~vent.coordinator.rpc.RPCClient`.
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+import vent.controller.control_module
+from vent.common.message import SensorValues, ControlSetting, Alarm
+from vent.common.sample_ring import SampleRing
+from vent.common.values import ValueName
+
+default_path = os.path.join(tempfile.gettempdir(), 'vent_coordinator.sock')
+
+# Seconds a client may take to send the rest of a request, or to read the response, before its connection is dropped
+CLIENT_TIMEOUT = 5.
+
+# Opcodes of requests
+GET_SENSORS = 1
+GET_ACTIVE_ALARMS = 2
+GET_LOGGED_ALARMS = 3
+SET_CONTROL = 4
+GET_CONTROL = 5
+GET_LOOP_STATS = 6
+START = 7
+IS_RUNNING = 8
+STOP = 9
+GET_STATE = 10
+
+# Opcodes of responses
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_HEADER_STRUCT = struct.Struct('<IB')
+_VALUE_NAME_STRUCT = struct.Struct('<B')
+_BOOL_STRUCT = struct.Struct('<?')
+_VERSION_STRUCT = struct.Struct('<q')
+_SENSOR_KEY_STRUCT = struct.Struct('<qd')
+_STATE_STRUCT = struct.Struct('<qB')
+_LENGTH_STRUCT = struct.Struct('<I')
+
+# Sections of the state, in the order they are sent
+_STATE_SECTIONS = ('sensors', 'active_alarms', 'logged_alarms', 'controls')
+
+
+def encode_sensor_values(sensor_values: SensorValues) -> bytes:
+    return sensor_values.to_bytes()
+
+
+def decode_sensor_values(data) -> SensorValues:
+    return SensorValues.from_bytes(data)
+
+
+def _encode_optional_sensor_values(sensor_values) -> bytes:
+    # None, when the sensor values did not change, as an empty payload
+    return b'' if sensor_values is None else encode_sensor_values(sensor_values)
+
+
+def _decode_optional_sensor_values(data):
+    return decode_sensor_values(data) if len(data) else None
+
+
+def _encode_version(version) -> bytes:
+    return _VERSION_STRUCT.pack(-1 if version is None else version)
+
+
+def _decode_version(data):
+    version, = _VERSION_STRUCT.unpack(data)
+    return None if version == -1 else version
+
+
+def _encode_sensor_key(loop_counter, timestamp) -> bytes:
+    # loop counter and timestamp of previous sensor values, -1 and NaN for none
+    return _SENSOR_KEY_STRUCT.pack(-1 if loop_counter is None else loop_counter,
+                                   float('nan') if timestamp is None else timestamp)
+
+
+def _decode_sensor_key(data):
+    loop_counter, timestamp = _SENSOR_KEY_STRUCT.unpack(data)
+    return None if loop_counter == -1 else loop_counter, None if timestamp != timestamp else timestamp
+
+
+def encode_value_name(name: ValueName) -> bytes:
+    return _VALUE_NAME_STRUCT.pack(name.value)
+
+
+def decode_value_name(data) -> ValueName:
+    return ValueName(_VALUE_NAME_STRUCT.unpack(data)[0])
+
+
+def encode_control_setting(control_setting: ControlSetting) -> bytes:
+    return control_setting.to_bytes()
+
+
+def decode_control_setting(data) -> ControlSetting:
+    return ControlSetting.from_bytes(data)
+
+
+def encode_alarms(alarms) -> bytes:
+    """
+    Args:
+        alarms (list): of :class:`~vent.common.message.Alarm`
+    """
+    return Alarm.encode_batch(alarms)
+
+
+def decode_alarms(data) -> list:
+    return Alarm.decode_batch(data)
+
+
+def encode_controls(controls) -> bytes:
+    """
+    Args:
+        controls (list): of :class:`~vent.common.message.ControlSetting`
+    """
+    return ControlSetting.encode_batch(controls)
+
+
+def decode_controls(data) -> list:
+    return ControlSetting.decode_batch(data)
+
+
+_STATE_ENCODERS = {
+    'sensors': encode_sensor_values,
+    'active_alarms': lambda alarms: encode_alarms(list(alarms.values())),
+    'logged_alarms': encode_alarms,
+    'controls': lambda controls: encode_controls(list(controls.values())),
+}
+
+_STATE_DECODERS = {
+    'sensors': decode_sensor_values,
+    'active_alarms': lambda data: {alarm.alarm_name: alarm for alarm in decode_alarms(data)},
+    'logged_alarms': decode_alarms,
+    'controls': lambda data: {control.name: control for control in decode_controls(data)},
+}
+
+
+def encode_state(state: dict) -> bytes:
+    """
+    Args:
+        state (dict): as returned by :meth:`~vent.controller.control_module.ControlModuleBase.get_state`
+    """
+    flags = 0
+    chunks = []
+    for bit, section in enumerate(_STATE_SECTIONS):
+        if state[section] is not None:
+            flags |= 1 << bit
+            encoded = _STATE_ENCODERS[section](state[section])
+            chunks.append(_LENGTH_STRUCT.pack(len(encoded)))
+            chunks.append(encoded)
+    chunks.append(json.dumps(state['loop_stats']).encode('utf-8'))
+    return _STATE_STRUCT.pack(state['version'], flags) + b''.join(chunks)
+
+
+def decode_state(data) -> dict:
+    data = memoryview(data)
+    version, flags = _STATE_STRUCT.unpack_from(data)
+    offset = _STATE_STRUCT.size
+    state = {'version': version}
+    for bit, section in enumerate(_STATE_SECTIONS):
+        if flags & (1 << bit):
+            length, = _LENGTH_STRUCT.unpack_from(data, offset)
+            offset += _LENGTH_STRUCT.size
+            state[section] = _STATE_DECODERS[section](data[offset:offset + length])
+            offset += length
+        else:
+            state[section] = None
+    state['loop_stats'] = json.loads(bytes(data[offset:]).decode('utf-8'))
+    return state
+
+
+def _recv_exact(sock, n) -> bytearray:
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        chunk = sock.recv_into(view[received:])
+        if chunk == 0:
+            raise ConnectionResetError('Connection closed by peer')
+        received += chunk
+    return buffer
+
+
+HEADER_SIZE = _HEADER_STRUCT.size
+
+
+def pack_message(opcode, payload=b'') -> bytes:
+    """ Header and payload of a message, as sent over the socket """
+    return _HEADER_STRUCT.pack(len(payload), opcode) + payload
+
+
+def unpack_header(data):
+    """
+    Returns:
+        tuple: length of the payload, opcode
+    """
+    return _HEADER_STRUCT.unpack(data)
+
+
+def send_message(sock, opcode, payload=b''):
+    sock.sendall(pack_message(opcode, payload))
+
+
+def recv_message(sock):
+    """
+    Returns:
+        tuple: opcode, payload
+    """
+    length, opcode = unpack_header(_recv_exact(sock, HEADER_SIZE))
+    payload = _recv_exact(sock, length) if length else b''
+    return opcode, payload
+
+
+class _IPCRequestHandler(socketserver.BaseRequestHandler):
+    # One thread per connection, serving requests until the client hangs up
+    def handle(self):
+        controller = self.server.controller
+        handlers = {
+            GET_SENSORS: lambda payload: _encode_optional_sensor_values(controller.get_sensors(*_decode_sensor_key(payload))),
+            GET_ACTIVE_ALARMS: lambda payload: encode_alarms(list(controller.get_active_alarms().values())),
+            GET_LOGGED_ALARMS: lambda payload: encode_alarms(controller.get_logged_alarms()),
+            SET_CONTROL: lambda payload: controller.set_control(decode_control_setting(payload)),
+            GET_CONTROL: lambda payload: encode_control_setting(controller.get_control(decode_value_name(payload))),
+            GET_LOOP_STATS: lambda payload: json.dumps(controller.get_loop_stats()).encode('utf-8'),
+            START: lambda payload: controller.start(),
+            IS_RUNNING: lambda payload: _BOOL_STRUCT.pack(bool(controller.is_running())),
+            STOP: lambda payload: controller.stop(),
+            GET_STATE: lambda payload: encode_state(controller.get_state(_decode_version(payload))),
+        }
+        while True:
+            try:
+                # a client may idle between requests, but not stall within one
+                self.request.settimeout(None)
+                length, opcode = unpack_header(_recv_exact(self.request, HEADER_SIZE))
+                self.request.settimeout(CLIENT_TIMEOUT)
+                payload = _recv_exact(self.request, length) if length else b''
+                try:
+                    response = handlers[opcode](payload)
+                except Exception as e:
+                    send_message(self.request, STATUS_ERROR, f'{type(e).__name__}: {e}'.encode('utf-8'))
+                else:
+                    send_message(self.request, STATUS_OK, response or b'')
+            except OSError:
+                # hung up, or timed out
+                return
+
+
+class _IPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def ipc_server_main(sim_mode, path=default_path, sample_ring_name=None, checkpoint=None, ready=None):
+    """
+    Run the control module, and serve it on the Unix socket at ``path``. Blocks forever.
+
+    Args:
+        sample_ring_name (str): if given, the control module writes its samples into this shared
+            :class:`~vent.common.sample_ring.SampleRing`
+        checkpoint (dict): if given, warm start the control module from the checkpoint of the previous one,
+            see :class:`~vent.coordinator.process_manager.ProcessManager`
+        ready (:class:`multiprocessing.connection.Connection`): if given, sent ``True`` once the server listens
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = _IPCServer(path, _IPCRequestHandler)
+    server.controller = vent.controller.control_module.get_control_module(sim_mode)
+    if sample_ring_name is not None:
+        server.controller.set_sample_ring(SampleRing.attach(sample_ring_name))
+    if checkpoint is not None:
+        server.controller.restore(checkpoint['controls'], checkpoint['active_alarms'], checkpoint['logged_alarms'])
+        if checkpoint['running']:
+            server.controller.start()
+    # imported here, vent.coordinator.subscription depends on this module
+    from vent.coordinator.subscription import start_subscription_server
+    start_subscription_server(server.controller)
+    if ready is not None:
+        ready.send(True)
+        ready.close()
+    server.serve_forever()
+
+
+class IPCClient:
+    """
+    Client side of the binary transport, one persistent connection to the control process.
+
+    Calls are thread-safe, and block until the response is received. If the connection was broken since the last
+    call, eg. because the control process was restarted, the call connects again and is retried once. If it breaks
+    during the call, or the call times out, the call raises, and the next call connects again.
+    """
+
+    def __init__(self, path=default_path, timeout=5.):
+        """
+        Args:
+            path (str): Path of the Unix socket of the control process
+            timeout (float): Seconds to wait for a response before raising :class:`socket.timeout`
+        """
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def _call(self, opcode, payload=b''):
+        with self._lock:
+            # a connection from a previous call may have been closed by the other side since
+            retry = self._sock is not None
+            while True:
+                if self._sock is None:
+                    self._connect()
+                try:
+                    send_message(self._sock, opcode, payload)
+                    status, response = recv_message(self._sock)
+                    break
+                except OSError as e:
+                    self._sock.close()
+                    self._sock = None
+                    if not (retry and isinstance(e, ConnectionError)):
+                        raise
+                    retry = False
+        if status == STATUS_ERROR:
+            raise RuntimeError(bytes(response).decode('utf-8'))
+        return response
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None) -> SensorValues:
+        return _decode_optional_sensor_values(self._call(GET_SENSORS, _encode_sensor_key(since_loop_counter,
+                                                                                          since_timestamp)))
+
+    def get_active_alarms(self) -> dict:
+        return {alarm.alarm_name: alarm for alarm in decode_alarms(self._call(GET_ACTIVE_ALARMS))}
+
+    def get_logged_alarms(self) -> list:
+        return decode_alarms(self._call(GET_LOGGED_ALARMS))
+
+    def set_control(self, control_setting: ControlSetting):
+        self._call(SET_CONTROL, encode_control_setting(control_setting))
+
+    def get_control(self, control_setting_name: ValueName) -> ControlSetting:
+        return decode_control_setting(self._call(GET_CONTROL, encode_value_name(control_setting_name)))
+
+    def get_loop_stats(self) -> dict:
+        return json.loads(bytes(self._call(GET_LOOP_STATS)).decode('utf-8'))
+
+    def get_state(self, since_version=None) -> dict:
+        return decode_state(self._call(GET_STATE, _encode_version(since_version)))
+
+    def start(self):
+        self._call(START)
+
+    def is_running(self) -> bool:
+        return _BOOL_STRUCT.unpack(self._call(IS_RUNNING))[0]
+
+    def stop(self):
+        self._call(STOP)
@@ -1,32 +1,131 @@
 import multiprocessing
+import threading
 import time
 
-from vent.coordinator import rpc
+from vent.coordinator import ipc, rpc
+
+SERVER_MAINS = {
+    'xmlrpc': rpc.rpc_server_main,
+    'ipc': ipc.ipc_server_main,
+}
+"""
+Entry point of the control process, for each transport between coordinator and controller.
+"""
+
+# Seconds between two checkpoints taken by the watchdog
+CHECKPOINT_INTERVAL = 0.5
+
+# Seconds to wait for a new control process to be ready
+STARTUP_TIMEOUT = 30.
+
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+"""
+How control processes are started, see :mod:`multiprocessing`. A fork server has the modules of the control process
+imported once, and forks new control processes from that clean state, not from the coordinator with its threads
+(and Qt, in the GUI).
+"""
+
+PRELOAD_MODULES = ['numpy', 'vent.controller.control_module', 'vent.coordinator.ipc', 'vent.coordinator.rpc',
+                   'vent.coordinator.subscription']
+"""
+Modules imported by the fork server
+"""
 
 
 class ProcessManager:
+    """
+    Runs the control process, and restarts it if it stalls or dies.
+
+    A new control process sends a message through a pipe once its server listens, until then,
+    :meth:`.wait_until_ready` blocks.
+
+    Once :meth:`.watch` is called, a watchdog thread polls a liveness counter of the control process, every fifth of
+    ``max_heartbeat_interval``. If the process died, or the counter didn't advance for ``max_heartbeat_interval``
+    while the controller should be running, the process is restarted, and warm-started from the last checkpoint:
+    a dict with the ``controls``, ``active_alarms`` and ``logged_alarms`` of the controller, and whether it was
+    ``running``. A checkpoint is taken every :data:`CHECKPOINT_INTERVAL` while the process is alive, and when
+    :meth:`.save_checkpoint` is called.
+
+    Attributes:
+        restarts (list): (time of the restart, seconds from the restart until the new process ticked) of each
+            restart by the watchdog of a running controller
+        startup_time (float): Seconds from starting the last control process until it was ready
+    """
+
     # Functions:
-    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None):
+    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None, transport='xmlrpc', sample_ring_name=None):
+        """
+        Args:
+            maxHeartbeatInterval (float): Seconds without a heartbeat after which the watchdog restarts the process
+        """
+        if transport not in SERVER_MAINS:
+            raise ValueError(f'Unknown transport {transport}, expected one of {tuple(SERVER_MAINS)}')
         self.sim_mode = sim_mode
+        self.server_main = SERVER_MAINS[transport]
+        self.server_kwargs = {'sample_ring_name': sample_ring_name}
         self.command_line = None  # TODO: what is this?
-        self.max_heartbeat_interval = None
+        self.max_heartbeat_interval = maxHeartbeatInterval
         self.previous_timestamp = None
+        self.checkpoint = None
+        self.restarts = []
+        self.startup_time = None
+        self._context = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == 'forkserver':
+            self._context.set_forkserver_preload(PRELOAD_MODULES)
+        self._ready = None
+        self._start_time = None
+        self._liveness = None
+        self._take_checkpoint = None
+        self._watchdog = None
+        self._stop_watchdog = threading.Event()
         # TODO: if child process exists, need to reconnect it
-        self.child_process = multiprocessing.Process(target=rpc.rpc_server_main, args=(self.sim_mode,))
+        self.child_process = None
         # TODO: when master process die, child process should survive
+        self._spawn(daemon=False)
+
+    def _spawn(self, daemon):
+        self._start_time = time.monotonic()
+        self._ready, ready = self._context.Pipe(duplex=False)
+        self.child_process = self._context.Process(target=self.server_main, args=(self.sim_mode,), daemon=daemon,
+                                                   kwargs=dict(self.server_kwargs, checkpoint=self.checkpoint, ready=ready))
         self.child_process.start()
+        # only the child writes to the pipe
+        ready.close()
         self.child_pid = self.child_process.pid
 
     def start_process(self):
         if self.child_process is not None:
             # Child process already started
             return
-        self.child_process = multiprocessing.Process(target=rpc.rpc_server_main, args=(self.sim_mode,))
-        self.child_process.daemon = True
-        self.child_process.start()
-        self.child_pid = self.child_process.pid
+        self._spawn(daemon=True)
+
+    def wait_until_ready(self, timeout=STARTUP_TIMEOUT):
+        """
+        Block until the control process listens for requests.
+
+        Raises:
+            RuntimeError: if the process exits, or isn't ready within ``timeout`` seconds
+        """
+        if self._ready is None:
+            return
+        try:
+            if not self._ready.poll(timeout):
+                raise RuntimeError(f'Control process not ready after {timeout} s')
+            self._ready.recv()
+        except EOFError:
+            raise RuntimeError(f'Control process exited with {self.child_process.exitcode} before it was ready')
+        self.startup_time = time.monotonic() - self._start_time
+        self._ready.close()
+        self._ready = None
 
     def stop_process(self):
+        """
+        Kill the control process, and stop the watchdog, which would restart it
+        """
+        self._stop_watchdog.set()
+        self._kill_process()
+
+    def _kill_process(self):
         if self.child_process is not None:
             # print(f'kill process {self.child_pid}')
             self.child_process.kill()
@@ -36,11 +135,89 @@ class ProcessManager:
             self.child_pid = None
 
     def restart_process(self):
+        """
+        Kill the control process, and start a new one, warm-started from the last checkpoint if any
+        """
         if self.child_process is not None:
-            self.stop_process()
+            self._kill_process()
         self.start_process()
 
     def heartbeat(self, timestamp):
-        # TODO: if no heartbeat in maxInterval restart
-        pass
+        """
+        Record that the control process was alive at ``timestamp`` (:func:`time.monotonic`), called by the watchdog
+        """
+        self.previous_timestamp = timestamp
+
+    def watch(self, liveness, checkpoint):
+        """
+        Start the watchdog.
+
+        Args:
+            liveness (callable): returns a counter that advances with every iteration of the control loop
+            checkpoint (callable): returns a checkpoint of the control process, as described above, or raises
+                if it can't be reached
+        """
+        if self.max_heartbeat_interval is None:
+            raise ValueError('The watchdog needs a max_heartbeat_interval')
+        self._liveness = liveness
+        self._take_checkpoint = checkpoint
+        self._stop_watchdog.clear()
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+            # in a thread of their own, so that the watchdog isn't held up when the process stalls during a checkpoint
+            threading.Thread(target=self._checkpoints, daemon=True).start()
+
+    def save_checkpoint(self):
+        """
+        Take a checkpoint now, eg. right after the settings changed. Ignored if the control process can't be reached.
+        """
+        if self._take_checkpoint is None:
+            return
+        try:
+            self.checkpoint = self._take_checkpoint()
+        except Exception:
+            pass
+
+    def _poll_liveness(self):
+        try:
+            return self._liveness()
+        except Exception:
+            # the control process can't be reached
+            return None
+
+    def _watch(self):
+        poll_interval = self.max_heartbeat_interval / 5
+        count = self._poll_liveness()
+        self.heartbeat(time.monotonic())
+        while not self._stop_watchdog.wait(poll_interval):
+            now = time.monotonic()
+            previous_count, count = count, self._poll_liveness()
+            if count != previous_count:
+                self.heartbeat(now)
+                continue
+
+            alive = self.child_process is not None and self.child_process.is_alive()
+            should_run = self.checkpoint is not None and self.checkpoint['running']
+            if alive and not (should_run and now - self.previous_timestamp > self.max_heartbeat_interval):
+                continue
+
+            # stalled or died
+            self.restart_process()
+            try:
+                self.wait_until_ready()
+            except RuntimeError:
+                # restarted again at the next poll
+                continue
+            if should_run:
+                restart_count = count
+                while count == restart_count and not self._stop_watchdog.wait(poll_interval / 10):
+                    count = self._poll_liveness()
+                self.restarts.append((now, time.monotonic() - now))
+            self.heartbeat(time.monotonic())
 
+    def _checkpoints(self):
+        while not self._stop_watchdog.wait(CHECKPOINT_INTERVAL):
+            # only while the process is alive, a stalled one would hold this up
+            if self.previous_timestamp is not None and time.monotonic() - self.previous_timestamp < CHECKPOINT_INTERVAL:
+                self.save_checkpoint()
@@ -1,17 +1,24 @@
+import http.client
 import pickle
+import socketserver
+import threading
 import xmlrpc.client
-from xmlrpc.server import SimpleXMLRPCServer
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 
 import vent.controller.control_module
+from vent.common.sample_ring import SampleRing
 
 default_addr = 'localhost'
 default_port = 9533
 
+# Seconds a client may take to send a request or to read the response, before the server drops its connection
+CLIENT_TIMEOUT = 5.
+
 remote_controller = None
 
 
-def get_sensors():
-    res = remote_controller.get_sensors()
+def get_sensors(since_loop_counter=None, since_timestamp=None):
+    res = remote_controller.get_sensors(since_loop_counter, since_timestamp)
     return pickle.dumps(res)
 
 
@@ -36,25 +43,139 @@ def get_control(control_setting_name):
     return pickle.dumps(res)
 
 
-def rpc_server_main(sim_mode, addr=default_addr, port=default_port):
+def get_loop_stats():
+    res = remote_controller.get_loop_stats()
+    return pickle.dumps(res)
+
+
+def get_state(since_version):
+    res = remote_controller.get_state(since_version)
+    return pickle.dumps(res)
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    # HTTP/1.1 keeps the connection of a client open between calls, a connection that stalls or idles for
+    # CLIENT_TIMEOUT is closed (and reopened by the client on its next call)
+    protocol_version = 'HTTP/1.1'
+    timeout = CLIENT_TIMEOUT
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except OSError:
+            # timed out within a request, or the client hung up
+            self.close_connection = True
+
+
+class _ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    # One thread per connection, so that a slow client doesn't hold up the others.
+    # The control loop runs in its own thread, and the controller only hands out snapshots, without taking its lock.
+    daemon_threads = True
+
+
+def rpc_server_main(sim_mode, addr=default_addr, port=default_port, sample_ring_name=None, checkpoint=None, ready=None):
     global remote_controller
     if addr != default_addr:
         raise NotImplementedError
     if port != default_port:
         raise NotImplementedError
     remote_controller = vent.controller.control_module.get_control_module(sim_mode)
-    server = SimpleXMLRPCServer((addr, port), allow_none=True, logRequests=False)
+    if sample_ring_name is not None:
+        remote_controller.set_sample_ring(SampleRing.attach(sample_ring_name))
+    if checkpoint is not None:
+        # warm start, see ProcessManager
+        remote_controller.restore(checkpoint['controls'], checkpoint['active_alarms'], checkpoint['logged_alarms'])
+        if checkpoint['running']:
+            remote_controller.start()
+    server = _ThreadedXMLRPCServer((addr, port), requestHandler=_RequestHandler, allow_none=True, logRequests=False)
     server.register_function(get_sensors, "get_sensors")
     server.register_function(get_active_alarms, "get_active_alarms")
     server.register_function(get_logged_alarms, "get_logged_alarms")
     server.register_function(set_control, "set_control")
     server.register_function(get_control, "get_control")
+    server.register_function(get_loop_stats, "get_loop_stats")
+    server.register_function(get_state, "get_state")
     server.register_function(remote_controller.start, "start")
     server.register_function(remote_controller.is_running, "is_running")
     server.register_function(remote_controller.stop, "stop")
+    # imported here, it needs the codecs of vent.coordinator.ipc
+    from vent.coordinator.subscription import start_subscription_server
+    start_subscription_server(remote_controller)
+    if ready is not None:
+        # tell the ProcessManager that requests can come in
+        ready.send(True)
+        ready.close()
     server.serve_forever()
 
 
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class RPCClient:
+    """
+    Client side of the XML-RPC transport, unpickles the responses of the server functions above.
+
+    Has the same interface as :class:`~vent.coordinator.ipc.IPCClient`. Calls are thread-safe, and reuse one
+    connection to the control process. A call that fails because the connection was lost, eg. because the control
+    process was restarted, is retried once on a new connection.
+    """
+
+    def __init__(self, addr=default_addr, port=default_port, timeout=CLIENT_TIMEOUT):
+        """
+        Args:
+            timeout (float): Seconds to wait for a response before raising :class:`socket.timeout`
+        """
+        self.proxy = xmlrpc.client.ServerProxy(f"http://{addr}:{port}/", transport=_TimeoutTransport(timeout),
+                                               allow_none=True)
+        self._lock = threading.Lock()
+
+    def _call(self, name, *args):
+        with self._lock:
+            try:
+                return getattr(self.proxy, name)(*args)
+            except (ConnectionError, http.client.HTTPException):
+                # closes the connection, the next request opens a new one
+                self.proxy('close')()
+                return getattr(self.proxy, name)(*args)
+
+    def get_sensors(self, since_loop_counter=None, since_timestamp=None):
+        return pickle.loads(self._call('get_sensors', since_loop_counter, since_timestamp).data)
+
+    def get_active_alarms(self):
+        return pickle.loads(self._call('get_active_alarms').data)
+
+    def get_logged_alarms(self):
+        return pickle.loads(self._call('get_logged_alarms').data)
+
+    def set_control(self, control_setting):
+        self._call('set_control', pickle.dumps(control_setting))
+
+    def get_control(self, control_setting_name):
+        return pickle.loads(self._call('get_control', pickle.dumps(control_setting_name)).data)
+
+    def get_loop_stats(self):
+        return pickle.loads(self._call('get_loop_stats').data)
+
+    def get_state(self, since_version=None):
+        return pickle.loads(self._call('get_state', since_version).data)
+
+    def start(self):
+        self._call('start')
+
+    def is_running(self):
+        return self._call('is_running')
+
+    def stop(self):
+        self._call('stop')
+
+
 def get_rpc_client():
-    proxy = xmlrpc.client.ServerProxy(f"http://{default_addr}:{default_port}/")
-    return proxy
\ No newline at end of file
+    return RPCClient()
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Push subscriptions from the control process, over a Unix domain socket.
+
+The control process runs :func:`start_subscription_server`, an asyncio server next to the RPC server. A client
+sends one ``SUBSCRIBE`` message per topic, with a decimation, and the server answers with the id of the
+subscription, or with an ``ERROR`` and its message if it can't subscribe. Answers come in the order of the requests.
+From then on, every message the controller publishes on the topic (see
+:data:`~vent.controller.publisher.TOPICS`) is pushed to the client as an ``EVENT``, until it unsubscribes or hangs up.
+
+Messages use the framing and the binary layouts of :mod:`vent.coordinator.ipc`. Events start with the
+subscription id (uint32), followed by the message: sensor values, an alarm and a control setting in their
+binary layouts, breath summaries as JSON.
+
+If a client doesn't keep up with reading, events are dropped for it rather than queued without bound. A client
+whose connection is lost, when the control process is restarted, connects again and subscribes again by itself.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from vent.common.message import SensorValues, ControlSetting, Alarm
+from vent.controller.publisher import TOPICS
+from vent.coordinator import ipc
+
+default_path = os.path.join(tempfile.gettempdir(), 'vent_subscriptions.sock')
+
+# Opcodes
+SUBSCRIBE = 20
+UNSUBSCRIBE = 21
+SUBSCRIBED = 22
+EVENT = 23
+ERROR = 24
+
+# Events are dropped for a client when this many bytes are waiting to be sent to it
+MAX_PENDING_BYTES = 1 << 20
+
+# Seconds between attempts of a client to connect again, after it lost its connection
+RECONNECT_INTERVAL = 0.1
+
+_SUBSCRIBE_STRUCT = struct.Struct('<BI')
+_ID_STRUCT = struct.Struct('<I')
+
+_ENCODERS = {
+    'sensors': SensorValues.to_bytes,
+    'breath': lambda breath: json.dumps(breath).encode('utf-8'),
+    'alarms': Alarm.to_bytes,
+    'controls': ControlSetting.to_bytes,
+}
+
+_DECODERS = {
+    'sensors': SensorValues.from_bytes,
+    'breath': lambda data: json.loads(bytes(data).decode('utf-8')),
+    'alarms': Alarm.from_bytes,
+    'controls': ControlSetting.from_bytes,
+}
+
+
+class _Forwarder:
+    # Subscriber callback of one client subscription, called in the dispatcher thread of the controller's publisher.
+    # Encodes the message, and hands it to the event loop to be sent.
+    def __init__(self, loop, send):
+        self.loop = loop
+        self.send = send
+        self.prefix = None   # subscription id, set once subscribed
+
+    def __call__(self, topic, message):
+        if self.prefix is not None:
+            self.loop.call_soon_threadsafe(self.send, ipc.pack_message(EVENT, self.prefix + _ENCODERS[topic](message)))
+
+
+async def _serve_client(controller, reader, writer):
+    loop = asyncio.get_running_loop()
+    transport = writer.transport
+    subscriptions = []
+
+    def send(message):
+        # in the event loop
+        if not transport.is_closing() and transport.get_write_buffer_size() < MAX_PENDING_BYTES:
+            transport.write(message)
+
+    try:
+        while True:
+            length, opcode = ipc.unpack_header(await reader.readexactly(ipc.HEADER_SIZE))
+            payload = await reader.readexactly(length) if length else b''
+            if opcode == SUBSCRIBE:
+                topic_index, decimation = _SUBSCRIBE_STRUCT.unpack(payload)
+                forwarder = _Forwarder(loop, send)
+                try:
+                    subscription_id = controller.subscribe(TOPICS[topic_index], forwarder, decimation)
+                except (IndexError, ValueError) as e:
+                    send(ipc.pack_message(ERROR, f'{type(e).__name__}: {e}'.encode('utf-8')))
+                    continue
+                forwarder.prefix = _ID_STRUCT.pack(subscription_id)
+                subscriptions.append(subscription_id)
+                send(ipc.pack_message(SUBSCRIBED, forwarder.prefix))
+            elif opcode == UNSUBSCRIBE:
+                subscription_id, = _ID_STRUCT.unpack(payload)
+                if subscription_id in subscriptions:
+                    controller.unsubscribe(subscription_id)
+                    subscriptions.remove(subscription_id)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        for subscription_id in subscriptions:
+            controller.unsubscribe(subscription_id)
+        writer.close()
+
+
+def start_subscription_server(controller, path=default_path) -> threading.Thread:
+    """
+    Serve subscriptions to the topics of ``controller`` on the Unix socket at ``path``, from an asyncio event loop
+    in a daemon thread.
+
+    Returns:
+        :class:`threading.Thread`: the thread running the event loop
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    started = threading.Event()
+
+    async def serve():
+        server = await asyncio.start_unix_server(lambda r, w: _serve_client(controller, r, w), path=path)
+        started.set()
+        async with server:
+            await server.serve_forever()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    started.wait()
+    return thread
+
+
+class _Subscription:
+    # A subscription of the client, which outlives the connections it is made on
+    def __init__(self, subscription_id, topic, callback, decimation):
+        self.id = subscription_id
+        self.topic = topic
+        self.callback = callback
+        self.decimation = decimation
+        # id given by the server on the current connection, None until it answered
+        self.server_id = None
+        # answer to the first request, waited for by subscribe()
+        self.answer = queue.SimpleQueue()
+        self.waiting = True
+
+    def request(self) -> bytes:
+        return _SUBSCRIBE_STRUCT.pack(TOPICS.index(self.topic), self.decimation)
+
+    def put_answer(self, answer):
+        # only while subscribe() waits, the requests made again on new connections are not waited for
+        if self.waiting:
+            self.waiting = False
+            self.answer.put(answer)
+
+
+class SubscriptionClient:
+    """
+    Subscribes to topics of the control process. Callbacks are called in a reader thread of the client.
+
+    If the connection is lost, eg. because the control process was restarted, the reader thread connects again, and
+    subscribes again to every topic, so that events resume once the new process publishes. Subscription ids stay the
+    same. Events published while disconnected are lost.
+    """
+
+    def __init__(self, path=default_path, timeout=5.):
+        """
+        Args:
+            path (str): Path of the Unix socket of the subscription server
+            timeout (float): Seconds to wait for the server to confirm a subscription
+        """
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._pid = None
+        self._closed = False
+        self._ids = itertools.count(1)
+        # by the id returned to the subscriber, and by the id given by the server on the current connection
+        self._subscriptions = {}
+        self._by_server_id = {}
+        # requests waiting for their answer on the current connection, oldest first
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        # writes to the socket, also by the reader thread
+        self._send_lock = threading.Lock()
+        # between an answer coming in, and the subscription being given up or unsubscribed
+        self._answer_lock = threading.Lock()
+        self._thread = None
+
+    def _open(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _connect(self):
+        self._sock = self._open()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._read, args=(self._sock,), daemon=True)
+        self._thread.start()
+
+    def _read(self, sock):
+        while sock is not None:
+            try:
+                while True:
+                    opcode, payload = ipc.recv_message(sock)
+                    if opcode == EVENT:
+                        server_id, = _ID_STRUCT.unpack_from(payload)
+                        subscription = self._by_server_id.get(server_id)
+                        if subscription is not None:
+                            subscription.callback(subscription.topic,
+                                                  _DECODERS[subscription.topic](memoryview(payload)[_ID_STRUCT.size:]))
+                    elif opcode in (SUBSCRIBED, ERROR) and self._pending:
+                        self._answer(self._pending.popleft(), opcode, payload)
+            except OSError:
+                pass
+            sock = self._reconnect(sock)
+
+    def _reconnect(self, sock):
+        # in the reader thread, once the connection is lost, until connected again or closed
+        sock.close()
+        while True:
+            with self._lock:
+                if self._closed:
+                    return None
+                # answers that won't come, the subscriptions are requested again on the new connection
+                self._pending.clear()
+                self._by_server_id.clear()
+                for subscription in self._subscriptions.values():
+                    subscription.server_id = None
+                try:
+                    self._sock = self._open()
+                    self._pid = os.getpid()
+                    for subscription in list(self._subscriptions.values()):
+                        self._pending.append(subscription)
+                        self._send(SUBSCRIBE, subscription.request())
+                    return self._sock
+                except OSError:
+                    if self._sock is not None:
+                        self._sock.close()
+            time.sleep(RECONNECT_INTERVAL)
+
+    def _answer(self, subscription, opcode, payload):
+        with self._answer_lock:
+            if opcode == ERROR:
+                self._subscriptions.pop(subscription.id, None)
+                subscription.put_answer(RuntimeError(bytes(payload).decode('utf-8')))
+            elif subscription.id not in self._subscriptions:
+                # given up on, or unsubscribed, while the request was on its way
+                self._send(UNSUBSCRIBE, payload)
+            else:
+                # before the next message is read, which may already be an event of the subscription
+                subscription.server_id, = _ID_STRUCT.unpack(payload)
+                self._by_server_id[subscription.server_id] = subscription
+                subscription.put_answer(subscription.id)
+
+    def _send(self, opcode, payload):
+        with self._send_lock:
+            ipc.send_message(self._sock, opcode, payload)
+
+    def subscribe(self, topic, callback, decimation=1) -> int:
+        """
+        Args:
+            topic (str): one of :data:`~vent.controller.publisher.TOPICS`
+            callback (callable): called as ``callback(topic, message)``
+            decimation (int): only receive every ``decimation`` th message
+
+        Returns:
+            int: id of the subscription, for :meth:`.unsubscribe`
+        """
+        if topic not in TOPICS:
+            raise ValueError(f'Unknown topic {topic}, expected one of {TOPICS}')
+        if int(decimation) < 1:
+            raise ValueError('decimation must be at least 1')
+        with self._lock:
+            if self._closed:
+                raise ConnectionError('Subscription client closed')
+            if self._sock is None:
+                self._connect()
+            subscription = _Subscription(next(self._ids), topic, callback, int(decimation))
+            self._subscriptions[subscription.id] = subscription
+            # in the order of the requests, which the server answers in
+            self._pending.append(subscription)
+            try:
+                self._send(SUBSCRIBE, subscription.request())
+            except OSError:
+                # the connection was lost, the reader thread requests it again on the new one
+                pass
+
+        try:
+            answer = subscription.answer.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._answer_lock:
+                if subscription.answer.empty():
+                    # unsubscribed by the reader thread if the answer still comes in
+                    subscription.waiting = False
+                    self._subscriptions.pop(subscription.id, None)
+                    raise TimeoutError(f'No answer to the subscription to {topic} after {self.timeout} s')
+            answer = subscription.answer.get()
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def unsubscribe(self, subscription_id):
+        with self._lock, self._answer_lock:
+            subscription = self._subscriptions.pop(subscription_id, None)
+            if subscription is None or subscription.server_id is None:
+                return
+            self._by_server_id.pop(subscription.server_id, None)
+            try:
+                self._send(UNSUBSCRIBE, _ID_STRUCT.pack(subscription.server_id))
+            except OSError:
+                # not requested again on the next connection
+                pass
+
+    def close(self):
+        with self._lock, self._answer_lock:
+            self._closed = True
+            if self._sock is not None:
+                if os.getpid() == self._pid:
+                    # the socket is shared with processes forked since, only hang up in this one
+                    try:
+                        self._sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                self._sock.close()
+                self._sock = None
+            for subscription in self._pending:
+                subscription.put_answer(ConnectionError('Subscription client closed'))
+            self._pending.clear()
+            self._subscriptions.clear()
+            self._by_server_id.clear()
@@ -4,7 +4,6 @@
 
 # python standard libraries
 import os
-from PySide2 import QtGui
 
 
 ########################
@@ -56,6 +55,9 @@ def load_mono_font():
         Must be called after :class:`PySide2.QtWidgets.QApplication` is instantiated!
 
     """
+    # imported here, so vent.gui.styles can be used without loading Qt
+    from PySide2 import QtGui
+
     try:
         # first try to load fira code for monospace font
         external_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'external')
@@ -0,0 +1,180 @@
+"""
+Acquisition of sensor values from the coordinator, in a :class:`PySide2.QtCore.QThread` of its own.
+
+With a :class:`~vent.coordinator.coordinator.CoordinatorRemote`, every call is a round trip to the control process,
+which blocks until it answers, or until the transport times out. Made from the Qt main thread, any hiccup of the
+control process would freeze touch input and rendering. :class:`.Acquisition` makes these calls instead, keeps the
+latest sensor values, and hands them to the widgets with queued signals, so the main thread never waits for the
+control process.
+"""
+import logging
+import time
+
+from PySide2 import QtCore
+
+from vent.coordinator.rpc import CLIENT_TIMEOUT
+
+
+class Acquisition(QtCore.QObject):
+    """
+    Polls the sensor values of the coordinator every ``update_period``, and passes on control settings to it,
+    from its own thread.
+
+    Only the values that changed since the last poll are requested (see
+    :meth:`.CoordinatorBase.get_sensors <vent.coordinator.coordinator.CoordinatorBase.get_sensors>`), and merged into
+    :attr:`.sensors`. :attr:`.sensors_updated` is only emitted when the controller published new values, and
+    :attr:`.heartbeat` along with it, so a widget connected to it, like :class:`~vent.gui.widgets.status_bar.HeartBeat`,
+    shows the values as stale when the controller stalls or stops, whatever state this thread is in.
+
+    The samples of every iteration of the control loop since the last poll, if the coordinator can read them
+    (see :meth:`.CoordinatorBase.get_samples <vent.coordinator.coordinator.CoordinatorBase.get_samples>`), are emitted
+    in one batch with :attr:`.samples_updated`.
+
+    Attributes:
+        sensors (dict): The latest :class:`~vent.common.message.SensorValueNew` by
+            :class:`~vent.common.values.ValueName`, replaced, not modified, with each update
+        last_update (float): :func:`time.time` of the last update of :attr:`.sensors`, None before the first
+        samples_supported (bool): Whether the coordinator gives the samples of the control loop
+    """
+
+    sensors_updated = QtCore.Signal(object)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with :attr:`.sensors` when new values were received
+    """
+
+    heartbeat = QtCore.Signal(float)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with :func:`time.time` when new values were received
+    """
+
+    samples_updated = QtCore.Signal(object)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with the new samples of the control loop, a :class:`numpy.ndarray` of
+    :data:`~vent.common.sample_ring.SAMPLE_DTYPE` records
+    """
+
+    error = QtCore.Signal(str)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with the error when a call to the coordinator failed or timed out
+    """
+
+    _update_period_changed = QtCore.Signal(float)
+
+    def __init__(self, coordinator, update_period=0.1):
+        """
+        Args:
+            coordinator (:class:`~vent.coordinator.coordinator.CoordinatorBase`)
+            update_period (float): Seconds between polls of the sensor values
+        """
+        super(Acquisition, self).__init__()
+        self.coordinator = coordinator
+        self._update_period = update_period
+        self.sensors = {}
+        self.last_update = None
+        self._loop_counter = None
+        self._timestamp = None
+        self._sample_count = None
+        self._timer = None
+
+        # known before the thread starts, so that the GUI knows where to plot from. Reading the samples doesn't
+        # consume them, the first poll gets all those in the ring.
+        try:
+            self.samples_supported = coordinator.get_samples() is not None
+        except NotImplementedError:
+            self.samples_supported = False
+
+        self.acquisition_thread = QtCore.QThread()
+        self.moveToThread(self.acquisition_thread)
+        self.acquisition_thread.started.connect(self._start_timer)
+        self._update_period_changed.connect(self._set_interval)
+
+    @property
+    def update_period(self) -> float:
+        return self._update_period
+
+    @update_period.setter
+    def update_period(self, update_period):
+        self._update_period = update_period
+        # the timer can only be changed from its own thread
+        self._update_period_changed.emit(update_period)
+
+    def start(self):
+        """ Start polling, in :attr:`.acquisition_thread` """
+        self.acquisition_thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the thread, waiting up to ``timeout`` seconds for a call to the coordinator to return
+        (``None``: as long as a call can block, the timeout of the clients of the control process)
+
+        Returns:
+            bool: Whether the thread stopped. If not, it must not be destroyed while still running.
+        """
+        if timeout is None:
+            timeout = max(CLIENT_TIMEOUT, self.update_period) + 1
+        self.acquisition_thread.quit()
+        stopped = self.acquisition_thread.wait(round(timeout * 1000))
+        if not stopped:
+            logging.getLogger(__name__).warning(f'Acquisition thread still running {timeout} s after being stopped')
+        return stopped
+
+    @QtCore.Slot()
+    def _start_timer(self):
+        # created in the acquisition thread, so that its timeouts are handled there
+        self._timer = QtCore.QTimer()
+        self._timer.timeout.connect(self.poll)
+        self.acquisition_thread.finished.connect(self._timer.stop)
+        self._timer.start(round(self._update_period * 1000))
+
+    @QtCore.Slot(float)
+    def _set_interval(self, update_period):
+        if self._timer is not None:
+            self._timer.setInterval(round(update_period * 1000))
+
+    @QtCore.Slot()
+    def poll(self):
+        """
+        Get the sensor values that changed since the last poll, and emit all of them if any did,
+        and the samples of the control loop since the last poll
+        """
+        if self.samples_supported:
+            self.poll_samples()
+
+        try:
+            changed = self.coordinator.get_sensors(since_loop_counter=self._loop_counter,
+                                                   since_timestamp=self._timestamp)
+        except Exception as e:
+            self.error.emit(f'{type(e).__name__}: {e}')
+            return
+        if not changed:
+            return
+
+        sensors = dict(self.sensors)
+        sensors.update(changed)
+        self.sensors = sensors
+        latest = next(iter(changed.values()))
+        self._loop_counter, self._timestamp = latest.loop_counter, latest.timestamp
+        self.last_update = time.time()
+        self.sensors_updated.emit(sensors)
+        self.heartbeat.emit(self.last_update)
+
+    def poll_samples(self):
+        try:
+            samples, self._sample_count = self.coordinator.get_samples(since=self._sample_count)
+        except Exception as e:
+            self.error.emit(f'{type(e).__name__}: {e}')
+            return
+        if len(samples):
+            # a view of the ring, which the controller keeps writing to
+            self.samples_updated.emit(samples.copy())
+
+    @QtCore.Slot(object)
+    def set_control(self, control_setting):
+        """
+        Args:
+            control_setting (:class:`~vent.common.message.ControlSetting`): passed on to the coordinator
+        """
+        try:
+            self.coordinator.set_control(control_setting)
+        except Exception as e:
+            self.error.emit(f'{type(e).__name__}: {e}')
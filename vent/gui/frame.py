@@ -0,0 +1,93 @@
+"""
+One clock for all visual updates of the GUI.
+
+Widgets don't redraw when new data comes in, they only mark themselves dirty with :meth:`.FrameClock.mark_dirty`.
+At every frame, :data:`FRAME_RATE` times per second, :class:`.FrameClock` calls the render function of each item that
+was marked since the previous frame, once, however often its data changed in between. Items that need to change
+with time alone, like the uptime of :class:`~vent.gui.widgets.status_bar.HeartBeat`, connect to
+:attr:`.FrameClock.frame` instead.
+
+Use the clock of the GUI, from :func:`get_frame_clock`.
+"""
+import time
+
+from PySide2 import QtCore
+
+FRAME_RATE = 20
+"""
+Frames per second of the :class:`.FrameClock` returned by :func:`get_frame_clock`
+"""
+
+
+class FrameClock(QtCore.QObject):
+    """
+    A :class:`~PySide2.QtCore.QTimer` at ``fps``, that calls the render functions of dirty items at each timeout.
+
+    Render functions are called in the order they were marked dirty. An item marked dirty while rendering, eg. a
+    curve whose data was set by the render function of its plot, is rendered in the same frame.
+
+    Attributes:
+        timer (:class:`~PySide2.QtCore.QTimer`)
+    """
+
+    frame = QtCore.Signal(float)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with :func:`time.time` at every frame, after the dirty items were rendered
+    """
+
+    def __init__(self, fps=FRAME_RATE):
+        super(FrameClock, self).__init__()
+        self._dirty = {}
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self._render)
+        self._fps = None
+        self.fps = fps
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @fps.setter
+    def fps(self, fps):
+        self._fps = float(fps)
+        self.timer.setInterval(round(1000. / self._fps))
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def mark_dirty(self, render):
+        """
+        Args:
+            render (callable): called without arguments at the next frame, once however often it was marked
+        """
+        self._dirty[render] = None
+
+    def _render(self):
+        # items still dirty after a few passes, eg. one that marks itself, wait for the next frame
+        for _ in range(3):
+            if not self._dirty:
+                break
+            dirty, self._dirty = self._dirty, {}
+            for render in dirty:
+                render()
+        self.frame.emit(time.time())
+
+
+_FRAME_CLOCK = None
+
+
+def get_frame_clock() -> FrameClock:
+    """
+    The :class:`.FrameClock` shared by all widgets, created and started on first use.
+
+    .. note::
+
+        Must be called after :class:`PySide2.QtWidgets.QApplication` is instantiated!
+    """
+    if globals()['_FRAME_CLOCK'] is None:
+        globals()['_FRAME_CLOCK'] = FrameClock()
+        globals()['_FRAME_CLOCK'].start()
+    return globals()['_FRAME_CLOCK']
@@ -0,0 +1,251 @@
+"""
+History of a plotted value, from the last seconds up to hours, at a bounded cost per redraw.
+
+:class:`.History` keeps the recent samples as they are, and coarser and coarser summaries of older ones: tiers
+of bins, each ``factor`` times wider than the previous one, with the min, max and mean of the samples in each
+bin. :meth:`.History.window` picks the finest level that still reaches back far enough, and merges neighbouring
+bins until at most ``max_points`` are left, so a plot of an hour draws as many points as a plot of seconds.
+
+Only uses numpy, so it can be used without Qt.
+"""
+import numpy as np
+
+
+class Ring:
+    """
+    Preallocated ring of rows, whose first column is a time that increases with every row appended.
+
+    Once full, the oldest rows are overwritten. The rows are then two sorted runs, the older one from the write index
+    to the end, and the newer one before it, so rows after a time are found with :func:`numpy.searchsorted`
+    on each run, and only those rows are copied.
+    """
+
+    def __init__(self, capacity, n_columns):
+        self._data = np.full((int(capacity), n_columns), np.nan)
+        self._write_index = 0
+        self._full = False
+
+    @property
+    def capacity(self) -> int:
+        return self._data.shape[0]
+
+    def append(self, row):
+        self._data[self._write_index] = row
+        self._write_index += 1
+        if self._write_index == self._data.shape[0]:
+            self._write_index = 0
+            self._full = True
+
+    def extend(self, rows):
+        """ Append several rows at once, oldest first """
+        capacity = self._data.shape[0]
+        rows = np.asarray(rows)
+        if len(rows) >= capacity:
+            self._data[:] = rows[len(rows) - capacity:]
+            self._write_index = 0
+            self._full = True
+            return
+        # up to the end of the ring, and the rest from its start
+        end = min(self._write_index + len(rows), capacity)
+        n_end = end - self._write_index
+        self._data[self._write_index:end] = rows[:n_end]
+        self._data[:len(rows) - n_end] = rows[n_end:]
+        self._write_index += len(rows)
+        if self._write_index >= capacity:
+            self._write_index -= capacity
+            self._full = True
+
+    def __len__(self):
+        return self._data.shape[0] if self._full else self._write_index
+
+    def covers(self, start) -> bool:
+        """ Whether no row after ``start`` was overwritten yet """
+        return not self._full or self._data[self._write_index, 0] <= start
+
+    def chronological(self) -> np.ndarray:
+        """ All rows, oldest first (a copy) """
+        if not self._full:
+            return self._data[:self._write_index].copy()
+        return np.concatenate((self._data[self._write_index:], self._data[:self._write_index]))
+
+    def _start(self, start):
+        # (run, index) of the first row later than start, run 0 the newer run, 1 the older one
+        index = np.searchsorted(self._data[:self._write_index, 0], start, side='right')
+        if not self._full or index > 0:
+            return 0, index
+        return 1, self._write_index + np.searchsorted(self._data[self._write_index:, 0], start, side='right')
+
+    def count_since(self, start) -> int:
+        """ Number of rows later than ``start`` """
+        run, index = self._start(start)
+        if run == 0:
+            return self._write_index - index
+        return self._data.shape[0] - index + self._write_index
+
+    def since(self, start) -> np.ndarray:
+        """ Rows later than ``start``, oldest first """
+        run, index = self._start(start)
+        if run == 0:
+            return self._data[index:self._write_index]
+        return np.concatenate((self._data[index:], self._data[:self._write_index]))
+
+
+class History:
+    """
+    Samples of one value, and min/max/mean pyramids of them.
+
+    :attr:`.raw` holds the last ``raw_size`` samples. ``tiers[k]`` holds bins of ``bin_width * factor ** k`` seconds,
+    aligned to multiples of their width so that every bin of a tier is made of ``factor`` bins of the tier below.
+    A bin is closed, and added to its tier and the next one, once a sample after it comes in, so appending costs a few
+    scalar operations, and rarely a few more. Samples that are None or NaN are only kept in :attr:`.raw`.
+
+    Attributes:
+        raw (:class:`.Ring`): time, value of the last samples
+        tiers (list): :class:`.Ring` of bins, with their start time, min, max and mean, finest first
+        widths (list): bin width of each tier, in seconds
+        latest (float): timestamp of the last sample
+    """
+
+    def __init__(self, raw_size=4092, bin_width=0.05, factor=4, n_tiers=5, tier_size=4096):
+        """
+        Args:
+            raw_size (int): Number of samples kept as they are
+            bin_width (float): Width of the bins of the first tier, in seconds
+            factor (int): Ratio between the bin widths of two consecutive tiers
+            n_tiers (int): Number of tiers of bins
+            tier_size (int): Number of bins kept per tier. The last tier reaches back
+                ``tier_size * bin_width * factor ** (n_tiers - 1)`` seconds, 3.6 hours by default.
+        """
+        self.raw = Ring(raw_size, 2)
+        self.factor = int(factor)
+        self.widths = [bin_width * self.factor ** k for k in range(n_tiers)]
+        # time (start of the bin), min, max, mean
+        self.tiers = [Ring(tier_size, 4) for _ in range(n_tiers)]
+        # the bin of each tier that is being filled: [index, min, max, sum, count], or None.
+        # Bins are numbered from 0 at time 0 in each tier, bin i of a tier is made of bins i * factor ... of the one
+        # below, in integers, so that rounding doesn't misalign the tiers.
+        self._open = [None] * n_tiers
+        self.latest = None
+
+    def append(self, timestamp, value):
+        """
+        Args:
+            timestamp (float): later than the timestamps appended before
+            value (float): None for a missing value
+        """
+        if value is None:
+            value = np.nan
+        self.raw.append((timestamp, value))
+        self.latest = timestamp
+        if value == value:
+            self._add(0, int(timestamp // self.widths[0]), value, value, value, 1)
+
+    def extend(self, timestamps, values):
+        """
+        Append a batch of samples, as :meth:`.append` on each would.
+
+        The samples are binned with array operations, and only the bins, a few per batch, are added one by one.
+
+        Args:
+            timestamps (:class:`numpy.ndarray`): increasing, later than the timestamps appended before
+            values (:class:`numpy.ndarray`): NaN for missing values
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if len(timestamps) == 0:
+            return
+        self.raw.extend(np.column_stack((timestamps, values)))
+        self.latest = timestamps[-1]
+
+        valid = values == values
+        if not valid.all():
+            timestamps, values = timestamps[valid], values[valid]
+        if len(values) == 0:
+            return
+        index = (timestamps // self.widths[0]).astype(np.int64)
+        first = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+        counts = np.diff(np.append(first, len(values)))
+        for bin_index, low, high, total, count in zip(index[first].tolist(),
+                                                      np.minimum.reduceat(values, first).tolist(),
+                                                      np.maximum.reduceat(values, first).tolist(),
+                                                      np.add.reduceat(values, first).tolist(),
+                                                      counts.tolist()):
+            self._add(0, bin_index, low, high, total, count)
+
+    def _add(self, tier, index, low, high, total, count):
+        # add samples to bin index of tier
+        current = self._open[tier]
+        if current is not None and index != current[0]:
+            self._close(tier, current)
+            current = None
+        if current is None:
+            self._open[tier] = [index, low, high, total, count]
+            return
+        if low < current[1]:
+            current[1] = low
+        if high > current[2]:
+            current[2] = high
+        current[3] += total
+        current[4] += count
+
+    def _close(self, tier, current):
+        index, low, high, total, count = current
+        self.tiers[tier].append((index * self.widths[tier], low, high, total / count))
+        if tier + 1 < len(self.tiers):
+            self._add(tier + 1, index // self.factor, low, high, total, count)
+
+    def _bins_since(self, tier, start) -> np.ndarray:
+        # closed bins that start after start, and the open one
+        width = self.widths[tier]
+        bins = self.tiers[tier].since(start)
+        current = self._open[tier]
+        if current is not None and current[0] * width > start:
+            bins = np.concatenate((bins, [(current[0] * width, current[1], current[2], current[3] / current[4])]))
+        return bins
+
+    def window(self, start, max_points, envelope=True):
+        """
+        The history after ``start``, in at most ``max_points`` points.
+
+        The samples themselves if there are few enough of them, otherwise bins of the finest tier that reaches back
+        to ``start``, merged in groups so that they fit.
+
+        Args:
+            start (float): time from which on the history is returned
+            max_points (int): eg. twice the width of the plot in pixels
+            envelope (bool): For bins, two points each, at the start and the middle of the bin, with the min and the max
+                of the bin, which draws as the envelope of the samples. Otherwise one point per bin, with its mean.
+                Only bins that start after ``start`` are returned.
+
+        Returns:
+            tuple: timestamps, values, as :class:`numpy.ndarray` s
+        """
+        if self.raw.covers(start) and self.raw.count_since(start) <= max_points:
+            samples = self.raw.since(start)
+            return samples[:, 0], samples[:, 1]
+
+        tier = next((k for k, ring in enumerate(self.tiers) if ring.covers(start)), len(self.tiers) - 1)
+        bins = self._bins_since(tier, start)
+        width = self.widths[tier]
+        points_per_bin = 2 if envelope else 1
+        group = -(-points_per_bin * len(bins) // max(int(max_points), points_per_bin))
+        if group > 1:
+            # merge groups of neighbouring bins, the mean of a group is the mean of the means of its bins
+            first = np.arange(0, len(bins), group)
+            counts = np.diff(np.append(first, len(bins)))
+            bins = np.column_stack((bins[first, 0],
+                                    np.minimum.reduceat(bins[:, 1], first),
+                                    np.maximum.reduceat(bins[:, 2], first),
+                                    np.add.reduceat(bins[:, 3], first) / counts))
+            width *= group
+
+        if not envelope:
+            return bins[:, 0], bins[:, 3]
+        timestamps = np.empty(2 * len(bins))
+        timestamps[0::2] = bins[:, 0]
+        # not beyond the latest sample, for the bins that are still being filled
+        timestamps[1::2] = np.minimum(bins[:, 0] + width / 2, self.latest)
+        values = np.empty(2 * len(bins))
+        values[0::2] = bins[:, 1]
+        values[1::2] = bins[:, 2]
+        return timestamps, values
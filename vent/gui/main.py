@@ -6,6 +6,8 @@ from PySide2 import QtWidgets, QtCore
 from vent.common.message import ControlSetting
 from vent.common.values import ValueName
 from vent.gui import widgets, set_gui_instance, get_gui_instance, styles
+from vent.gui.acquisition import Acquisition
+from vent.gui.frame import get_frame_clock, FRAME_RATE
 from vent.common import values
 
 
@@ -59,6 +61,12 @@ class Vent_Gui(QtWidgets.QMainWindow):
     :class:`PySide2.QtCore.Signal` emitted when the GUI is closing.
     """
 
+    control_requested = QtCore.Signal(object)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with a :class:`~vent.common.message.ControlSetting` to be set,
+    by :attr:`.acquisition` in its thread.
+    """
+
     MONITOR = values.MONITOR
     """
     see :data:`.gui.defaults.MONITOR`
@@ -74,6 +82,17 @@ class Vent_Gui(QtWidgets.QMainWindow):
     see :data:`.gui.defaults.PLOTS`
     """
 
+    SAMPLE_PLOTS = {
+        'pressure': lambda samples: samples['pressure'],
+        'flow': lambda samples: samples['Qin'] - samples['Qout'],
+        'volume': lambda samples: samples['volume'],
+    }
+    """
+    :data:`.PLOTS` keys plotted from the samples of every iteration of the control loop, when the coordinator gives
+    them, rather than from the sensor values of each poll, with a function of the
+    :data:`~vent.common.sample_ring.SAMPLE_DTYPE` records that returns the values to plot
+    """
+
     display_width = 2
     plot_width = 2
     control_width = 2
@@ -89,21 +108,24 @@ class Vent_Gui(QtWidgets.QMainWindow):
     computed from ``status_height+main_height``
     """
 
-    def __init__(self, coordinator, update_period = 0.1, test=False):
+    def __init__(self, coordinator, update_period = 0.1, test=False, stale_timeout = 1., fps = FRAME_RATE):
         """
 
         Attributes:
+            acquisition (:class:`~vent.gui.acquisition.Acquisition`): Talks to the coordinator from its own thread
             monitor (dict): Dictionary mapping :data:`.default.MONITOR` keys to :class:`.widgets.Monitor_Value` objects
             plots (dict): Dictionary mapping :data:`.default.PLOT` keys to :class:`.widgets.Plot` objects
             controls (dict): Dictionary mapping :data:`.default.CONTROL` keys to :class:`.widgets.Control` objects
             start_time (float): Start time as returned by :func:`time.time`
-            update_period (float): The global delay between redraws of the GUI (seconds)
+            update_period (float): The global delay between polls of the sensor values (seconds)
 
 
 
         Arguments:
-            update_period (float): The global delay between redraws of the GUI (seconds)
+            update_period (float): The global delay between polls of the sensor values (seconds)
             test (bool): Whether the monitored values and plots should be fed sine waves for visual testing.
+            stale_timeout (float): Seconds without new sensor values after which the status bar shows them as stale
+            fps (float): Frames per second of the :class:`~vent.gui.frame.FrameClock` that redraws the widgets
 
 
         """
@@ -121,27 +143,33 @@ class Vent_Gui(QtWidgets.QMainWindow):
         self.control_settings = {}
 
         self.coordinator = coordinator
-        self.control_module = self.coordinator.control_module
-
-        # start QTimer to update values
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.update_gui)
-        # stop QTimer when program closing
-        self.gui_closing.connect(self.timer.stop)
-        # start the timer
-
-        # set update period (after timer is created!!)
+        self.stale_timeout = stale_timeout
+
+        # the coordinator is only called from the acquisition thread, new values come back as queued signals
+        self.acquisition = Acquisition(coordinator, update_period)
+        self.acquisition.sensors_updated.connect(self.update_gui)
+        self.acquisition.samples_updated.connect(self.update_samples)
+        self.acquisition.error.connect(self.acquisition_error)
+        self.control_requested.connect(self.acquisition.set_control)
+        # stop acquiring when program closing
+        self.gui_closing.connect(self.acquisition.stop)
+
+        # widgets only redraw at frames, when their values changed
+        get_frame_clock().fps = fps
+        self.gui_closing.connect(get_frame_clock().stop)
+
+        # set update period (after acquisition is created!!)
         self._update_period = None
         self.update_period = update_period
 
-        # initialize controls to starting values
+        # initialize controls to starting values, sent once the acquisition thread runs
         self.init_controls()
 
 
         self.init_ui()
         self.start_time = time.time()
 
-        self.timer.start(self.update_period*1000)
+        self.acquisition.start()
 
     @property
     def update_period(self):
@@ -152,9 +180,8 @@ class Vent_Gui(QtWidgets.QMainWindow):
         assert(isinstance(update_period, float) or isinstance(update_period, int))
 
         if update_period != self._update_period:
-            # if the timer is active, stop it and restart with new period
-            if self.timer.isActive():
-                self.timer.setInterval(update_period*1000)
+            # poll at the new period
+            self.acquisition.update_period = update_period
 
             # store new value
             self._update_period = update_period
@@ -172,36 +199,64 @@ class Vent_Gui(QtWidgets.QMainWindow):
 
     def set_value(self, new_value, value_name=None):
         """
-        set value in the test thread
+        set value in the acquisition thread
+
+        Arguments:
+            new_value (float)
+            value_name (:class:`~vent.common.values.ValueName`, str): or its name, by default the object name of the
+                :class:`.widgets.Control` that sent the new value
         """
         # get sender ID
         if value_name is None:
             value_name = self.sender().objectName()
+        if isinstance(value_name, str):
+            value_name = ValueName[value_name]
 
 
-        control_object = ControlSetting(name=getattr(ValueName, value_name),
+        control_object = ControlSetting(name=value_name,
                                         value=new_value,
                                         min_value = self.CONTROL[value_name]['safe_range'][0],
                                         max_value = self.CONTROL[value_name]['safe_range'][1],
                                         timestamp = time.time())
-        self.coordinator.set_control(control_object)
-
-
-    def update_gui(self):
+        self.control_requested.emit(control_object)
 
-        vals = self.coordinator.get_sensors()
-        #pdb.set_trace()
-
-        # for monitor_key, monitor_obj in self.monitor.items():
-        #     if hasattr(vals, monitor_key):
-        #         monitor_obj.update_value(getattr(vals, monitor_key))
+    @QtCore.Slot(object)
+    def update_gui(self, sensors):
+        """
+        Arguments:
+            sensors (dict): :class:`~vent.common.message.SensorValueNew` by :class:`~vent.common.values.ValueName`,
+                as emitted by :attr:`.Acquisition.sensors_updated <vent.gui.acquisition.Acquisition.sensors_updated>`
+        """
+        for monitor_key, monitor_obj in self.monitor.items():
+            sensor_value = sensors.get(monitor_key)
+            if sensor_value is not None and sensor_value.value is not None:
+                monitor_obj.update_value(sensor_value.value)
 
         for plot_key, plot_obj in self.plots.items():
-            if hasattr(vals, plot_key):
-                plot_obj.update_value((time.time(), getattr(vals, plot_key)))
+            if self.acquisition.samples_supported and plot_key in self.SAMPLE_PLOTS:
+                # plotted by update_samples
+                continue
+            sensor_value = sensors.get(ValueName[plot_key.upper()])
+            if sensor_value is not None:
+                plot_obj.update_value((time.time(), sensor_value.value))
+
+    @QtCore.Slot(object)
+    def update_samples(self, samples):
+        """
+        Arguments:
+            samples (:class:`numpy.ndarray`): :data:`~vent.common.sample_ring.SAMPLE_DTYPE` records, as emitted by
+                :attr:`.Acquisition.samples_updated <vent.gui.acquisition.Acquisition.samples_updated>`
+        """
+        for plot_key, plot_obj in self.plots.items():
+            if plot_key in self.SAMPLE_PLOTS:
+                plot_obj.extend(samples['timestamp'], self.SAMPLE_PLOTS[plot_key](samples))
 
-        #
-        # QtCore.QTimer.singleShot(1, self.read_sensors)
+    @QtCore.Slot(str)
+    def acquisition_error(self, error):
+        """
+        Show a call to the coordinator that failed in the status bar
+        """
+        self.status_bar.log_console.update_message(('acquisition', 'warning', error))
 
 
 
@@ -246,6 +301,9 @@ class Vent_Gui(QtWidgets.QMainWindow):
         ##########
         # Status Bar
         self.status_bar = widgets.Status_Bar()
+        # the status indicator turns to alarm when no new sensor values arrived for stale_timeout
+        self.status_bar.heartbeat.timeout_dur = self.stale_timeout * 1000
+        self.acquisition.heartbeat.connect(self.status_bar.heartbeat.beatheart)
         self.layout.addWidget(self.status_bar, self.status_height)
 
         #########
@@ -300,8 +358,8 @@ class Vent_Gui(QtWidgets.QMainWindow):
 
         # connect displays to plots
         # FIXME: Link in gui.defaults
-        self.monitor['vte'].limits_changed.connect(self.plots['pressure'].set_safe_limits)
-        self.plots['pressure'].limits_changed.connect(self.monitor['vte'].update_limits)
+        self.monitor[ValueName.VTE].limits_changed.connect(self.plots['pressure'].set_safe_limits)
+        self.plots['pressure'].limits_changed.connect(self.monitor[ValueName.VTE].update_limits)
 
 
         ####################
@@ -310,7 +368,7 @@ class Vent_Gui(QtWidgets.QMainWindow):
         self.controls_layout = QtWidgets.QVBoxLayout()
         for control_name, control_params in self.CONTROL.items():
             self.controls[control_name] = widgets.Control(control_params)
-            self.controls[control_name].setObjectName(control_name)
+            self.controls[control_name].setObjectName(control_name.name)
             self.controls[control_name].value_changed.connect(self.set_value)
             self.controls_layout.addWidget(self.controls[control_name])
             self.controls_layout.addWidget(widgets.components.QHLine())
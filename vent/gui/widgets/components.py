@@ -59,6 +59,10 @@ class RangeSlider(QtWidgets.QSlider):
     With code from https://stackoverflow.com/a/54819051
     for labels!
 
+    The groove, handles and labels only change when the range or the size of the slider do, so they are rendered
+    once into a :class:`~PySide2.QtGui.QPixmap`, and each repaint for a new indicator value only draws the indicator
+    and that pixmap. The slider is only repainted when the indicator moves by at least a pixel.
+
     """
 
     valueChanged = QtCore.Signal(tuple)
@@ -108,6 +112,10 @@ class RangeSlider(QtWidgets.QSlider):
         # indicator
         self._indicator = 0
 
+        # groove, handles and labels, and what they were rendered for
+        self._static_pixmap = None
+        self._static_key = None
+
 
     @property
     def low(self):
@@ -140,8 +148,18 @@ class RangeSlider(QtWidgets.QSlider):
         elif new_val < self.minimum():
             new_val = self.minimum()
 
+        old_position = self._indicator_position()
         self._indicator = new_val
-        self.update()
+        if self._indicator_position() != old_position:
+            self.update()
+
+    def _indicator_position(self):
+        # y of the top of the indicator, in pixels, None when it isn't drawn
+        if self._indicator == 0:
+            return None
+        # as opt.upsideDown from initStyleOption, for a vertical slider
+        return QtWidgets.QStyle.sliderPositionFromValue(self.minimum(),
+                self.maximum(), self._indicator, self.height(), not self.invertedAppearance())
 
     @property
     def alarm(self):
@@ -149,29 +167,19 @@ class RangeSlider(QtWidgets.QSlider):
 
     @alarm.setter
     def alarm(self, alarm):
-        self._alarm = alarm
-        self.update()
+        if alarm != self._alarm:
+            self._alarm = alarm
+            self.update()
 
 
     def paintEvent(self, event):
         # based on http://qt.gitorious.org/qt/qt/blobs/master/src/gui/widgets/qslider.cpp
 
         painter = QtGui.QPainter(self)
-        #style = QtWidgets.QApplication.style()
-        style = self.style()
 
         ### Draw current value indicator
-        if self._indicator != 0:
-            opt = QtWidgets.QStyleOptionSlider()
-            self.initStyleOption(opt)
-            length = style.pixelMetric(QtWidgets.QStyle.PM_SliderLength, opt, self)
-            available = style.pixelMetric(QtWidgets.QStyle.PM_SliderSpaceAvailable, opt, self)
-
-
-            y_loc= QtWidgets.QStyle.sliderPositionFromValue(self.minimum(),
-                    self.maximum(), self._indicator, self.height(), opt.upsideDown)
-
-
+        y_loc = self._indicator_position()
+        if y_loc is not None:
             # draw indicator first, so underneath max and min
             indicator_color = QtGui.QColor(0,0,0)
             if not self.alarm:
@@ -188,6 +196,30 @@ class RangeSlider(QtWidgets.QSlider):
 
             painter.setPen(pen_bak)
 
+        painter.drawPixmap(0, 0, self._static())
+
+    def _static(self):
+        """
+        The groove, handles and labels, rendered again only when the range, the handle being pressed or hovered,
+        or the size of the slider changed since the last time.
+
+        Returns:
+            :class:`~PySide2.QtGui.QPixmap`, transparent where nothing was drawn, so the indicator shows underneath
+        """
+        key = (self.width(), self.height(), self.devicePixelRatioF(), self._low, self._high,
+               self.pressed_control, self.hover_control, self.isEnabled())
+        if key == self._static_key:
+            return self._static_pixmap
+
+        ratio = self.devicePixelRatioF()
+        pixmap = QtGui.QPixmap(round(self.width() * ratio), round(self.height() * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(QtCore.Qt.transparent)
+
+        painter = QtGui.QPainter(pixmap)
+        #style = QtWidgets.QApplication.style()
+        style = self.style()
+
         for i, value in enumerate([self._high, self._low]):
             opt = QtWidgets.QStyleOptionSlider()
             self.initStyleOption(opt)
@@ -242,8 +274,13 @@ class RangeSlider(QtWidgets.QSlider):
             pos=QtCore.QPoint(left, bottom)
             painter.drawText(pos, label_str)
 
+        painter.end()
+
         self.setTickInterval(self.levels[1]-self.levels[0])
 
+        self._static_pixmap = pixmap
+        self._static_key = key
+        return pixmap
 
 
 
@@ -2,10 +2,18 @@ import numpy as np
 from PySide2 import QtWidgets, QtCore
 
 from vent.gui import styles, mono_font
+from vent.gui.frame import get_frame_clock
 from vent.gui.widgets.components import RangeSlider
 
 
 class Monitor_Value(QtWidgets.QWidget):
+    """
+    Displays a value, its limits in a :class:`.RangeSlider`, and whether it is out of them.
+
+    Values come in faster than they can be seen, and mostly render the same as the previous one, so the text and
+    alarm style last set on the Qt widgets are kept, and the widgets are only touched when they change. Setting a
+    style sheet in particular makes Qt re-polish the label.
+    """
     alarm = QtCore.Signal()
     limits_changed = QtCore.Signal(tuple)
 
@@ -14,7 +22,8 @@ class Monitor_Value(QtWidgets.QWidget):
 
         Args:
             value (:class:`~vent.values.Value`):
-            update_period (float): update period of monitor in s
+            update_period (float): update period of monitor in s, unused: the value is drawn at the next frame of
+                the :class:`~vent.gui.frame.FrameClock`
         """
         super(Monitor_Value, self).__init__()
 
@@ -27,9 +36,11 @@ class Monitor_Value(QtWidgets.QWidget):
 
         self.value = None
 
-        self.init_ui()
+        # what the widgets show, to only update them when it changes
+        self._value_str = None
+        self._alarm_state = False
 
-        self.timed_update()
+        self.init_ui()
 
     def init_ui(self):
         self.layout = QtWidgets.QHBoxLayout()
@@ -118,8 +129,7 @@ class Monitor_Value(QtWidgets.QWidget):
 
         self.value = new_value
         self.check_alarm()
-        new_value = np.clip(new_value, self.abs_range[0], self.abs_range[1])
-        self.range_slider.update_indicator(new_value)
+        get_frame_clock().mark_dirty(self.timed_update)
 
     @QtCore.Slot(tuple)
     def update_limits(self, new_limits):
@@ -128,12 +138,20 @@ class Monitor_Value(QtWidgets.QWidget):
         self.update_boxes(new_limits)
 
     def timed_update(self):
+        # at the frame after the value changed
+        if self.value is None:
+            # eg. no sensor value yet before the first breath
+            return
+
         # format value based on decimals
         if self.value:
             value_str = str(np.round(self.value, self.decimals))
-            self.value_label.setText(value_str)
+            if value_str != self._value_str:
+                self.value_label.setText(value_str)
+                self._value_str = value_str
 
-        QtCore.QTimer.singleShot(round(self.update_period*1000), self.timed_update)
+        # only repaints if the indicator moved
+        self.range_slider.update_indicator(np.clip(self.value, self.abs_range[0], self.abs_range[1]))
 
     def _limits_changed(self, val):
         # ignore value, just emit changes and check alarm
@@ -144,8 +162,13 @@ class Monitor_Value(QtWidgets.QWidget):
         if self.value:
             if (self.value >= self.max_safe.value()) or (self.value <= self.min_safe.value()):
                 self.alarm.emit()
-                self.value_label.setStyleSheet(styles.DISPLAY_VALUE_ALARM)
-                self.range_slider.alarm = True
+                self._set_alarm_state(True)
             else:
-                self.value_label.setStyleSheet(styles.DISPLAY_VALUE)
-                self.range_slider.alarm = False
\ No newline at end of file
+                self._set_alarm_state(False)
+
+    def _set_alarm_state(self, alarm):
+        if alarm == self._alarm_state:
+            return
+        self._alarm_state = alarm
+        self.value_label.setStyleSheet(styles.DISPLAY_VALUE_ALARM if alarm else styles.DISPLAY_VALUE)
+        self.range_slider.alarm = alarm
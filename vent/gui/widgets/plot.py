@@ -1,5 +1,4 @@
 import time
-from collections import deque
 
 import numpy as np
 from PySide2 import QtCore
@@ -9,16 +8,12 @@ import pyqtgraph as pg
 
 from vent.gui import styles
 from vent.gui import mono_font
-from vent.gui import get_gui_instance
+from vent.gui.frame import get_frame_clock
+from vent.gui.history import History
 
-PLOT_TIMER = None
+MIN_PLOT_WIDTH = 640
 """
-A :class:`~PySide2.QtCore.QTimer` that updates :class:`.TimedPlotCurveItem`s
-"""
-
-PLOT_FREQ = 5
-"""
-Update frequency of :class:`.Plot` s in Hz
+Width in pixels a :class:`.Plot` draws points for at least, eg. before it is shown
 """
 
 
@@ -35,8 +30,8 @@ class Plot(pg.PlotWidget):
 
         super(Plot, self).__init__(background=styles.BACKGROUND_COLOR,
                                    title=titlestr)
-        self.timestamps = deque(maxlen=buffer_size)
-        self.history = deque(maxlen=buffer_size)
+        # the last buffer_size values, and min/max pyramids of older ones for long plot durations
+        self._history = History(raw_size=buffer_size)
         # TODO: Make @property to update buffer_size, preserving history
         self.plot_duration = plot_duration
 
@@ -72,6 +67,7 @@ class Plot(pg.PlotWidget):
         self.addItem(self.max_safe)
 
         if color:
+            color = styles.SUBWAY_COLORS.get(color, color)
             self.early_curve.setPen(color=color, width=3)
             self.late_curve.setPen(color=color, width=3)
 
@@ -81,10 +77,43 @@ class Plot(pg.PlotWidget):
         self.setXRange(0, self.plot_duration)
 
 
+    @property
+    def timestamps(self) -> np.ndarray:
+        """ Timestamps of the last ``buffer_size`` values, oldest first (a copy) """
+        return self._history.raw.chronological()[:, 0]
+
+    @property
+    def history(self) -> np.ndarray:
+        """ The last ``buffer_size`` values, oldest first (a copy) """
+        return self._history.raw.chronological()[:, 1]
+
+    def _max_points(self) -> int:
+        # twice the width of the plot in pixels, more points could not be told apart
+        return 2 * max(int(self.getPlotItem().getViewBox().width()), MIN_PLOT_WIDTH)
+
     def update_value(self, new_value):
         """
         new_value: (timestamp from time.time(), value)
+
+        Drawn at the next frame of the :class:`~vent.gui.frame.FrameClock`
+        """
+        self._history.append(new_value[0], new_value[1])
+        get_frame_clock().mark_dirty(self._render)
+
+    def extend(self, timestamps, values):
+        """
+        Add a batch of samples, eg. of every iteration of the control loop since the last poll.
+
+        Args:
+            timestamps (:class:`numpy.ndarray`): in seconds since the epoch, like :func:`time.time`
+            values (:class:`numpy.ndarray`)
+
+        Drawn at the next frame of the :class:`~vent.gui.frame.FrameClock`
         """
+        self._history.extend(timestamps, values)
+        get_frame_clock().mark_dirty(self._render)
+
+    def _render(self):
         try:
             this_time = time.time()
             #time_diff = this_time-self._last_time
@@ -93,32 +122,25 @@ class Plot(pg.PlotWidget):
             self.time_marker.setData([current_relative_time, current_relative_time],
                                      [limits[1][0], limits[1][1]])
 
-            self.timestamps.append(new_value[0])
-            self.history.append(new_value[1])
-
-            # filter values based on timestamps
-            ts_array = np.array(self.timestamps)
-            end_ind = len(self.history)
-            start_ind = np.where(ts_array > (this_time - self.plot_duration))[0][0]
+            # values within the last plot_duration, at most a few per pixel
+            timestamps, plot_values = self._history.window(this_time - self.plot_duration, self._max_points())
 
             # subtract start time and take modulus of duration to get wrapped timestamps
-            plot_timestamps = np.mod(ts_array[start_ind:end_ind]-self._start_time, self.plot_duration)
-            plot_values = np.array([self.history[i] for i in range(start_ind, end_ind)])
+            plot_timestamps = np.mod(timestamps - self._start_time, self.plot_duration)
 
-            # find the point where the time resets
-            try:
-                reset_ind = np.where(np.diff(plot_timestamps)<0)[0][0]
+            # the time resets once in the window, when the marker last passed 0: values before go on the right
+            reset_time = this_time - current_relative_time
+            reset_ind = np.searchsorted(timestamps, reset_time, side='left')
 
-                # plot early and late
-                self.early_curve.setData(plot_timestamps[0:reset_ind+1],plot_values[0:reset_ind+1] )
-                self.late_curve.setData(plot_timestamps[reset_ind+1:], plot_values[reset_ind+1:])
-
-            except IndexError:
-                self.early_curve.setData(plot_timestamps, plot_values)
+            # plot early and late
+            self.early_curve.setData(plot_timestamps[:reset_ind], plot_values[:reset_ind])
+            if reset_ind < timestamps.shape[0]:
+                self.late_curve.setData(plot_timestamps[reset_ind:], plot_values[reset_ind:])
+            else:
                 self.late_curve.clear()
         except:
             # FIXME: Log this lol
-            print('error with value: {}, timestamp: {}'.format(new_value[1], new_value[0]))
+            print('error plotting {} values'.format(len(self._history.raw)))
 
         #self._last_time = this_time
 
@@ -177,45 +199,14 @@ class TimedPlotDataItem(pg.PlotDataItem):
 
 class TimedPlotCurveItem(pg.PlotCurveItem):
     """
-    Subclass :class:`pyqtgraph.PlotCurveItem` to update with a fixed frequency instead of whenever new data pushed
-
-    Either creates or gets :data:`PLOT_TIMER` and connects it to :meth:`TimedPlotCurveItem.update`
+    Subclass :class:`pyqtgraph.PlotCurveItem` to update at the next frame of the :class:`~vent.gui.frame.FrameClock`
+    instead of whenever new data pushed
     """
 
-
-    def __init__(self, *args, **kwargs):
-        super(TimedPlotCurveItem, self).__init__(*args, **kwargs)
-
-        if globals()['PLOT_TIMER'] is None:
-            globals()['PLOT_TIMER'] = QtCore.QTimer()
-
-            get_gui_instance().gui_closing.connect(globals()['PLOT_TIMER'].stop)
-
-        self.timer = globals()['PLOT_TIMER']
-        # stop timer, add ourselves, restart
-        self.timer.timeout.connect(self.update)
-
-        try:
-            self.fps = float(globals()['PLOT_FREQ'])
-        except (ValueError, KeyError):
-            self.fps = 15.
-
-        self.timer.start(1./self.fps)
-
-
-
-    def __del__(self):
-        """
-        On object deletion, remove from :data:`.PLOT_TIMER` 's signals
-        """
-        #self.timer.disconnect(self.update)
-        #super(TimedPlotCurveItem, self).__del__()
-
-
     def updateData(self, *args, **kargs):
         """
-        Override :meth:`pyqtgraph.PlotCurveItem.updateData` to omit call to :meth:`.update`
-        which is done by :data:`.PLOT_TIMER`
+        Override :meth:`pyqtgraph.PlotCurveItem.updateData` to replace the call to :meth:`.update`
+        by marking the curve dirty with the :class:`~vent.gui.frame.FrameClock`
 
         """
         profiler = pg.debug.Profiler()
@@ -292,7 +283,7 @@ class TimedPlotCurveItem(pg.PlotCurveItem):
             self.opts['antialias'] = kargs['antialias']
 
         profiler('set')
-        #self.update()
+        get_frame_clock().mark_dirty(self.update)
         profiler('update')
         #self.sigPlotChanged.emit(self)
         profiler('emit')
@@ -5,7 +5,7 @@ import numpy as np
 from PySide2 import QtWidgets, QtCore
 
 from vent.gui import styles, mono_font
-from vent.gui import get_gui_instance
+from vent.gui.frame import get_frame_clock
 
 
 class Status_Bar(QtWidgets.QWidget):
@@ -217,7 +217,8 @@ class HeartBeat(QtWidgets.QFrame):
     def __init__(self, update_interval = 100, timeout_dur = 5000):
         """
         Args:
-            update_interval (int): How often to do the heartbeat, in ms
+            update_interval (int): How often to do the heartbeat, in ms, at most every frame of the
+                :class:`~vent.gui.frame.FrameClock`
             timeout (int): how long to wait before hearing from control process
         """
 
@@ -228,13 +229,10 @@ class HeartBeat(QtWidgets.QFrame):
         self.timeout_dur = timeout_dur
         self._state = False
         self._last_heartbeat = 0
+        self._last_update = 0
+        self._running = False
         self.init_ui()
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self._heartbeat)
-
-        get_gui_instance().gui_closing.connect(self.timer.stop)
-
     def init_ui(self):
 
         self.layout = QtWidgets.QGridLayout()
@@ -284,25 +282,32 @@ class HeartBeat(QtWidgets.QFrame):
         if update_interval:
             self.update_interval = update_interval
 
-        self.timer.start(self.update_interval)
+        if not self._running:
+            get_frame_clock().frame.connect(self._heartbeat)
+            self._running = True
 
     def stop_timer(self):
         """
         you can read the sign ya punk
         """
-        self.timer.stop()
-        self.setText("")
+        if self._running:
+            get_frame_clock().frame.disconnect(self._heartbeat)
+            self._running = False
+        self.timer_label.setText("")
 
     @QtCore.Slot(float)
     def beatheart(self, heartbeat_time):
         self._last_heartbeat = heartbeat_time
 
-    def _heartbeat(self):
+    @QtCore.Slot(float)
+    def _heartbeat(self, current_time):
         """
-        Called every (update_interval) milliseconds to set the text of the timer.
+        Called every frame, sets the text of the timer every (update_interval) milliseconds.
 
         """
-        current_time = time.time()
+        if current_time - self._last_update < self.update_interval / 1000:
+            return
+        self._last_update = current_time
         self.heartbeat.emit(current_time)
 
         secs_elapsed = current_time-self.start_time